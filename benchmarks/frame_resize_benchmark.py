@@ -0,0 +1,42 @@
+"""
+measure how long frame_resize.Resizer takes to resize a frame to a model's input size, for each method and resolution,
+in milliseconds per frame
+
+run from the repository root:
+    python -m benchmarks.frame_resize_benchmark --repeat 50
+"""
+import argparse
+import json
+import timeit
+
+import numpy
+
+import frame_resize
+
+RESOLUTIONS = {'480p': (480, 640), '720p': (720, 1280), '1080p': (1080, 1920)}
+SIZE = (300, 300)
+
+
+def benchmark(repeat, size=SIZE):
+    """ returns a dict of {resolution: {method: milliseconds per frame}} """
+    random = numpy.random.RandomState(0)
+    results = {}
+    for name, (height, width) in RESOLUTIONS.items():
+        frame = random.randint(0, 256, size=(height, width, 3)).astype(numpy.uint8)
+        results[name] = {}
+        for method in frame_resize.METHODS:
+            resizer = frame_resize.Resizer(size, method)
+            # the first call works out the lookups for the frame size, which are reused for every later frame
+            resizer(frame)
+            results[name][method] = round(timeit.timeit(lambda: resizer(frame), number=repeat) / repeat * 1000, 3)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark frame resizing")
+    parser.add_argument("--repeat", help="how many frames to resize for each resolution and method", type=int,
+                        default=50)
+    parser.add_argument("--size", help="the size to resize to as <width>x<height>", type=frame_resize.parse_size,
+                        default=SIZE)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.repeat, args.size), indent=2))
@@ -0,0 +1,91 @@
+"""
+compare building and serializing detection messages field by field, as detect_video_stream used to, against
+message_builder.MessageBuilder, in messages per second
+
+run from the repository root:
+    python -m benchmarks.message_builder_benchmark --repeat 200
+"""
+import argparse
+import json
+import timeit
+
+import numpy
+
+import detect_video_stream_utils
+import frame_encoding
+import message_builder
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+RESOLUTIONS = {'480p': (480, 640), '720p': (720, 1280)}
+ENCODINGS = (frame_encoding.FLOAT, frame_encoding.RAW, frame_encoding.NONE)
+INSTANCE_NAME = 'benchmark'
+SOURCE = '/videos/benchmark.mp4'
+START_TIMESTAMP = 1565000000.0
+FLOAT_MAP = {'frame_height': 720.0, 'frame_width': 1280.0}
+CATEGORY_INDEX = {class_id: {'id': class_id, 'name': f'class {class_id}'} for class_id in range(1, 91)}
+
+
+def field_by_field(frame_count, output_dict, frame, encoding):
+    """ build the message the way detect_video_stream did before MessageBuilder """
+    detection_boxes = detection_handler_pb2.float_array(numbers=output_dict['detection_boxes'].ravel(),
+                                                        shape=output_dict['detection_boxes'].shape)
+    category_index = detect_video_stream_utils.class_names_from_index(output_dict['detection_classes'],
+                                                                      CATEGORY_INDEX)
+    source = SOURCE
+    instance_name = INSTANCE_NAME
+    string_map = {'id': detect_video_stream_utils.create_detection_request_id(instance_name, source, frame_count)}
+    frame_numbers, frame_string_map = frame_encoding.encode_frame(frame, encoding)
+    string_map.update(frame_string_map)
+    return detection_handler_pb2.handle_detection_request(
+        start_timestamp=START_TIMESTAMP,
+        detection_classes=output_dict['detection_classes'].astype(numpy.float32),
+        detection_scores=output_dict['detection_scores'],
+        detection_boxes=detection_boxes,
+        instance_name=instance_name,
+        frame=detection_handler_pb2.float_array(**frame_numbers) if frame_numbers else None,
+        frame_count=frame_count,
+        source=source,
+        float_map=FLOAT_MAP,
+        category_index=category_index,
+        string_map=string_map).SerializeToString()
+
+
+def with_builder(builder):
+    def build(frame_count, output_dict, frame, encoding):
+        string_map = {'id': builder.request_id(frame_count)}
+        frame_numbers, frame_string_map = frame_encoding.encode_frame(frame, encoding)
+        string_map.update(frame_string_map)
+        return builder.build(frame_count, output_dict, string_map, frame_numbers)
+
+    return build
+
+
+def benchmark(repeat, detections=5):
+    """ returns a dict of {resolution: {encoding: {method: messages per second}}} """
+    random = numpy.random.RandomState(0)
+    output_dict = {'detection_scores': random.uniform(0.5, 1, detections).astype(numpy.float32),
+                   'detection_classes': random.randint(1, 91, detections).astype(numpy.int64),
+                   'detection_boxes': random.uniform(0, 1, (detections, 4)).astype(numpy.float32)}
+    methods = {'field_by_field': field_by_field,
+               'message_builder': with_builder(message_builder.MessageBuilder(
+                   INSTANCE_NAME, SOURCE, START_TIMESTAMP, FLOAT_MAP, CATEGORY_INDEX))}
+    results = {}
+    for name, (height, width) in RESOLUTIONS.items():
+        frame = random.randint(0, 256, size=(height, width, 3)).astype(numpy.uint8)
+        results[name] = {}
+        for encoding in ENCODINGS:
+            # float frames are slow to build field by field, fewer repeats keep the run short
+            number = max(1, repeat // 20) if encoding == frame_encoding.FLOAT else repeat
+            results[name][encoding] = {
+                method: round(number / timeit.timeit(lambda: build(7, output_dict, frame, encoding), number=number), 1)
+                for method, build in methods.items()}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark detection message building")
+    parser.add_argument("--repeat", help="how many messages to build for each resolution and encoding", type=int,
+                        default=100)
+    parser.add_argument("--detections", help="how many detections each message has", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.repeat, args.detections), indent=2))
@@ -0,0 +1,224 @@
+"""
+measure the throughput of detect_video_stream_tf_serving.py end to end without tensorflow serving or redis
+
+A fake PredictionService grpc server answers every request with samples/predict_response_01.bin after a
+configurable latency and messages are published to fake_services.FakeRedis. Synthetic videos are written for each
+resolution and run at each sample rate. The results are printed as json, with per stage times from the stream's
+metrics, the bytes published and the peak resident memory. Each run is in a process of its own, so its peak memory is
+its own and not the largest of the runs before it.
+
+run from the repository root:
+    python -m benchmarks.pipeline_benchmark --resolutions 480p,720p --sample-rates 1,5 --latency 0.02
+    python -m benchmarks.pipeline_benchmark --save-baseline benchmarks/pipeline_baseline.json
+    python -m benchmarks.pipeline_benchmark --baseline ''
+Arguments the benchmark does not know are passed on to detect_video_stream_tf_serving.py e.g. --frame-encoding jpeg
+The results are compared with benchmarks/pipeline_baseline.json, or the --baseline file. Only runs with the same
+configuration (frames, latency and stream arguments) as a baseline run are compared, see compare(). Runs that are
+slower or use more memory than the baseline by more than --tolerance are listed under 'regressions' and the exit
+status is 1 when the baseline was recorded on the same host, otherwise they are only listed under 'other_host'.
+"""
+import argparse
+from concurrent import futures
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import imageio
+import numpy
+
+import detect_video_stream_tf_serving as detect_video_stream
+import detect_video_stream_utils
+import fake_services
+from juu_object_detection_protos.api.generated.tensorflow_serving.apis import predict_pb2
+
+RESOLUTIONS = {'480p': (480, 640), '720p': (720, 1280), '1080p': (1080, 1920)}
+SAMPLE_RATES = (1, 5)
+FRAMES = 150
+FPS = 30
+# seconds tensorflow serving takes to answer
+LATENCY = 0.02
+# the fraction by which a run can be worse than the baseline before it is flagged
+TOLERANCE = 0.2
+SAMPLE_RESPONSE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'samples',
+                               'predict_response_01.bin')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline_baseline.json')
+MODEL_NAME = 'ssd_mobilenet_v1_coco'
+CHANNEL_NAME = 'predictions'
+
+
+def write_synthetic_video(path, height, width, frames=FRAMES, fps=FPS):
+    """ write a video of a square moving across a gradient, so consecutive frames differ """
+    gradient = numpy.linspace(0, 255, width, dtype=numpy.uint8)[numpy.newaxis, :, numpy.newaxis]
+    background = numpy.broadcast_to(gradient, (height, width, 3))
+    size = height // 4
+    with imageio.get_writer(path, fps=fps, macro_block_size=8) as writer:
+        for i in range(frames):
+            frame = background.copy()
+            left = i * (width - size) // max(frames - 1, 1)
+            frame[height // 3:height // 3 + size, left:left + size] = (255, 64, 0)
+            writer.append_data(frame)
+
+
+def write_label_map(path, classes=90):
+    """ write a label map with a made up name for each class id the sample response can contain """
+    with open(path, 'w') as f:
+        for class_id in range(1, classes + 1):
+            f.write(f"item {{\n  name: \"class_{class_id}\"\n  id: {class_id}\n  display_name: \"class {class_id}\"\n}}\n")
+
+
+def batch_responder(sample_response):
+    """
+    returns a function for fake_services.FakePredictionService that answers a request for a batch of frames with
+    the sample response repeated for each frame
+    """
+    response = predict_pb2.PredictResponse.FromString(sample_response)
+    responses = {1: sample_response}
+
+    def respond(request):
+        batch_size = predict_pb2.PredictRequest.FromString(request).inputs['inputs'].tensor_shape.dim[0].size
+        if batch_size not in responses:
+            batch_response = predict_pb2.PredictResponse()
+            batch_response.CopyFrom(response)
+            for key, tensor in response.outputs.items():
+                values = detect_video_stream_utils.tensor_proto_to_array(tensor)
+                batch_tensor = batch_response.outputs[key]
+                batch_tensor.Clear()
+                detect_video_stream_utils.fill_tensor_proto(batch_tensor, [values[0]] * batch_size)
+            responses[batch_size] = batch_response.SerializeToString()
+        return responses[batch_size]
+
+    return respond
+
+
+def peak_rss_mb():
+    """ the peak resident memory of this process so far in megabytes, see run_in_process() """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run(video_path, label_map_path, port, sample_rate, stream_args=()):
+    """ run detection on one video, returns the results as a dict """
+    parser = detect_video_stream.create_arg_parser()
+    args = parser.parse_args([video_path, label_map_path, str(port), MODEL_NAME, CHANNEL_NAME,
+                              '--samplerate', str(sample_rate), '--instance_name', 'benchmark',
+                              '--cutoff', '1'] + list(stream_args))
+    resources = detect_video_stream.StreamResources(args, fake_services.FakeRedis(keep_messages=False))
+    try:
+        start = time.perf_counter()
+        stats = detect_video_stream.detect_video_stream(args, resources)
+        seconds = time.perf_counter() - start
+    finally:
+        resources.close()
+    # the registry also holds the tensorflow serving endpoints' metrics, the stream's are found by its labels
+    stages = resources.metrics.stream_metrics({'source': video_path, 'instance': 'benchmark'}).summary()['stages']
+    return {'seconds': round(seconds, 3),
+            'fps': round(stats['read'] / seconds, 2),
+            'sampled_fps': round(stats['sampled'] / seconds, 2),
+            'published': stats['published'],
+            'bytes_published': stats['payload_bytes'],
+            'stages_ms': {stage: {name: round(value * 1000, 3) if name != 'count' and value is not None else value
+                                  for name, value in summary.items()}
+                          for stage, summary in stages.items()},
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def run_in_process(*args):
+    """ run() in a new process, so the peak memory it reports is for this run alone """
+    # spawned rather than forked, the child starts without the memory the parent already has
+    with futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run, *args).result()
+
+
+def benchmark(resolutions, sample_rates, frames=FRAMES, latency=LATENCY, stream_args=()):
+    """
+    returns a dict of {'<resolution>/samplerate=<rate>': results}, see run(), each with the 'config' it ran with
+    and the 'host' it ran on
+    """
+    config = {'frames': frames, 'latency': latency, 'stream_args': list(stream_args)}
+    with open(SAMPLE_RESPONSE, 'rb') as f:
+        service = fake_services.FakePredictionService(batch_responder(f.read()), latency)
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            label_map_path = os.path.join(directory, 'label_map.pbtxt')
+            write_label_map(label_map_path)
+            for resolution in resolutions:
+                video_path = os.path.join(directory, f'{resolution}.mp4')
+                write_synthetic_video(video_path, *RESOLUTIONS[resolution], frames=frames)
+                for sample_rate in sample_rates:
+                    result = run_in_process(video_path, label_map_path, service.port, sample_rate, stream_args)
+                    result.update(config=config, host=platform.node())
+                    results[f'{resolution}/samplerate={sample_rate}'] = result
+    finally:
+        service.close()
+    return results
+
+
+def find_regressions(results, baseline, tolerance=TOLERANCE):
+    """ returns a list of descriptions of the runs that are slower or use more memory than in the baseline """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        if result['fps'] < expected['fps'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['fps']} fps, baseline {expected['fps']} fps")
+        if result['peak_rss_mb'] > expected['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak rss {result['peak_rss_mb']} MB, baseline {expected['peak_rss_mb']} MB")
+    return regressions
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    compare the runs with the baseline runs of the same name and config
+
+    returns a dict of
+        'regressions': see find_regressions(), for baseline runs recorded on the same host
+        'other_host': the same for baseline runs recorded on another host, whose speed and memory may differ
+        'not_compared': the names of the runs the baseline has no run with the same config for
+    """
+    report = {'regressions': [], 'other_host': [], 'not_compared': []}
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None or expected.get('config') != result['config']:
+            report['not_compared'].append(name)
+            continue
+        found = find_regressions({name: result}, {name: expected}, tolerance)
+        report['regressions' if expected.get('host') == result['host'] else 'other_host'].extend(found)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark detection end to end against fake tensorflow serving "
+                                                 "and redis")
+    parser.add_argument("--resolutions", default=','.join(RESOLUTIONS),
+                        help=f"comma separated resolutions to run, from {list(RESOLUTIONS)}")
+    parser.add_argument("--sample-rates", default=','.join(str(rate) for rate in SAMPLE_RATES),
+                        help="comma separated sample rates to run each resolution at")
+    parser.add_argument("--frames", type=int, default=FRAMES, help="how many frames each synthetic video has")
+    parser.add_argument("--latency", type=float, default=LATENCY,
+                        help="seconds the fake tensorflow serving takes to answer each request")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="a json file of earlier results to compare with, an empty string to not compare")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="the fraction by which a run can be worse than the baseline")
+    parser.add_argument("--save-baseline", help="write the results to this json file")
+    args, stream_args = parser.parse_known_args()
+    results = benchmark(args.resolutions.split(','), [int(rate) for rate in args.sample_rates.split(',')],
+                        args.frames, args.latency, stream_args)
+    report = {'results': results}
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report.update(compare(results, json.load(f), args.tolerance))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
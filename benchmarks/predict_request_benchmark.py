@@ -0,0 +1,53 @@
+"""
+compare building a PredictRequest with tf.compat.v1.make_tensor_proto against detect_video_stream_utils.predict_request_builder
+
+run from the repository root:
+    python -m benchmarks.predict_request_benchmark --repeat 50
+"""
+import argparse
+import json
+import timeit
+
+import numpy
+
+import detect_video_stream_utils
+from juu_object_detection_protos.api.generated.tensorflow_serving.apis import predict_pb2, model_pb2
+
+RESOLUTIONS = {'720p': (720, 1280), '1080p': (1080, 1920), '4K': (2160, 3840)}
+MODEL_NAME = 'ssd_mobilenet_v1_coco'
+
+
+def make_tensor_proto_request(frames):
+    """ the original way of building a request, a new request and tensorflow's tensor conversion per frame """
+    import tensorflow as tf
+    return predict_pb2.PredictRequest(
+        model_spec=model_pb2.ModelSpec(name=MODEL_NAME),
+        inputs={'inputs': tf.compat.v1.make_tensor_proto(numpy.stack(frames))})
+
+
+def benchmark(repeat, batch_size):
+    """ returns a dict of {resolution: {method: milliseconds per request}} """
+    try:
+        import tensorflow
+        methods = {'make_tensor_proto': make_tensor_proto_request}
+    except ImportError:
+        methods = {}
+    methods['predict_request_builder'] = detect_video_stream_utils.predict_request_builder(
+        predict_pb2.PredictRequest(model_spec=model_pb2.ModelSpec(name=MODEL_NAME)))
+    results = {}
+    for name, (height, width) in RESOLUTIONS.items():
+        frames = [numpy.random.randint(0, 256, size=(height, width, 3)).astype(numpy.uint8) for _ in range(batch_size)]
+        results[name] = {}
+        for method, build in methods.items():
+            # serialization is included since the grpc stub serializes every request it sends
+            seconds = timeit.timeit(lambda: build(frames).SerializeToString(), number=repeat)
+            results[name][method] = round(seconds / repeat * 1000, 3)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark PredictRequest construction")
+    parser.add_argument("--repeat", help="how many requests to build for each resolution", type=int, default=20)
+    parser.add_argument("--batch-size", help="how many frames to place in each request", type=int, default=1)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.repeat, args.batch_size), indent=2))
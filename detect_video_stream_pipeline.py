@@ -0,0 +1,221 @@
+"""
+runs video detection as a pipeline of stages connected by bounded queues:
+
+    reader (decode + sample) -> predictor (batch + non blocking predict calls) -> publisher (filter, serialize, publish)
+
+decoding the next frames and publishing earlier results overlap with the round trip to tensorflow serving.
+Results leave the predictor in the order frames were read, so the output order per source is preserved.
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+
+# placed on a queue by a stage to tell the next stage that no more items are coming
+END_OF_STREAM = object()
+# how long the predictor waits for a new frame before checking on the requests it has in flight
+POLL_INTERVAL = 0.005
+INFLIGHT = 4
+QUEUE_SIZE = 16
+BATCH_SIZE = 1
+# seconds to wait for a batch to fill up
+BATCH_TIMEOUT = 0.05
+
+
+def read_frames(frames, frame_queue, stats, motion_gate=None, metrics=None):
+    """
+    decode frames and place every sampled frame on the frame queue
+
+    parameters:
+        frames: an iterable of (frame_count, frame) tuples where frame is None for frames that are not sampled
+            e.g. from video_sources.determine_sampled_frames()
+        frame_queue: receives (frame_count, frame) tuples
+        stats: a collections.Counter updated with 'read', 'sampled' and 'static' counts
+        motion_gate: an optional frame_sampling.MotionGate, sampled frames it finds static are not placed on the queue
+        metrics: optional metrics.StreamMetrics, the 'decode' stage is the time to read up to each sampled frame
+    """
+    read = 0
+    start = time.perf_counter()
+    for frame_count, frame in frames:
+        # counts add up when the same stats are used again e.g. after a restart
+        stats['read'] += frame_count + 1 - read
+        read = frame_count + 1
+        if frame is None:
+            continue
+        if metrics is not None:
+            metrics.observe('decode', time.perf_counter() - start)
+        if motion_gate is None or motion_gate.should_detect(frame):
+            frame_queue.put((frame_count, frame))
+            stats['sampled'] += 1
+        else:
+            stats['static'] += 1
+        start = time.perf_counter()
+
+
+def collect_batch(frame_queue, batch, batch_size, batch_timeout):
+    """
+    add frames from the frame queue to batch until it has batch_size frames or batch_timeout seconds pass
+    a frame whose shape differs from the batch's ends the batch, frames of one request must have the same shape
+    e.g. the images of a directory
+
+    returns a tuple of (True if END_OF_STREAM was received, the frame that ended the batch or None)
+    """
+    shape = getattr(batch[0][1], 'shape', None)
+    deadline = time.monotonic() + batch_timeout
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            item = frame_queue.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is END_OF_STREAM:
+            return True, None
+        if getattr(item[1], 'shape', None) != shape:
+            return False, item
+        batch.append(item)
+    return False, None
+
+
+def predict_frames(frame_queue, prediction_queue, predict_async, inflight=INFLIGHT, batch_size=BATCH_SIZE,
+                   batch_timeout=BATCH_TIMEOUT, split_prediction=None, metrics=None, cache=None):
+    """
+    start a prediction for each batch of frames without waiting for earlier ones to complete
+
+    parameters:
+        frame_queue: provides (frame_count, frame) tuples
+        prediction_queue: receives (frame_count, frame, prediction) tuples in the order frames were received
+        predict_async: a callable that takes a list of frames and returns a future
+            e.g. one wrapping tensorflow_serving_stub.Predict.future
+        inflight: the maximum number of batches that can be waiting on a response at any time
+        batch_size: the maximum number of frames sent in one prediction request
+        batch_timeout: seconds to wait for a batch to fill up before sending what is available
+        split_prediction: a callable taking the prediction for a batch and the number of frames in it and returning
+            a list with the prediction for each frame, if absent the prediction must already be such a list
+        metrics: optional metrics.StreamMetrics, the 'predict' stage is the time from sending a batch until its
+            prediction is taken from the future
+        cache: an optional object with get(frame_count) returning the prediction for a frame or None and
+            put(frame_count, prediction) e.g. a detection_cache.StreamCache, cached frames are not sent for prediction
+    """
+    # (batch, future or None if every frame was cached, start, the cached prediction of each frame or None)
+    pending = collections.deque()
+
+    def emit_oldest():
+        batch, future, start, cached = pending.popleft()
+        predicted = iter(())
+        if future is not None:
+            prediction = future.result()
+            if metrics is not None:
+                metrics.observe('predict', time.perf_counter() - start)
+            if split_prediction:
+                predicted_count = sum(1 for frame_prediction in cached if frame_prediction is None)
+                prediction = split_prediction(prediction, predicted_count)
+            predicted = iter(prediction)
+        for (frame_count, frame), frame_prediction in zip(batch, cached):
+            if frame_prediction is None:
+                frame_prediction = next(predicted)
+                if cache is not None:
+                    cache.put(frame_count, frame_prediction)
+            prediction_queue.put((frame_count, frame, frame_prediction))
+
+    finished = False
+    # a frame taken from the queue that starts the next batch
+    held = None
+    while not finished or held is not None:
+        # results are emitted oldest first, even if a later request completes earlier
+        while pending and (pending[0][1] is None or pending[0][1].done()):
+            emit_oldest()
+        if len(pending) >= inflight:
+            emit_oldest()
+            continue
+        if held is not None:
+            item, held = held, None
+        else:
+            try:
+                # with nothing in flight, there is nothing to do but wait for the next frame
+                item = frame_queue.get(timeout=POLL_INTERVAL if pending else None)
+            except queue.Empty:
+                continue
+            if item is END_OF_STREAM:
+                break
+        batch = [item]
+        if not finished:
+            finished, held = collect_batch(frame_queue, batch, batch_size, batch_timeout)
+        cached = [cache.get(frame_count) if cache is not None else None for frame_count, _ in batch]
+        frames = [frame for (_, frame), frame_prediction in zip(batch, cached) if frame_prediction is None]
+        start = time.perf_counter()
+        pending.append((batch, predict_async(frames) if frames else None, start, cached))
+    while pending:
+        emit_oldest()
+
+
+def publish_predictions(prediction_queue, handle_prediction, stats):
+    """
+    pass each prediction to handle_prediction, which filters, serializes and publishes it
+
+    parameters:
+        prediction_queue: provides (frame_count, frame, prediction) tuples
+        handle_prediction: a callable taking frame_count, frame and prediction, returns True if a message was published
+        stats: a collections.Counter updated with the 'published' count
+    """
+    while True:
+        item = prediction_queue.get()
+        if item is END_OF_STREAM:
+            break
+        if handle_prediction(*item):
+            stats['published'] += 1
+
+
+def start_stage(name, target, out_queue, errors, *args):
+    """
+    run target(*args) in a daemon thread, then place END_OF_STREAM on out_queue even if target fails
+
+    parameters:
+        errors: a list that receives the exception raised by target, if any
+    """
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            logging.exception(f'{name} stage failed')
+            errors.append(e)
+        finally:
+            out_queue.put(END_OF_STREAM)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def run_pipeline(frames, predict_async, handle_prediction, inflight=INFLIGHT,
+                 queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, batch_timeout=BATCH_TIMEOUT, split_prediction=None,
+                 motion_gate=None, stats=None, metrics=None, cache=None):
+    """
+    run the reader and predictor stages in background threads and the publisher in the calling thread
+    see read_frames() for the frames and motion_gate parameters
+    and predict_frames() for the predict_async, batch_size, batch_timeout, split_prediction and cache parameters
+    stats: an optional collections.Counter to update with frame counts as frames are processed
+    metrics: optional metrics.StreamMetrics to record the time spent decoding and predicting in
+
+    returns a collections.Counter with the 'read', 'sampled', 'static' and 'published' frame counts
+    raises the first exception raised by a background stage
+    """
+    if stats is None:
+        stats = collections.Counter()
+    errors = []
+    frame_queue = queue.Queue(maxsize=queue_size)
+    prediction_queue = queue.Queue(maxsize=queue_size)
+    reader = start_stage('reader', read_frames, frame_queue, errors,
+                         frames, frame_queue, stats, motion_gate, metrics)
+    predictor = start_stage('predictor', predict_frames, prediction_queue, errors,
+                            frame_queue, prediction_queue, predict_async, inflight, batch_size, batch_timeout,
+                            split_prediction, metrics, cache)
+    publish_predictions(prediction_queue, handle_prediction, stats)
+    predictor.join()
+    if errors:
+        # the reader may be blocked on a full queue that nobody reads anymore, it is a daemon so leave it
+        raise errors[0]
+    reader.join()
+    return stats
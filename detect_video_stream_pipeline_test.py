@@ -0,0 +1,156 @@
+import threading
+import time
+from concurrent import futures
+
+import imageio
+import numpy
+import pytest
+
+import detect_video_stream_pipeline
+import metrics
+import video_sources
+
+
+def test_run_pipeline_preserves_frame_order():
+    """ later frames get faster responses, results should still be handled in frame order """
+    executor = futures.ThreadPoolExecutor(max_workers=4)
+    frames = list(range(20))
+
+    def predict_async(frames):
+        return executor.submit(lambda: time.sleep(0.001 * (20 - frames[0])) or [frames[0] * 10])
+
+    handled = []
+
+    def handle_prediction(frame_count, frame, prediction):
+        handled.append((frame_count, frame, prediction))
+        return frame % 2 == 0
+
+    stats = detect_video_stream_pipeline.run_pipeline(video_sources.sample_every(frames, 2), predict_async,
+                                                      handle_prediction, inflight=4)
+    assert handled == [(i, i, i * 10) for i in range(0, 20, 2)]
+    assert stats['read'] == 20
+    assert stats['sampled'] == 10
+    assert stats['published'] == 10
+
+
+def test_run_pipeline_limits_inflight_predictions():
+    executor = futures.ThreadPoolExecutor(max_workers=8)
+    lock = threading.Lock()
+    counts = {'inflight': 0, 'max': 0}
+
+    def predict(frames):
+        time.sleep(0.002)
+        with lock:
+            counts['inflight'] -= 1
+        return frames
+
+    def predict_async(frames):
+        with lock:
+            counts['inflight'] += 1
+            counts['max'] = max(counts['max'], counts['inflight'])
+        return executor.submit(predict, frames)
+
+    detect_video_stream_pipeline.run_pipeline(video_sources.sample_every(range(30), 1), predict_async,
+                                              lambda *args: True, inflight=3)
+    assert counts['max'] <= 3
+
+
+def test_run_pipeline_raises_stage_errors():
+    def predict_async(frames):
+        raise ValueError('tensorflow serving is down')
+
+    with pytest.raises(ValueError):
+        detect_video_stream_pipeline.run_pipeline(video_sources.sample_every(range(5), 1), predict_async,
+                                                  lambda *args: True)
+
+
+def test_run_pipeline_batches_frames():
+    executor = futures.ThreadPoolExecutor(max_workers=2)
+    batches = []
+
+    def predict_async(frames):
+        batches.append(list(frames))
+        return executor.submit(lambda: {'batch': list(frames)})
+
+    def split_prediction(prediction, frame_total):
+        assert len(prediction['batch']) == frame_total
+        return [frame * 10 for frame in prediction['batch']]
+
+    handled = []
+    detect_video_stream_pipeline.run_pipeline(video_sources.sample_every(range(10), 1), predict_async,
+                                              lambda *item: handled.append(item), batch_size=4, batch_timeout=1.0,
+                                              split_prediction=split_prediction)
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert handled == [(i, i, i * 10) for i in range(10)]
+
+
+def test_run_pipeline_sends_partial_batch_after_timeout():
+    frame_queue = detect_video_stream_pipeline.queue.Queue()
+    batch = [(0, 'frame')]
+    frame_queue.put((1, 'frame'))
+    finished, held = detect_video_stream_pipeline.collect_batch(frame_queue, batch, 8, 0.01)
+    assert not finished
+    assert held is None
+    assert batch == [(0, 'frame'), (1, 'frame')]
+
+
+def test_run_pipeline_batches_images_of_different_sizes_separately(tmp_path):
+    sizes = [(4, 6), (4, 6), (8, 5), (8, 5), (8, 5), (4, 6)]
+    for index, size in enumerate(sizes):
+        imageio.imwrite(str(tmp_path / f'{index:03d}.png'), numpy.full(size + (3,), index, dtype=numpy.uint8))
+    reader = video_sources.ImageReader(video_sources.list_images(str(tmp_path)))
+    batches = []
+
+    def predict_async(frames):
+        # like a PredictRequest or LocalDetector, a batch can only hold frames of one size
+        batch = numpy.stack(frames)
+        batches.append(batch.shape)
+        future = futures.Future()
+        future.set_result([int(frame[0, 0, 0]) for frame in batch])
+        return future
+
+    handled = []
+    detect_video_stream_pipeline.run_pipeline(
+        reader.sample(), predict_async, lambda frame_count, frame, prediction: handled.append(prediction) or True,
+        batch_size=4, batch_timeout=1.0)
+    assert handled == list(range(6))
+    assert batches == [(2, 4, 6, 3), (3, 8, 5, 3), (1, 4, 6, 3)]
+
+
+def test_run_pipeline_skips_static_frames():
+    class EveryThirdFrame(object):
+        """ a stand in for frame_sampling.MotionGate """
+        def should_detect(self, frame):
+            return frame % 3 == 0
+
+    executor = futures.ThreadPoolExecutor(max_workers=1)
+    handled = []
+    stats = detect_video_stream_pipeline.run_pipeline(video_sources.sample_every(range(12), 1),
+                                                      lambda frames: executor.submit(lambda: frames),
+                                                      lambda *item: handled.append(item[0]),
+                                                      motion_gate=EveryThirdFrame())
+    assert handled == [0, 3, 6, 9]
+    assert stats['sampled'] == 4
+    assert stats['static'] == 8
+
+
+def test_run_pipeline_counts_frames_that_were_not_decoded():
+    executor = futures.ThreadPoolExecutor(max_workers=1)
+    # a source that only yields the sampled frames
+    frames = [(0, 'a'), (10, 'b'), (20, 'c')]
+    stats = detect_video_stream_pipeline.run_pipeline(frames, lambda batch: executor.submit(lambda: batch),
+                                                      lambda *item: True)
+    assert stats['read'] == 21
+    assert stats['sampled'] == 3
+
+
+def test_run_pipeline_records_stage_metrics():
+    executor = futures.ThreadPoolExecutor(max_workers=2)
+    stream_metrics = metrics.StreamMetrics({'source': 'test'})
+    stats = detect_video_stream_pipeline.run_pipeline(
+        video_sources.sample_every(range(12), 3), lambda frames: executor.submit(lambda: frames),
+        lambda *args: True, batch_size=2, stats=stream_metrics.counters, metrics=stream_metrics)
+    assert stats is stream_metrics.counters
+    assert stream_metrics.counters['read'] == 12
+    assert stream_metrics.stages['decode'].count == 4
+    assert stream_metrics.stages['predict'].count == 2
@@ -0,0 +1,214 @@
+"""
+run many detection streams in one process
+
+The streams share the label map, the connection to tensorflow serving (or the local detector) and the redis sink.
+Each stream runs in its own thread and is restarted when it fails. Aggregate throughput is logged periodically.
+
+The config file is json, with the same names as the arguments of detect_video_stream_tf_serving.py e.g.
+    {
+        "defaults": {"path_to_label_map": "mscoco_label_map.pbtxt", "tensorflow_serving_port": 8500,
+                     "model_name": "ssd_mobilenet_v1_coco", "channel_name": "predictions", "sink": "stream"},
+        "sources": [
+            {"source": "0", "instance_name": "front-door", "samplerate": 10, "cutoff": 70},
+            {"source": "/videos/backyard.mp4", "instance_name": "backyard", "samplerate": 5}
+        ]
+    }
+Values in a source override the defaults, except for SHARED_ARGS: the label map, tensorflow serving or the frozen
+graph, redis, the frame store, the cache, the archive and metrics are set up once for all the streams, so they can
+only be set in the defaults. Values are parsed like command line arguments, with the same checks.
+"""
+import argparse
+import collections
+import json
+import logging
+import threading
+import time
+
+import detect_video_stream_tf_serving as detect_video_stream
+
+POSITIONAL_ARGS = ['source', 'path_to_label_map', 'tensorflow_serving_port', 'model_name', 'channel_name']
+# the args detect_video_stream.StreamResources is created from, the same for every stream
+SHARED_ARGS = frozenset([
+    'path_to_label_map', 'tensorflow_serving_port', 'channel_name', 'redis_url', 'sink', 'stream_maxlen',
+    'sink_batch_size', 'sink_flush_interval', 'sink_buffer_size', 'sink_overflow', 'serving_endpoints',
+    'endpoint_inflight', 'hedge_delay', 'predict_attempts', 'frozen_graph', 'metrics_port', 'metrics_host',
+    'metrics_log_interval', 'frame_store', 'frame_store_ttl', 'frame_store_path', 'frame_store_slots',
+    'frame_store_slot_size', 'cache_dir', 'cache_max_size', 'archive_dir', 'archive_chunk_rows',
+    'archive_flush_interval'])
+# how many times a failing stream is restarted, a negative value restarts it forever
+MAX_RESTARTS = -1
+# seconds
+RESTART_DELAY = 5.0
+REPORT_INTERVAL = 30.0
+
+
+def load_config(path):
+    """ read the supervisor config file, returns a dict with 'defaults' and 'sources' """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    if not config.get('sources'):
+        raise ValueError(f'{path} does not list any sources')
+    config.setdefault('defaults', {})
+    return config
+
+
+def create_stream_args(defaults, source_config, parser=None):
+    """
+    create the args for one stream as if they had been passed to detect_video_stream_tf_serving.py
+
+    parameters:
+        defaults: a dict of argument values shared by all streams
+        source_config: a dict of argument values for this stream, these override the defaults
+        parser: the parser returned by detect_video_stream_tf_serving.create_arg_parser(), created if absent
+
+    returns a namespace object
+    """
+    parser = parser or detect_video_stream.create_arg_parser()
+    shared = [name for name in SHARED_ARGS & set(source_config) if source_config[name] != defaults.get(name)]
+    if shared:
+        raise ValueError(f'{sorted(shared)} are shared by all the streams, set them in the defaults instead of for '
+                         f'source {source_config}')
+    values = dict(defaults, **source_config)
+    missing = [name for name in POSITIONAL_ARGS if name not in values]
+    if missing:
+        raise ValueError(f'missing {missing} for source {source_config}')
+    actions = {action.dest: action for action in parser._actions if action.option_strings}
+    command_line = [str(values[name]) for name in POSITIONAL_ARGS]
+    for name, value in values.items():
+        if name in POSITIONAL_ARGS:
+            continue
+        if name not in actions:
+            raise ValueError(f'unknown argument {name} for source {source_config}')
+        action = actions[name]
+        if action.nargs == 0:
+            # a flag e.g. --live
+            if value:
+                command_line.append(action.option_strings[0])
+        elif value is not None:
+            command_line += [action.option_strings[0], str(value)]
+    try:
+        return parser.parse_args(command_line)
+    except SystemExit:
+        # argparse has printed what is wrong
+        raise ValueError(f'invalid arguments for source {source_config}')
+
+
+class StreamWorker(object):
+    """ runs detect_video_stream() for one source in a thread, restarting it when it fails """
+
+    def __init__(self, args, resources, max_restarts=MAX_RESTARTS, restart_delay=RESTART_DELAY,
+                 run=detect_video_stream.detect_video_stream):
+        """
+        :param args: the stream's args, see create_stream_args()
+        :param resources: the shared detect_video_stream.StreamResources
+        :param max_restarts: how many times to restart the stream when it fails, negative for no limit
+        :param restart_delay: seconds to wait before restarting
+        :param run: the function that runs the stream, called with args, resources and stats, useful for mocking
+        """
+        self.args = args
+        self.resources = resources
+        self.max_restarts = max_restarts
+        self.restart_delay = restart_delay
+        self.run = run
+        self.stats = collections.Counter()
+        self.restarts = 0
+        self.failed = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f'stream {args.source}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """ stop restarting the stream, a running stream continues until its source ends """
+        self.stopping.set()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def _run(self):
+        while True:
+            try:
+                self.run(self.args, self.resources, self.stats)
+                logging.info(f'stream {self.args.source} finished')
+                return
+            except Exception:
+                logging.exception(f'stream {self.args.source} failed')
+            if 0 <= self.max_restarts <= self.restarts:
+                logging.error(f'stream {self.args.source} failed {self.restarts + 1} times, giving up')
+                self.failed = True
+                return
+            if self.stopping.wait(self.restart_delay):
+                return
+            self.restarts += 1
+            logging.info(f'restarting stream {self.args.source}, restart {self.restarts}')
+
+
+def aggregate_stats(workers):
+    """ returns a collections.Counter with the sum of the frame counts of all workers """
+    total = collections.Counter()
+    for worker in workers:
+        total.update(worker.stats)
+    total['restarts'] = sum(worker.restarts for worker in workers)
+    total['failed'] = sum(1 for worker in workers if worker.failed)
+    return total
+
+
+def supervise(workers, report_interval=REPORT_INTERVAL, clock=time.monotonic):
+    """
+    start the workers and log their aggregate throughput every report_interval seconds until they all finish
+
+    returns the aggregate stats, see aggregate_stats()
+    """
+    for worker in workers:
+        worker.start()
+    last_report_time = clock()
+    last_total = aggregate_stats(workers)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.thread.join(report_interval / len(workers))
+            now = clock()
+            if now - last_report_time >= report_interval:
+                total = aggregate_stats(workers)
+                elapsed = now - last_report_time
+                rates = {name: round((total[name] - last_total[name]) / elapsed, 2)
+                         for name in ('read', 'sampled', 'published')}
+                alive = sum(1 for worker in workers if worker.is_alive())
+                logging.info(json.dumps({'streams': alive, 'frames_per_second': rates, 'total': dict(total)}))
+                last_report_time, last_total = now, total
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.stop()
+    return aggregate_stats(workers)
+
+
+def run_supervisor(config, max_restarts=MAX_RESTARTS, restart_delay=RESTART_DELAY, report_interval=REPORT_INTERVAL):
+    """ create the shared resources and one worker per source in config, then supervise them """
+    parser = detect_video_stream.create_arg_parser()
+    defaults = config['defaults']
+    # the shared resources only use the default args, the source is a placeholder
+    resources = detect_video_stream.StreamResources(create_stream_args(defaults, {'source': '-'}, parser))
+    try:
+        workers = [StreamWorker(create_stream_args(defaults, source_config, parser), resources,
+                                max_restarts=max_restarts, restart_delay=restart_delay)
+                   for source_config in config['sources']]
+        total = supervise(workers, report_interval)
+    finally:
+        resources.close()
+    logging.info(f'supervisor finished: {dict(total)}')
+    return total
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="run detection on many video sources in one process")
+    parser.add_argument("config", help="path to a json config file listing the sources")
+    parser.add_argument("--max-restarts", type=int, default=MAX_RESTARTS,
+                        help="how many times to restart a failing stream, negative for no limit")
+    parser.add_argument("--restart-delay", type=float, default=RESTART_DELAY,
+                        help="seconds to wait before restarting a failed stream")
+    parser.add_argument("--report-interval", type=float, default=REPORT_INTERVAL,
+                        help="seconds between throughput reports")
+    args = parser.parse_args()
+    run_supervisor(load_config(args.config), args.max_restarts, args.restart_delay, args.report_interval)
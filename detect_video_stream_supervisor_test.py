@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+import detect_video_stream_supervisor as supervisor
+
+DEFAULTS = {'path_to_label_map': '/path/to/label-map.txt', 'tensorflow_serving_port': 8500,
+            'model_name': 'model_id', 'channel_name': 'predictions', 'cutoff': '70'}
+
+
+def test_load_config(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({'defaults': DEFAULTS, 'sources': [{'source': '0'}]}))
+    config = supervisor.load_config(str(path))
+    assert config['sources'] == [{'source': '0'}]
+    path.write_text(json.dumps({'defaults': DEFAULTS, 'sources': []}))
+    with pytest.raises(ValueError):
+        supervisor.load_config(str(path))
+
+
+def test_create_stream_args():
+    args = supervisor.create_stream_args(DEFAULTS, {'source': 0, 'samplerate': 10, 'cutoff': '80',
+                                                    'instance_name': 'front-door'})
+    assert args.source == '0'
+    assert args.tensorflow_serving_port == '8500'
+    # parsed like command line arguments
+    assert args.samplerate == '10'
+    assert args.cutoff == '80', "source values override the defaults"
+    assert args.instance_name == 'front-door'
+    assert args.batch_size is None
+
+
+def test_create_stream_args_unknown_argument():
+    with pytest.raises(ValueError):
+        supervisor.create_stream_args(DEFAULTS, {'source': '0', 'sample_rate': 10})
+
+
+def test_create_stream_args_checks_values_like_the_parser():
+    assert supervisor.create_stream_args(DEFAULTS, {'source': '0', 'live': True, 'track': 'iou'}).live
+    assert not supervisor.create_stream_args(DEFAULTS, {'source': '0', 'live': False}).live
+    with pytest.raises(ValueError):
+        supervisor.create_stream_args(DEFAULTS, {'source': '0', 'track': 'kalman'})
+
+
+def test_create_stream_args_rejects_per_source_shared_args():
+    defaults = dict(DEFAULTS, sink='stream')
+    assert supervisor.create_stream_args(defaults, {'source': '0', 'sink': 'stream'}).sink == 'stream'
+    for source_config in ({'source': '0', 'sink': 'pubsub'}, {'source': '0', 'channel_name': 'other'},
+                          {'source': '0', 'frozen_graph': 'graph.pb'}):
+        with pytest.raises(ValueError):
+            supervisor.create_stream_args(defaults, source_config)
+
+
+def test_worker_restarts_failed_stream():
+    calls = []
+
+    def run(args, resources, stats):
+        calls.append(args)
+        stats['read'] += 10
+        if len(calls) < 3:
+            raise IOError('camera disconnected')
+
+    args = supervisor.create_stream_args(DEFAULTS, {'source': '0'})
+    worker = supervisor.StreamWorker(args, resources=None, restart_delay=0, run=run)
+    total = supervisor.supervise([worker], report_interval=0.01)
+    assert len(calls) == 3
+    assert worker.restarts == 2
+    assert not worker.failed
+    assert total['read'] == 30
+
+
+def test_worker_gives_up_after_max_restarts():
+    def run(args, resources, stats):
+        raise IOError('camera disconnected')
+
+    workers = [supervisor.StreamWorker(supervisor.create_stream_args(DEFAULTS, {'source': str(i)}), resources=None,
+                                       max_restarts=1, restart_delay=0, run=run) for i in range(2)]
+    total = supervisor.supervise(workers, report_interval=0.01)
+    assert total['failed'] == 2
+    assert total['restarts'] == 2
@@ -2,114 +2,552 @@
 import logging
 import argparse
 import sys
-import numpy as np
-import object_detection.utils.label_map_util as label_utils
 from datetime import datetime as dt
-import grpc
 import google.protobuf.json_format as json_format
-import tensorflow as tf
 import redis
 import imageio
 import json
+import functools
+import collections
+import time
+import os
+from concurrent import futures
 
-from juu_object_detection_protos.api.generated import detection_handler_pb2
-import video_object_detection as obj_detect
 import detect_video_stream_utils
-from juu_object_detection_protos.api.generated.tensorflow_serving.apis import predict_pb2, model_pb2, prediction_service_pb2_grpc
+import detect_video_stream_pipeline
+import frame_encoding
+import label_map
+import message_builder
+import frame_resize
+import frame_store
+import detection_sinks
+import frame_sampling
+import video_sources
+import model_fanout
+import detection_suppression
+import detection_tracking
+import metrics
+import detection_cache
+import detection_archive
+import serving_client
+from juu_object_detection_protos.api.generated.tensorflow_serving.apis import predict_pb2, model_pb2
 
 CUT_OFF_SCORE = 90.0
 SAMPLE_RATE = 5
 HANDLER_PORT = 50051
+# seconds to wait for a prediction from tensorflow serving, retries and hedges included
+PREDICT_TIMEOUT = 10.0
 
 
-def detect_video_stream(args):
-    """ detect objects in video stream """
+class StreamResources(object):
+    """
+    what the detection streams in one process share: the label map, the inference backend and the redis sink
+    """
 
-    # setup redis
-    redis_client = redis.Redis()
+    def __init__(self, args, redis_client=None):
+        """
+        :param args: see create_arg_parser()
+        :param redis_client: the redis client to publish with, created from args.redis_url if absent
+        """
+        # generate dict from labels
+        self.category_index = label_map.create_category_index_from_labelmap(args.path_to_label_map,
+                                                                            use_display_name=True)
+        # setup redis
+        if redis_client is None:
+            redis_client = redis.Redis.from_url(args.redis_url) if args.redis_url else redis.Redis()
+        self.sink = detection_sinks.create_sink(
+            detect_video_stream_utils.determine_input_arg(args.sink, detection_sinks.PUBSUB), redis_client,
+            args.channel_name,
+            maxlen=int(detect_video_stream_utils.determine_input_arg(args.stream_maxlen,
+                                                                     detection_sinks.STREAM_MAXLEN)),
+            batch_size=int(detect_video_stream_utils.determine_input_arg(args.sink_batch_size,
+                                                                         detection_sinks.BATCH_SIZE)),
+            flush_interval=float(detect_video_stream_utils.determine_input_arg(args.sink_flush_interval,
+                                                                               detection_sinks.FLUSH_INTERVAL)),
+            buffer_size=int(detect_video_stream_utils.determine_input_arg(args.sink_buffer_size,
+                                                                          detection_sinks.BUFFER_SIZE)),
+            overflow=detect_video_stream_utils.determine_input_arg(args.sink_overflow, detection_sinks.BLOCK))
+        self.metrics = metrics.MetricsRegistry()
+        self.metrics_server = None
+        if args.metrics_port:
+            self.metrics_server = metrics.MetricsServer(
+                self.metrics, int(args.metrics_port),
+                detect_video_stream_utils.determine_input_arg(args.metrics_host, metrics.HOST))
+        self.metrics_logger = None
+        if args.metrics_log_interval:
+            self.metrics_logger = metrics.MetricsLogger(self.metrics, float(args.metrics_log_interval))
+        self.frame_store = None
+        if args.frame_store:
+            self.frame_store = frame_store.create_frame_store(
+                args.frame_store, redis_client,
+                ttl=int(detect_video_stream_utils.determine_input_arg(args.frame_store_ttl, frame_store.TTL)),
+                path=detect_video_stream_utils.determine_input_arg(args.frame_store_path, frame_store.MMAP_PATH),
+                slots=int(detect_video_stream_utils.determine_input_arg(args.frame_store_slots, frame_store.SLOTS)),
+                slot_size=int(detect_video_stream_utils.determine_input_arg(args.frame_store_slot_size,
+                                                                            frame_store.SLOT_SIZE)))
+        self.detection_cache = None
+        if args.cache_dir:
+            self.detection_cache = detection_cache.DetectionCache(
+                args.cache_dir,
+                max_size=int(float(detect_video_stream_utils.determine_input_arg(
+                    args.cache_max_size, detection_cache.MAX_SIZE / 1024 ** 2)) * 1024 ** 2))
+        self.archive = None
+        if args.archive_dir:
+            self.archive = detection_archive.DetectionArchive(
+                args.archive_dir,
+                chunk_rows=int(detect_video_stream_utils.determine_input_arg(args.archive_chunk_rows,
+                                                                             detection_archive.CHUNK_ROWS)),
+                flush_interval=float(detect_video_stream_utils.determine_input_arg(args.archive_flush_interval,
+                                                                                   detection_archive.FLUSH_INTERVAL)))
+        self.detector = None
+        self.executor = None
+        self.serving_client = None
+        # frozen graph path: the hash of its content, identifies the graph in the detection cache
+        self.frozen_graph_hashes = {}
+        if args.frozen_graph:
+            # run inference in this process, one session runs the batches one after the other
+            logging.debug(f'loading frozen graph from {args.frozen_graph}')
+            # tensorflow is only imported when inference runs in this process
+            import video_object_detection as obj_detect
+            self.detector = obj_detect.LocalDetector.from_frozen_model(args.frozen_graph)
+            self.executor = futures.ThreadPoolExecutor(max_workers=1)
+        else:
+            # setup grpc comms to tensorflow serving, requests are spread over the endpoints
+            addresses = serving_client.parse_endpoints(args.serving_endpoints, args.tensorflow_serving_port) \
+                if args.serving_endpoints else [f'localhost:{args.tensorflow_serving_port}']
+            logging.debug(f'connecting to tensorflow serving at {addresses}')
+            self.serving_client = serving_client.BalancedClient(
+                addresses, predict_pb2.PredictRequest.SerializeToString, predict_pb2.PredictResponse.FromString,
+                max_inflight=int(detect_video_stream_utils.determine_input_arg(args.endpoint_inflight,
+                                                                               serving_client.MAX_INFLIGHT)),
+                hedge_delay=float(args.hedge_delay) if args.hedge_delay else None,
+                max_attempts=int(detect_video_stream_utils.determine_input_arg(args.predict_attempts,
+                                                                               serving_client.MAX_ATTEMPTS)),
+                registry=self.metrics)
 
-    # setup grpc comms to tensorflow serving
-    tensorflow_serving_port = args.tensorflow_serving_port
-    url = f'localhost:{tensorflow_serving_port}'
-    logging.debug(f'connecting to tensorflow serving at {url}')
-    tensorflow_serving_channel = grpc.insecure_channel(url)
-    tensorflow_serving_stub = prediction_service_pb2_grpc.PredictionServiceStub(tensorflow_serving_channel)
+    def close(self):
+        self.sink.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.metrics_logger:
+            self.metrics_logger.close()
+        if self.frame_store:
+            self.frame_store.close()
+        if self.detection_cache:
+            self.detection_cache.close()
+        if self.archive:
+            self.archive.close()
+        if self.executor:
+            self.executor.shutdown()
+            self.detector.close()
+        if self.serving_client:
+            self.serving_client.close()
 
-    # generate dict from labels
-    category_index = label_utils.create_category_index_from_labelmap(args.path_to_label_map, use_display_name=True)
+
+def create_predictor(args, resources, stream_metrics=None):
+    """
+    set up inference for one stream either in this process (--frozen-graph) or through tensorflow serving
+    stream_metrics: optional metrics.StreamMetrics to record the time spent building requests in
+
+    returns a tuple of
+        predict_async: takes a list of frames, returns a future for the prediction for the batch
+        split_prediction: splits a prediction for a batch into one per frame, None if it is already split
+        filter_prediction: takes the prediction for a frame and the filter args of filter_detection_output()
+    """
+    if resources.detector:
+        def predict_async(frames):
+            """ queue the frames for inference in the local session """
+            return resources.executor.submit(resources.detector.predict, frames)
+
+        return predict_async, None, detect_video_stream_utils.filter_detection_output
+
+    # the client has the Predict.future() of a PredictionServiceStub
+    tensorflow_serving_stub = resources.serving_client
+    predict_timeout = float(detect_video_stream_utils.determine_input_arg(args.predict_timeout, PREDICT_TIMEOUT))
+    # each stream builds its own requests since the request object is reused
+    model_spec = model_pb2.ModelSpec(name=args.model_name)
+    if args.cache_model_version and not args.fan_out_models:
+        # the version the cached predictions are keyed by is the one asked for, not whichever serving has loaded
+        model_spec.version.value = int(args.cache_model_version)
+    build_prediction_request = detect_video_stream_utils.predict_request_builder(
+        predict_pb2.PredictRequest(model_spec=model_spec))
+    if stream_metrics is not None:
+        build_prediction_request = stream_metrics.timed('request', build_prediction_request)
+
+    def filter_prediction(prediction_response, *filter_args):
+        return detect_video_stream_utils.filter_detection_output_tf_serving(prediction_response.outputs,
+                                                                            *filter_args)
+
+    if args.fan_out_models:
+        # every batch goes to all the models and their detections are merged into one message per frame
+        model_names = [args.model_name] + [name.strip() for name in args.fan_out_models.split(',')]
+        logging.debug(f'sending frames to models {model_names}')
+        predict_async = model_fanout.fan_out_predictor(
+            tensorflow_serving_stub, build_prediction_request, model_names, predict_timeout,
+            float(detect_video_stream_utils.determine_input_arg(args.fan_out_timeout, model_fanout.JOIN_TIMEOUT)))
+        split_prediction = functools.partial(model_fanout.split_fan_out,
+                                             split_prediction=detect_video_stream_utils.split_prediction_response)
+        return predict_async, split_prediction, functools.partial(model_fanout.merge_detections, filter_prediction)
+
+    def predict_async(frames):
+        """ send the frames to tensorflow serving as one batch without waiting for the response """
+        return tensorflow_serving_stub.Predict.future(build_prediction_request(frames), predict_timeout)
+
+    return predict_async, detect_video_stream_utils.split_prediction_response, filter_prediction
+
+
+def create_resizer(args, resources):
+    """
+    returns a frame_resize.Resizer for the frames sent for detection, None if they are sent at full resolution
+    with --resize auto, the size comes from the frozen graph or from the model name
+    """
+    if not args.resize:
+        return None
+    if args.resize != frame_resize.AUTO:
+        size = frame_resize.parse_size(args.resize)
+    elif resources.detector and resources.detector.input_size():
+        size = resources.detector.input_size()
+    else:
+        size = frame_resize.model_input_size(args.model_name)
+    logging.debug(f'resizing frames to {size} (height, width) before detection')
+    return frame_resize.Resizer(size, detect_video_stream_utils.determine_input_arg(args.resize_method,
+                                                                                    frame_resize.NEAREST))
+
+
+def create_stream_cache(args, resources, resizer, stats):
+    """
+    returns a detection_cache.StreamCache for the stream's predictions, None if there is no --cache-dir or the source
+    is not a file, live sources never show the same frames again
+    """
+    if not resources.detection_cache or not os.path.isfile(args.source):
+        return None
+    if args.fan_out_models:
+        logging.warning('--cache-dir is not used with --fan-out-models')
+        return None
+    # the frames sent to the model only change with the resize
+    preprocessing_key = f'{resizer.height}x{resizer.width}:{resizer.method}' if resizer else ''
+    # the model comes from the stream's own args, streams of a supervisor can use different models
+    if resources.detector:
+        encode, decode = detection_cache.encode_arrays, detection_cache.decode_arrays
+        if args.frozen_graph not in resources.frozen_graph_hashes:
+            resources.frozen_graph_hashes[args.frozen_graph] = detection_cache.source_content_hash(args.frozen_graph)
+        model_key = resources.frozen_graph_hashes[args.frozen_graph]
+    else:
+        if not args.cache_model_version:
+            # tensorflow serving can load a new version under the same name, which would keep getting the old one's
+            # cached predictions
+            logging.warning('--cache-dir needs --cache-model-version with tensorflow serving, not caching')
+            return None
+        encode, decode = predict_pb2.PredictResponse.SerializeToString, predict_pb2.PredictResponse.FromString
+        model_key = f'{args.model_name}:{int(args.cache_model_version)}'
+    start = time.perf_counter()
+    source_hash = detection_cache.source_content_hash(args.source)
+    logging.debug(f'hashed {args.source} for the detection cache in {time.perf_counter() - start:.2f} seconds')
+    return detection_cache.StreamCache(resources.detection_cache, model_key, source_hash, preprocessing_key,
+                                       encode, decode, stats)
+
+
+def detect_video_stream(args, resources=None, stats=None):
+    """
+    detect objects in video stream
+
+    parameters:
+        args: a namespace object from the parser returned by create_arg_parser()
+        resources: the StreamResources to use, if absent they are created from args and closed at the end
+        stats: an optional collections.Counter updated with frame counts as frames are processed, the stream's
+            metrics keep their counters in it
+    returns the frame counts, see detect_video_stream_pipeline.run_pipeline()
+    """
+    if resources is None:
+        resources = StreamResources(args)
+        try:
+            stats = detect_video_stream(args, resources, stats)
+        finally:
+            resources.close()
+        sink = resources.sink
+        logging.info(f"messages written to redis: {sink.sent}, dropped: {sink.dropped}, failed: {sink.failed}")
+        return stats
+
+    category_index = resources.category_index
+    sink = resources.sink
     # logging.debug(f"category_index: {category_index}")
     # TODO validate args
     # determine sample rate
-    sample_rate = detect_video_stream_utils.determine_samplerate(args.samplerate, SAMPLE_RATE)
-    video_reader = detect_video_stream_utils.determine_source(args, imageio.get_reader)
+    sample_rate = int(detect_video_stream_utils.determine_samplerate(args.samplerate, SAMPLE_RATE))
+    target_fps = float(args.target_fps) if args.target_fps else None
+    if stats is None:
+        stats = collections.Counter()
+    live_source = None
+    if args.live:
+        # the newest frame is always the next one detected, at a rate that keeps up with detection
+        video_reader = detect_video_stream_utils.determine_source(args, imageio.get_reader)
+        live_source = video_sources.LiveSource(
+            video_reader,
+            target_latency=float(detect_video_stream_utils.determine_input_arg(args.target_latency,
+                                                                               video_sources.TARGET_LATENCY)),
+            min_interval=1.0 / target_fps if target_fps else 0.0,
+            stats=stats)
+        frames = live_source.frames()
+    else:
+        video_reader, frames = video_sources.determine_sampled_frames(args, sample_rate, target_fps,
+                                                                      imageio.get_reader)
     float_map = {'frame_height': video_reader.get_meta_data()['size'][0], 'frame_width': video_reader.get_meta_data()['size'][1]}
-    total_frame_count = 0
-    prediction_frame_count = 0
     start_time = dt.now().timestamp()
     cut_off_score = detect_video_stream_utils.determine_cut_off_score(args, default_cut_off=CUT_OFF_SCORE)
     logging.debug(f"using a cut off score of {cut_off_score}")
-    model_name = args.model_name
-    # loop over frames in video
-    for frame in video_reader:
-        # only consider frames that are a multiple of the sample rate
-        if frame is not None and total_frame_count % sample_rate == 0:
-            img_to_array = np.expand_dims(frame, axis=0)
-            # run inference
-            prediction_request = predict_pb2.PredictRequest(
-                        model_spec=model_pb2.ModelSpec(name=model_name),
-                        inputs={'inputs': tf.compat.v1.make_tensor_proto(img_to_array)})
-            prediction_response =  tensorflow_serving_stub.Predict(prediction_request, 10.0)
-            output_dict = prediction_response.outputs
-            output_dict = detect_video_stream_utils.filter_detection_output_tf_serving(output_dict, cut_off_score)
-            if len(output_dict['detection_boxes']) > 0:
-                #logging.debug(f'filtered output: {output_dict}')
-                detection_boxes = detection_handler_pb2.float_array(numbers=output_dict['detection_boxes'].ravel(),
-                                                                    shape=output_dict['detection_boxes'].shape)
-                filtered_category_index = detect_video_stream_utils.class_names_from_index(
-                    output_dict['detection_classes'], category_index)
-                source = detect_video_stream_utils.determine_source_name(args.source)
-                instance_name = detect_video_stream_utils.determine_instance_name(args.instance_name)
-                # TODO - if someone reruns the same static source (video file), using the same model
-                #  (which could be provided via instance name), we expect the same id for each frame
-                #  for live streams (cameras, network sources), detect_video_stream_utils.determine_source()
-                #  could be changed to append the start timestamp to the source
-                request_id = detect_video_stream_utils.create_detection_request_id\
-                    (instance_name, source, total_frame_count)
-                string_map = {'id': request_id}
-                message = detection_handler_pb2.handle_detection_request(
-                    start_timestamp=start_time,
-                    detection_classes=output_dict['detection_classes'],
-                    detection_scores=output_dict['detection_scores'],
-                    detection_boxes=detection_boxes,
-                    instance_name=instance_name,
-                    frame=detection_handler_pb2.float_array(numbers=frame.ravel(), shape=frame.shape),
-                    frame_count=total_frame_count,
-                    source=source,
-                    float_map=float_map,
-                    category_index=filtered_category_index,
-                    string_map=string_map)
-                redis_client.publish(args.channel_name, message.SerializeToString())
-                print(f'placed request on redis, frame_count: {message.frame_count}, instance: {message.instance_name}, source: {message.source}\r', end='')
-                prediction_frame_count += 1
-        total_frame_count += 1
-    logging.info(f"\npredictions/total frames : {prediction_frame_count}/{total_frame_count}")
+    class_cut_off_scores = detect_video_stream_utils.determine_class_cut_off_scores(args.class_cutoff, category_index)
+    logging.debug(f"using class cut off scores of {class_cut_off_scores}")
+    top_k = int(args.top_k) if args.top_k else None
+    frame_encoding_name = detect_video_stream_utils.determine_input_arg(args.frame_encoding, frame_encoding.FLOAT)
+    frame_quality = int(detect_video_stream_utils.determine_input_arg(args.frame_quality, frame_encoding.JPEG_QUALITY))
 
+    source = detect_video_stream_utils.determine_source_name(args.source)
+    instance_name = detect_video_stream_utils.determine_instance_name(args.instance_name)
+    stream_metrics = resources.metrics.stream_metrics({'source': source, 'instance': instance_name}, stats)
+    predict_async, split_prediction, filter_prediction = create_predictor(args, resources, stream_metrics)
+    resizer = create_resizer(args, resources)
+    if resizer:
+        resize = stream_metrics.timed('resize', resizer)
+        predict_full_frames = predict_async
 
-if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
+        def predict_async(frames):
+            """ send downscaled frames, the boxes are normalized so they apply to the full frames too """
+            return predict_full_frames([resize(frame) for frame in frames])
+
+    stream_cache = create_stream_cache(args, resources, resizer, stats)
+    tracker = None
+    if args.track:
+        tracker = detection_tracking.Tracker(
+            metric=args.track,
+            max_age=int(detect_video_stream_utils.determine_input_arg(args.track_max_age, detection_tracking.MAX_AGE)),
+            constant_velocity=args.track_velocity)
+    suppressor = None
+    if args.suppress_iou:
+        suppressor = detection_suppression.ChangeSuppressor(
+            iou_threshold=float(args.suppress_iou),
+            keyframe_interval=float(detect_video_stream_utils.determine_input_arg(
+                args.keyframe_interval, detection_suppression.KEYFRAME_INTERVAL)))
+    publish_resizer = None
+    if args.publish_frame_size:
+        publish_resizer = frame_resize.Resizer(frame_resize.parse_size(args.publish_frame_size),
+                                               detect_video_stream_utils.determine_input_arg(args.resize_method,
+                                                                                             frame_resize.NEAREST))
+    motion_gate = None
+    if args.motion_threshold:
+        motion_gate = frame_sampling.MotionGate(
+            threshold=float(args.motion_threshold),
+            max_skip=int(detect_video_stream_utils.determine_input_arg(args.motion_max_skip, frame_sampling.MAX_SKIP)))
+
+    # the parts of the messages that are the same for the whole stream are prepared once
+    builder = message_builder.MessageBuilder(instance_name, source, start_time, float_map, category_index)
+
+    def handle_prediction(total_frame_count, frame, prediction):
+        """ filter the prediction and publish it to redis if anything was detected, returns True if published """
+        start = time.perf_counter()
+        output_dict = filter_prediction(prediction, cut_off_score, class_cut_off_scores, top_k)
+        filtered = time.perf_counter()
+        stream_metrics.observe('filter', filtered - start)
+        if tracker:
+            # every frame updates the tracks, even those that are not published
+            track_ids = tracker.update(total_frame_count, output_dict['detection_classes'],
+                                       output_dict['detection_boxes'])
+        if len(output_dict['detection_boxes']) == 0:
+            if suppressor:
+                suppressor.reset()
+            return False
+        stream_metrics.increment('detected')
+        # TODO - if someone reruns the same static source (video file), using the same model
+        #  (which could be provided via instance name), we expect the same id for each frame
+        #  for live streams (cameras, network sources), detect_video_stream_utils.determine_source()
+        #  could be changed to append the start timestamp to the source
+        request_id = builder.request_id(total_frame_count)
+        if resources.archive:
+            # every frame with detections is archived, suppressed or not
+            resources.archive.add(source, instance_name, request_id, total_frame_count, output_dict)
+        if suppressor and not suppressor.should_publish(output_dict['detection_classes'],
+                                                        output_dict['detection_boxes']):
+            stream_metrics.increment('suppressed')
+            return False
+        #logging.debug(f'filtered output: {output_dict}')
+        string_map = {'id': request_id}
+        string_map.update(output_dict.get('string_map', {}))
+        if suppressor:
+            string_map.update(suppressor.string_map())
+        if tracker:
+            string_map.update(detection_tracking.track_ids_string_map(track_ids))
+        if publish_resizer:
+            frame = publish_resizer(frame)
+        frame_numbers, frame_string_map = frame_encoding.encode_frame(frame, frame_encoding_name, frame_quality,
+                                                                      resources.frame_store, request_id)
+        string_map.update(frame_string_map)
+        payload = builder.build(total_frame_count, output_dict, string_map, frame_numbers)
+        serialized = time.perf_counter()
+        stream_metrics.observe('serialize', serialized - filtered)
+        # the sink counts the messages and bytes redis accepted in the stream's counters
+        sent = sink.send(payload, stream_metrics.counters)
+        stream_metrics.observe('publish', time.perf_counter() - serialized)
+        if not sent:
+            return False
+        print(f'placed request on redis, frame_count: {total_frame_count}, instance: {instance_name}, source: {source}\r', end='')
+        return True
+
+    if live_source:
+        handle_frame_prediction = handle_prediction
+
+        def handle_prediction(total_frame_count, frame, prediction):
+            """ record how long after capture the frame was handled, which sets the live source's rate """
+            published = handle_frame_prediction(total_frame_count, frame, prediction)
+            latency = live_source.completed(total_frame_count)
+            if published:
+                stream_metrics.observe('capture_to_publish', latency)
+            return published
+
+    # decoding, prediction and publishing run as separate stages so they overlap
+    stats = detect_video_stream_pipeline.run_pipeline(
+        frames, predict_async, handle_prediction,
+        inflight=int(detect_video_stream_utils.determine_input_arg(args.inflight, detect_video_stream_pipeline.INFLIGHT)),
+        queue_size=int(detect_video_stream_utils.determine_input_arg(args.queue_size, detect_video_stream_pipeline.QUEUE_SIZE)),
+        batch_size=int(detect_video_stream_utils.determine_input_arg(args.batch_size, detect_video_stream_pipeline.BATCH_SIZE)),
+        batch_timeout=float(detect_video_stream_utils.determine_input_arg(args.batch_timeout, detect_video_stream_pipeline.BATCH_TIMEOUT)),
+        split_prediction=split_prediction,
+        motion_gate=motion_gate,
+        stats=stats,
+        metrics=stream_metrics,
+        cache=stream_cache)
+    logging.info(f"\npredictions/total frames : {stats['published']}/{stats['read']}")
+    if motion_gate:
+        logging.info(f"static frames skipped: {stats['static']}/{stats['static'] + stats['sampled']}")
+    if suppressor:
+        logging.info(f"unchanged detections suppressed: {stats['suppressed']}/{stats['detected']}")
+    if live_source:
+        logging.info(f"frames dropped to keep up with the live source: {stats['dropped']}/{stats['read']}")
+    if stream_cache:
+        logging.info(f"cached predictions used: {stats['cache_hits']}/{stats['cache_hits'] + stats['cache_misses']}")
+    return stats
+
+
+def create_arg_parser():
+    """ the command line arguments of this script, the supervisor uses the same names in its config file """
     parser = argparse.ArgumentParser(description="detect objects in video")
     # credit for adding required arg - https://stackoverflow.com/a/24181138/315385
     parser.add_argument("source",
-                        help="- for standard input, path to file or a numeral that represents the webcam device number")
+                        help="- for standard input, path to file, a directory of images, a quoted glob pattern matching "
+                             "images e.g. 'dump/*.jpg' or a numeral that represents the webcam device number")
     parser.add_argument("path_to_label_map", help="path to label map")
     parser.add_argument("tensorflow_serving_port", help="the grpc port to request prediction results from")
     parser.add_argument("model_name", help="the model name")
     parser.add_argument("channel_name", help="channel to subscribe to for detection handling requests")
+    parser.add_argument("--redis-url", help="e.g. redis://localhost:6379/0, defaults to redis on localhost")
+    parser.add_argument("--sink", choices=detection_sinks.SINK_TYPES,
+                        help="publish to a pub/sub channel (default) or append to a redis stream named channel_name")
+    parser.add_argument("--stream-maxlen", help="trim the redis stream to about this many messages")
+    parser.add_argument("--sink-batch-size", help="how many messages to write to redis in one round trip")
+    parser.add_argument("--sink-flush-interval", help="seconds to wait for a batch of messages to fill up")
+    parser.add_argument("--sink-buffer-size", help="how many messages can wait to be written to redis")
+    parser.add_argument("--sink-overflow", choices=detection_sinks.OVERFLOW_POLICIES,
+                        help="what to do when the buffer is full: block (default) slows down detection, "
+                             "drop-newest or drop-oldest drop messages")
     parser.add_argument("--cutoff", help="cut off detection score (%%), a value between 1 and 100")
+    parser.add_argument("--class-cutoff",
+                        help="cut off detection scores (%%) for particular classes, e.g. person=50,car=80 or 1=50,3=80")
+    parser.add_argument("--top-k", help="the maximum number of detections to publish per frame, highest scores first")
+    parser.add_argument("--motion-threshold",
+                        help="only send sampled frames where at least this percentage of pixels changed since the last "
+                             "frame that was sent, e.g. 1.0")
+    parser.add_argument("--motion-max-skip",
+                        help="the most sampled frames that can be skipped in a row by --motion-threshold")
+    parser.add_argument("--track", choices=detection_tracking.METRICS,
+                        help="give detections track ids that stay the same across frames, matching them to earlier "
+                             "detections by iou or by the distance between their centers")
+    parser.add_argument("--track-max-age", help="sampled frames an object can go undetected before its track ends")
+    parser.add_argument("--track-velocity", action="store_true",
+                        help="expect tracked objects to keep moving at the same speed, helps at low sample rates")
+    parser.add_argument("--suppress-iou",
+                        help="only publish frames whose detections changed, a detection is unchanged when it overlaps "
+                             "one of the same class last published by at least this iou, e.g. 0.5")
+    parser.add_argument("--keyframe-interval",
+                        help="seconds after which unchanged detections are published anyway with --suppress-iou")
+    parser.add_argument("--fan-out-models",
+                        help="comma separated names of more models to send each frame to, their detections are "
+                             "merged with those of model_name into one message per frame")
+    parser.add_argument("--fan-out-timeout",
+                        help="seconds to wait for all --fan-out-models to respond, models that respond later are "
+                             "left out of the message")
+    parser.add_argument("--serving-endpoints",
+                        help="comma separated host:port addresses of tensorflow serving replicas to spread requests "
+                             "over, hosts without a port use tensorflow_serving_port, defaults to localhost")
+    parser.add_argument("--predict-timeout",
+                        help=f"seconds to wait for a prediction, retries and hedges included, default {PREDICT_TIMEOUT}")
+    parser.add_argument("--endpoint-inflight", help="the most requests in flight at each tensorflow serving endpoint")
+    parser.add_argument("--hedge-delay",
+                        help="seconds after which an unanswered request is also sent to another endpoint")
+    parser.add_argument("--predict-attempts",
+                        help="the most endpoints a request is sent to, counting retries and hedges")
+    parser.add_argument("--frozen-graph",
+                        help="path to a frozen detection graph to run in this process instead of using tensorflow serving")
+    parser.add_argument("--metrics-port",
+                        help="serve per stage latency histograms and frame counters for prometheus on this port")
+    parser.add_argument("--metrics-host",
+                        help="the address --metrics-port listens on, 127.0.0.1 by default, 0.0.0.0 for all interfaces")
+    parser.add_argument("--metrics-log-interval",
+                        help="log per stage latency summaries and frame counters as json every this many seconds")
     parser.add_argument("--dryrun", help="echo a params as json object, don't process anything", action="store_true")
     parser.add_argument("--samplerate", help="how often to retrieve video frames for object detection")
+    parser.add_argument("--target-fps",
+                        help="sample this many frames per second of video instead of using --samplerate")
+    parser.add_argument("--live", action="store_true",
+                        help="for cameras and standard input: always detect the newest frame, dropping frames to keep "
+                             "the time from capture to publishing under --target-latency, --samplerate is not used")
+    parser.add_argument("--target-latency",
+                        help=f"seconds from capturing a frame to publishing it that --live aims to stay under, "
+                             f"default {video_sources.TARGET_LATENCY}")
+    parser.add_argument("--decode-workers",
+                        help="how many images of a directory or glob pattern source are decoded at a time")
+    parser.add_argument("--decode-processes", action="store_true",
+                        help="decode images in processes instead of threads")
+    parser.add_argument("--prefetch", help="the most decoded images waiting for detection")
     parser.add_argument("--instance_name", help="a descriptive name for this detection instance e.g. hostname")
-    args = parser.parse_args()
+    parser.add_argument("--inflight", help="how many prediction requests can await a response from tensorflow serving at a time")
+    parser.add_argument("--queue-size", help="how many frames can wait between the decode, predict and publish stages")
+    parser.add_argument("--batch-size", help="how many sampled frames to send to tensorflow serving in one request")
+    parser.add_argument("--batch-timeout", help="seconds to wait for a batch to fill up before sending a smaller one")
+    parser.add_argument("--frame-encoding", choices=frame_encoding.ENCODINGS,
+                        help="how the frame is placed in published messages, float (default) keeps the original format")
+    parser.add_argument("--frame-quality", help="jpeg quality between 1 and 100 for --frame-encoding jpeg")
+    parser.add_argument("--resize",
+                        help="downscale frames to this size before detection, <width>x<height> e.g. 300x300, "
+                             "or auto to use the model's input size")
+    parser.add_argument("--resize-method", choices=frame_resize.METHODS,
+                        help="how frames are downscaled, nearest (default) is the fastest")
+    parser.add_argument("--publish-frame-size",
+                        help="downscale published frames to <width>x<height>, they are published at full resolution "
+                             "by default whatever --resize is")
+    parser.add_argument("--frame-store", choices=frame_store.STORE_TYPES,
+                        help="write frames to redis keys or a shared memory ring instead of the messages, "
+                             "messages then carry a reference to their frame")
+    parser.add_argument("--frame-store-ttl", help="seconds frames are kept in redis by --frame-store redis")
+    parser.add_argument("--frame-store-path", help="the file backing --frame-store mmap, defaults to one in /dev/shm")
+    parser.add_argument("--frame-store-slots", help="how many frames --frame-store mmap keeps")
+    parser.add_argument("--frame-store-slot-size", help="the largest frame in bytes --frame-store mmap can keep")
+    parser.add_argument("--cache-dir",
+                        help="keep the predictions for video files in this directory, running the same file again "
+                             "with the same model and --resize uses them instead of running inference")
+    parser.add_argument("--cache-max-size", help="megabytes of predictions --cache-dir keeps, the oldest go first")
+    parser.add_argument("--cache-model-version",
+                        help="the tensorflow serving model version to request and key --cache-dir predictions by, "
+                             "predictions from tensorflow serving are only cached with it")
+    parser.add_argument("--archive-dir",
+                        help="also write the filtered detections to numpy chunk files in this directory for offline "
+                             "analysis, see detection_archive.py")
+    parser.add_argument("--archive-chunk-rows", help="how many detections of a source are written to one chunk")
+    parser.add_argument("--archive-flush-interval",
+                        help="seconds after which a source's detections are written to a chunk however few there are")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.DEBUG)
+    args = create_arg_parser().parse_args()
     if args.dryrun:
         print(json.dumps(args.__dict__))
     else:
@@ -1,4 +1,5 @@
 import os
+import glob
 import platform
 import sys
 import hashlib
@@ -39,6 +40,7 @@ def determine_source_name(src):
                 '-' (hyphen): standard input
                 digit: webcam
                 URL: file path
+                a directory of images or a glob pattern matching images
 
         returns a descriptive string e.g. 'device 0'
     """
@@ -46,13 +48,14 @@ def determine_source_name(src):
         return "standard input"
     elif src.isnumeric():
         return f"device {src}"
-    elif os.path.exists(src):
+    elif os.path.exists(src) or glob.has_magic(src):
         return src
 
 
-def filter_detection_output(detection_output_dict, cut_off_score):
+def filter_detection_output_legacy(detection_output_dict, cut_off_score):
     """
     drop all detections from the dict whose score is less than the cut_off_score
+    this is the original implementation of filter_detection_output(), kept to check the vectorized one against
 
     args:
     detection_output_dict - A dict returned frrom running obj_detect.run_inference_for_single_image()
@@ -77,6 +80,118 @@ def filter_detection_output(detection_output_dict, cut_off_score):
     return result
 
 
+def filter_detections(scores, classes, boxes, cut_off_score, class_cut_off_scores=None, top_k=None):
+    """
+    keep detections whose score is at least the cut off score for their class, using one boolean mask
+
+    args:
+    scores - an array-like of detection scores, one per detection
+    classes - an array-like of detection class ids, one per detection
+    boxes - an array-like of detection boxes, one row of 4 values per detection
+    cut_off_score - the minimum score to retain detections which is the percentage divided by 100. e.g. 30% will be passed in as 0.3
+    class_cut_off_scores - optional dict of {class_id: cut_off_score} for classes that use a different cut off score
+    top_k - optional maximum number of detections to keep, the highest scores are kept
+
+    return - a dict with detection_scores, detection_classes (int64) and detection_boxes numpy arrays
+    """
+    scores = numpy.asarray(scores)
+    classes = numpy.asarray(classes).astype(numpy.int64)
+    boxes = numpy.asarray(boxes)
+    if class_cut_off_scores:
+        cut_off_scores = numpy.full(scores.shape, cut_off_score, dtype=numpy.float64)
+        for class_id, class_cut_off_score in class_cut_off_scores.items():
+            cut_off_scores[classes == class_id] = class_cut_off_score
+        retained = numpy.flatnonzero(scores >= cut_off_scores)
+    else:
+        retained = numpy.flatnonzero(scores >= cut_off_score)
+    if top_k is not None and len(retained) > top_k:
+        # a stable sort keeps the original order among equal scores
+        retained = retained[numpy.argsort(-scores[retained], kind='stable')[:top_k]]
+    return {'detection_scores': scores[retained],
+            'detection_classes': classes[retained],
+            'detection_boxes': boxes[retained].reshape(-1, 4)}
+
+
+def iou_matrix(boxes, other_boxes):
+    """
+    the intersection over union of every pair of boxes, computed for all pairs at once
+
+    :param boxes: an array of shape (n, 4) of [ymin, xmin, ymax, xmax] boxes, as in detection_boxes
+    :param other_boxes: an array of shape (m, 4)
+    :return: a float array of shape (n, m)
+    """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 1, 4)
+    other_boxes = numpy.asarray(other_boxes, dtype=numpy.float64).reshape(1, -1, 4)
+    heights = numpy.clip(numpy.minimum(boxes[..., 2], other_boxes[..., 2])
+                         - numpy.maximum(boxes[..., 0], other_boxes[..., 0]), 0, None)
+    widths = numpy.clip(numpy.minimum(boxes[..., 3], other_boxes[..., 3])
+                        - numpy.maximum(boxes[..., 1], other_boxes[..., 1]), 0, None)
+    intersections = heights * widths
+    areas = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    other_areas = (other_boxes[..., 2] - other_boxes[..., 0]) * (other_boxes[..., 3] - other_boxes[..., 1])
+    unions = areas + other_areas - intersections
+    return numpy.divide(intersections, unions, out=numpy.zeros_like(intersections), where=unions > 0)
+
+
+def filter_detection_output(detection_output_dict, cut_off_score, class_cut_off_scores=None, top_k=None):
+    """
+    drop all detections from the dict whose score is less than the cut_off_score
+
+    args:
+    detection_output_dict - A dict returned frrom running obj_detect.run_inference_for_single_image()
+    cut_off_score - the minimum score to retain detections which is the percentage divided by 100. e.g. 30% will be passed in as 0.3
+    class_cut_off_scores, top_k - see filter_detections()
+
+    return - the filtered dict, see filter_detections()
+    """
+    return filter_detections(detection_output_dict['detection_scores'], detection_output_dict['detection_classes'],
+                             detection_output_dict['detection_boxes'], cut_off_score, class_cut_off_scores, top_k)
+
+
+def filter_detection_output_tf_serving(detection_output_dict, cut_off_score, class_cut_off_scores=None, top_k=None):
+    """
+    drop all detections from the protobuf (from tensor flow serving) whose score is less than the cut_off_score
+
+    args:
+    detection_output_dict - the outputs of a tensorflow serving PredictResponse for a single frame
+    cut_off_score - the minimum score to retain detections which is the percentage divided by 100. e.g. 30% will be passed in as 0.3
+    class_cut_off_scores, top_k - see filter_detections()
+
+    return - the filtered dict, see filter_detections()
+    """
+    # drop the batch dimension
+    scores, classes, boxes = (tensor_proto_to_array(detection_output_dict[key])[0]
+                              for key in ('detection_scores', 'detection_classes', 'detection_boxes'))
+    return filter_detections(scores, classes, boxes, cut_off_score, class_cut_off_scores, top_k)
+
+
+def determine_class_cut_off_scores(class_cut_off_arg, category_index):
+    """
+    parse per class cut off scores given as a comma separated list of class=percentage pairs e.g. 'person=50,3=80'
+
+    Args:
+    class_cut_off_arg: the value of an optional arg, classes are ids or names in the category index
+    category_index: the category index dict e.g. {1: {'id': 1, 'name': 'person'}, 3: {'id': 3, 'name': 'car'}}
+
+    returns - a dict of {class_id: cut_off_score} with scores divided by 100 e.g. {1: 0.5, 3: 0.8}, empty if the arg is absent
+    """
+    if not class_cut_off_arg:
+        return {}
+    class_ids = {category['name']: class_id for class_id, category in category_index.items()}
+    class_cut_off_scores = {}
+    for pair in class_cut_off_arg.split(','):
+        class_name, _, percentage = pair.partition('=')
+        class_name = class_name.strip()
+        if class_name.isnumeric():
+            class_id = int(class_name)
+        elif class_name in class_ids:
+            class_id = class_ids[class_name]
+        else:
+            raise ValueError(f'unknown class {class_name} in class cut off scores {class_cut_off_arg}')
+        class_cut_off_scores[class_id] = float(percentage) / 100
+    return class_cut_off_scores
+
+
 def determine_cut_off_score(args, default_cut_off):
     """
     check for cut_off_score in args, if absent return default
@@ -143,9 +258,10 @@ def create_detection_request_id(*args):
     id_str = ''.join(str(x) for x in args)
     return hashlib.sha256(id_str.encode('utf-8')).hexdigest()
 
-def filter_detection_output_tf_serving(detection_output_dict, cut_off_score):
+def filter_detection_output_tf_serving_legacy(detection_output_dict, cut_off_score):
     """
     drop all detections from the protobuf (from tensor flow serving) whose score is less than the cut_off_score
+    this is the original implementation of filter_detection_output_tf_serving(), kept to check the vectorized one against
 
     args:
     detection_output_dict - A dict returned frrom running obj_detect.run_inference_for_single_image()
@@ -181,3 +297,113 @@ def write_protobuf_message_to_file(message):
         #logging.debug(msg_to_string)
         tmp_file.write(msg_to_string)
         logging.debug(f"\nwrote detection request to {tmp_file.name}")
+
+
+# tensorflow DataType enum values mapped to the numpy dtype and the TensorProto field holding their values
+TENSOR_DTYPES = {
+    1: (numpy.float32, 'float_val'),
+    2: (numpy.float64, 'double_val'),
+    3: (numpy.int32, 'int_val'),
+    4: (numpy.uint8, 'int_val'),
+    5: (numpy.int16, 'int_val'),
+    6: (numpy.int8, 'int_val'),
+    9: (numpy.int64, 'int64_val'),
+    10: (numpy.bool_, 'bool_val'),
+    17: (numpy.uint16, 'int_val'),
+}
+
+
+def tensor_proto_to_array(tensor):
+    """
+    convert a TensorProto (e.g. an output in a tensorflow serving PredictResponse) into a numpy array
+    without importing tensorflow
+
+    :param tensor: a TensorProto whose values are either in tensor_content or in the field matching its dtype
+    :return: a numpy array with the tensor's shape
+    """
+    dtype, field = TENSOR_DTYPES[tensor.dtype]
+    shape = [int(dim.size) for dim in tensor.tensor_shape.dim]
+    if tensor.tensor_content:
+        return numpy.frombuffer(tensor.tensor_content, dtype=dtype).reshape(shape)
+    return numpy.array(getattr(tensor, field), dtype=dtype).reshape(shape)
+
+
+def split_prediction_response(prediction_response, frame_total):
+    """
+    split the response to a batched prediction request into one response per frame
+
+    :param prediction_response: a PredictResponse whose outputs have a leading batch dimension of frame_total
+    :param frame_total: the number of frames that were sent in the request
+    :return: a list of PredictResponse objects, one per frame, whose outputs have a leading batch dimension of 1
+    """
+    if frame_total == 1:
+        return [prediction_response]
+    responses = [type(prediction_response)() for _ in range(frame_total)]
+    for key, tensor in prediction_response.outputs.items():
+        values = tensor_proto_to_array(tensor)
+        _, field = TENSOR_DTYPES[tensor.dtype]
+        for response, frame_values in zip(responses, values):
+            frame_tensor = response.outputs[key]
+            frame_tensor.dtype = tensor.dtype
+            frame_tensor.tensor_shape.dim.add(size=1)
+            for size in frame_values.shape:
+                frame_tensor.tensor_shape.dim.add(size=size)
+            # keep the values in the same field as the batched response since consumers may read it directly
+            if tensor.tensor_content:
+                frame_tensor.tensor_content = frame_values.tobytes()
+            else:
+                getattr(frame_tensor, field).extend(frame_values.ravel().tolist())
+    return responses
+
+
+# the tensorflow DataType enum value for each numpy dtype
+NUMPY_TENSOR_DTYPES = {numpy.dtype(dtype): enum_value for enum_value, (dtype, _) in TENSOR_DTYPES.items()}
+
+
+def fill_tensor_proto(tensor, frames):
+    """
+    write a batch of frames into a TensorProto without importing tensorflow, replacing its previous contents
+    the bytes of each frame are copied once, straight into tensor_content
+
+    :param tensor: a TensorProto e.g. prediction_request.inputs['inputs']
+    :param frames: a list of numpy arrays with the same shape and dtype e.g. uint8 frames of shape (height, width, 3)
+    :return: the tensor with shape [len(frames), *frame.shape]
+    """
+    first = frames[0]
+    tensor.dtype = NUMPY_TENSOR_DTYPES[first.dtype]
+    # reuse the dims from the previous batch when the shape is the same
+    shape = (len(frames),) + first.shape
+    if [dim.size for dim in tensor.tensor_shape.dim] != list(shape):
+        tensor.tensor_shape.Clear()
+        for size in shape:
+            tensor.tensor_shape.dim.add(size=size)
+    if len(frames) == 1:
+        tensor.tensor_content = numpy.ascontiguousarray(first).tobytes()
+    else:
+        for frame in frames:
+            if frame.shape != first.shape or frame.dtype != first.dtype:
+                raise ValueError(f'frames in a batch should have the same shape and dtype, '
+                                 f'got {frame.shape} {frame.dtype} and {first.shape} {first.dtype}')
+        tensor.tensor_content = b''.join(numpy.ascontiguousarray(frame).data for frame in frames)
+    return tensor
+
+
+def predict_request_builder(prediction_request, input_name='inputs'):
+    """
+    reuse one PredictRequest for every batch of frames, only its input tensor is replaced
+
+    the request can be reused once it is passed to a grpc stub since the stub serializes it before returning,
+    even for Predict.future()
+
+    :param prediction_request: a PredictRequest with the model_spec set e.g.
+        predict_pb2.PredictRequest(model_spec=model_pb2.ModelSpec(name=model_name))
+    :param input_name: the name of the model's input tensor
+    :return: a function that takes a list of frames and returns the request with the frames as input
+    """
+    tensor = prediction_request.inputs[input_name]
+
+    def build(frames):
+        fill_tensor_proto(tensor, frames)
+        return prediction_request
+
+    return build
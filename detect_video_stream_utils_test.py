@@ -45,6 +45,17 @@ def test_optional_args():
     assert args['instance_name'] == "acer-ubuntu-18", "name differs"
 
 
+def test_dryrun_does_not_import_tensorflow():
+    """ the publisher only needs tensorflow for --frozen-graph, starting it should not load tensorflow """
+    result = subprocess.run(
+        ["python", "-c", "import sys, detect_video_stream_tf_serving; "
+                         "print(','.join(name for name in ('tensorflow.python', 'object_detection', "
+                         "'video_object_detection') if name in sys.modules))"],
+        stdout=subprocess.PIPE)
+    assert result.returncode == 0
+    assert result.stdout.decode().strip() == ''
+
+
 def test_determine_samplerate_no_input():
     sample_rate = detect_video_stream_utils.determine_samplerate(None, detect_video_stream.SAMPLE_RATE)
     assert sample_rate == detect_video_stream.SAMPLE_RATE, "when sample rate is not specified, use default"
@@ -241,3 +252,131 @@ def inactive_test_save_predict_response_to_redis():
     msg_rcvd.ParseFromString(pubsub.get_message()['data'])
     assert msg_rcvd is not None
     assert msg_rcvd.outputs['detection_boxes'] is not None
+
+
+def test_split_prediction_response():
+    msg = predict_pb2.PredictResponse()
+    with open('./samples/predict_response_01.bin', 'rb') as f:
+        msg.ParseFromString(f.read())
+    # simulate the response to a request with two frames by repeating the outputs for a single frame
+    batched = predict_pb2.PredictResponse()
+    for key, tensor in msg.outputs.items():
+        values = detect_video_stream_utils.tensor_proto_to_array(tensor)
+        batched_tensor = batched.outputs[key]
+        batched_tensor.dtype = tensor.dtype
+        for size in (2,) + values.shape[1:]:
+            batched_tensor.tensor_shape.dim.add(size=size)
+        _, field = detect_video_stream_utils.TENSOR_DTYPES[tensor.dtype]
+        getattr(batched_tensor, field).extend(numpy.concatenate([values, values]).ravel().tolist())
+    responses = detect_video_stream_utils.split_prediction_response(batched, 2)
+    assert len(responses) == 2
+    expected = detect_video_stream_utils.filter_detection_output_tf_serving(msg.outputs, .75)
+    for response in responses:
+        result = detect_video_stream_utils.filter_detection_output_tf_serving(response.outputs, .75)
+        assert result['detection_scores'] == pytest.approx(expected['detection_scores'])
+        assert result['detection_classes'] == expected['detection_classes']
+        numpy.testing.assert_allclose(result['detection_boxes'], expected['detection_boxes'])
+
+
+def test_fill_tensor_proto_matches_make_tensor_proto():
+    frames = [numpy.random.randint(0, 256, size=(6, 8, 3)).astype(numpy.uint8) for _ in range(3)]
+    request = predict_pb2.PredictRequest()
+    tensor = detect_video_stream_utils.fill_tensor_proto(request.inputs['inputs'], frames)
+    expected = tf.make_tensor_proto(numpy.stack(frames))
+    assert tensor.dtype == expected.dtype
+    assert tensor.tensor_shape == expected.tensor_shape
+    numpy.testing.assert_array_equal(detect_video_stream_utils.tensor_proto_to_array(tensor), numpy.stack(frames))
+    numpy.testing.assert_array_equal(tf.make_ndarray(tensor), numpy.stack(frames))
+
+
+def test_predict_request_builder_reuses_request():
+    build = detect_video_stream_utils.predict_request_builder(
+        predict_pb2.PredictRequest(model_spec=model_pb2.ModelSpec(name='good model')))
+    first = build([numpy.zeros((4, 4, 3), numpy.uint8)])
+    first_bytes = first.SerializeToString()
+    second = build([numpy.ones((2, 2, 3), numpy.uint8), numpy.ones((2, 2, 3), numpy.uint8)])
+    assert first is second
+    assert second.model_spec.name == 'good model'
+    assert [dim.size for dim in second.inputs['inputs'].tensor_shape.dim] == [2, 2, 2, 3]
+    assert first_bytes != second.SerializeToString()
+
+
+def test_fill_tensor_proto_rejects_mixed_shapes():
+    request = predict_pb2.PredictRequest()
+    with pytest.raises(ValueError):
+        detect_video_stream_utils.fill_tensor_proto(request.inputs['inputs'],
+                                                    [numpy.zeros((4, 4, 3), numpy.uint8),
+                                                     numpy.zeros((2, 4, 3), numpy.uint8)])
+
+
+def test_filter_detection_output_matches_legacy_from_file():
+    import numpy as np
+    with open('samples/output_dict_01.txt', 'r') as f:
+        output_dict = eval(f.read())
+    for cut_off_score in (.05, .1, .14, .5):
+        result = detect_video_stream_utils.filter_detection_output(output_dict, cut_off_score)
+        legacy = detect_video_stream_utils.filter_detection_output_legacy(output_dict, cut_off_score)
+        assert list(result['detection_scores']) == legacy['detection_scores']
+        assert list(result['detection_classes']) == legacy['detection_classes']
+        numpy.testing.assert_array_equal(result['detection_boxes'],
+                                         numpy.array(legacy['detection_boxes']).reshape(-1, 4))
+
+
+def test_filter_detection_output_tf_serving_matches_legacy():
+    msg = predict_pb2.PredictResponse()
+    with open('./samples/predict_response_01.bin', 'rb') as f:
+        msg.ParseFromString(f.read())
+    for cut_off_score in (.05, .3, .75):
+        result = detect_video_stream_utils.filter_detection_output_tf_serving(msg.outputs, cut_off_score)
+        legacy = detect_video_stream_utils.filter_detection_output_tf_serving_legacy(msg.outputs, cut_off_score)
+        assert result['detection_scores'] == pytest.approx(legacy['detection_scores'])
+        assert list(result['detection_classes']) == legacy['detection_classes']
+        assert result['detection_classes'].dtype == numpy.int64
+        numpy.testing.assert_allclose(result['detection_boxes'], legacy['detection_boxes'])
+
+
+def test_filter_detection_output_class_cut_off_scores_and_top_k():
+    output_dict = {'detection_scores': [.9, .7, .6, .55, .3], 'detection_classes': [1, 3, 1, 3, 1],
+                   'detection_boxes': numpy.arange(20).reshape(5, 4)}
+    result = detect_video_stream_utils.filter_detection_output(output_dict, .5, class_cut_off_scores={3: .8})
+    assert list(result['detection_classes']) == [1, 1]
+    assert list(result['detection_scores']) == [.9, .6]
+    numpy.testing.assert_array_equal(result['detection_boxes'], [[0, 1, 2, 3], [8, 9, 10, 11]])
+    result = detect_video_stream_utils.filter_detection_output(output_dict, .5, top_k=2)
+    assert list(result['detection_scores']) == [.9, .7]
+    result = detect_video_stream_utils.filter_detection_output(output_dict, .95)
+    assert result['detection_boxes'].shape == (0, 4)
+
+
+def test_determine_class_cut_off_scores():
+    category_index = {1: {'id': 1, 'name': 'person'}, 3: {'id': 3, 'name': 'car'}}
+    assert detect_video_stream_utils.determine_class_cut_off_scores('person=50,3=80', category_index) == {1: .5, 3: .8}
+    assert detect_video_stream_utils.determine_class_cut_off_scores(None, category_index) == {}
+    with pytest.raises(ValueError):
+        detect_video_stream_utils.determine_class_cut_off_scores('bus=50', category_index)
+
+
+def test_iou_matrix():
+    boxes = numpy.array([[0, 0, 1, 1], [0, 0, 0.5, 0.5]])
+    other_boxes = numpy.array([[0, 0, 1, 1], [0.5, 0.5, 1, 1], [0, 0, 0, 0]])
+    numpy.testing.assert_allclose(detect_video_stream_utils.iou_matrix(boxes, other_boxes),
+                                  [[1, 0.25, 0], [0.25, 0, 0]])
+    assert detect_video_stream_utils.iou_matrix(boxes, numpy.zeros((0, 4))).shape == (2, 0)
+
+
+def test_create_stream_cache_keys_by_the_stream_model(tmp_path):
+    video_path = tmp_path / 'video.mp4'
+    video_path.write_bytes(b'video')
+    resources = mock.Mock(detector=None, detection_cache=mock.Mock())
+    parser = detect_video_stream.create_arg_parser()
+
+    def stream_cache(model_name, version='2'):
+        args = parser.parse_args([str(video_path), 'label_map.pbtxt', '8500', model_name, 'channel',
+                                  '--cache-dir', str(tmp_path)] + (['--cache-model-version', version] if version else []))
+        return detect_video_stream.create_stream_cache(args, resources, None, {})
+
+    # two streams of one supervisor sharing resources but using different models
+    assert stream_cache('ssd_mobilenet_v1_coco').model_key == 'ssd_mobilenet_v1_coco:2'
+    assert stream_cache('faster_rcnn_resnet50_coco').model_key == 'faster_rcnn_resnet50_coco:2'
+    # without a version, a new model served under the same name would get the old predictions
+    assert stream_cache('ssd_mobilenet_v1_coco', version=None) is None
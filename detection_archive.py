@@ -0,0 +1,225 @@
+"""
+archive the filtered detections in columnar chunks for offline analysis, next to publishing them
+
+Every detection is a row of flat columns:
+    request_id: the message's string_map['id']
+    instance: the instance name
+    frame_count: the frame's position in the video
+    timestamp: seconds since the epoch when the detection was archived
+    class_id, score: the detection's class and score
+    box: [ymin, xmin, ymax, xmax] normalized
+Rows are buffered per source and written as a numpy .npz chunk once CHUNK_ROWS rows are buffered or FLUSH_INTERVAL
+seconds after the first of them, by a background thread, so memory stays bounded however long a stream runs.
+Chunks are written to a directory per source, named after the first and last timestamp in them, so a scan by source
+and time only opens the chunks that overlap the time range, see scan().
+
+    archive/
+        <source key>/
+            1565000000.000000-1565000060.000000-000000.npz
+"""
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy
+
+CHUNK_ROWS = 10000
+# seconds
+FLUSH_INTERVAL = 60.0
+# the chunks that can wait to be written before adding detections waits
+QUEUE_SIZE = 4
+COLUMNS = ('request_id', 'instance', 'frame_count', 'timestamp', 'class_id', 'score', 'box')
+CHUNK_SUFFIX = '.npz'
+
+
+def source_key(source):
+    """ the name of a source's directory in the archive """
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+
+
+class SourceBuffer(object):
+    """ the rows of one source waiting to be written """
+
+    def __init__(self):
+        self.columns = {column: [] for column in COLUMNS}
+        self.rows = 0
+        self.started = None
+
+    def add(self, request_id, instance, frame_count, timestamp, output_dict):
+        classes = output_dict['detection_classes']
+        count = len(classes)
+        if self.started is None:
+            self.started = time.monotonic()
+        self.columns['request_id'].append(numpy.full(count, request_id))
+        self.columns['instance'].append(numpy.full(count, instance))
+        self.columns['frame_count'].append(numpy.full(count, frame_count, dtype=numpy.int64))
+        self.columns['timestamp'].append(numpy.full(count, timestamp, dtype=numpy.float64))
+        self.columns['class_id'].append(numpy.asarray(classes, dtype=numpy.int32))
+        self.columns['score'].append(numpy.asarray(output_dict['detection_scores'], dtype=numpy.float32))
+        self.columns['box'].append(numpy.asarray(output_dict['detection_boxes'], dtype=numpy.float32).reshape(-1, 4))
+        self.rows += count
+
+    def chunk(self):
+        """ returns a dict of the buffered columns joined into arrays """
+        return {column: numpy.concatenate(values) for column, values in self.columns.items()}
+
+
+class DetectionArchive(object):
+    """ buffers detections per source and writes them to chunk files in a background thread """
+
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS, flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        """
+        :param directory: created if it does not exist
+        :param chunk_rows: a source's buffered rows are written once there are this many
+        :param flush_interval: seconds after which a source's buffered rows are written however many there are
+        :param queue_size: the chunks that can wait to be written, add() waits when there are more
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        # source: SourceBuffer
+        self.buffers = {}
+        self.lock = threading.Lock()
+        # held while checking closed and queuing a chunk, so close() never drains the queue before a chunk lands
+        self.put_lock = threading.Lock()
+        self.chunks = queue.Queue(maxsize=queue_size)
+        self.sequence = 0
+        self.closed = threading.Event()
+        self.rows = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name='DetectionArchive', daemon=True)
+        self.thread.start()
+
+    def add(self, source, instance, request_id, frame_count, output_dict, timestamp=None):
+        """
+        buffer the detections of a frame
+
+        :param output_dict: the filtered detections, see detect_video_stream_utils.filter_detection_output()
+        :param timestamp: seconds since the epoch, now if absent
+        """
+        if self.closed.is_set():
+            raise ValueError('the archive is closed')
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            source_buffer = self.buffers.setdefault(source, SourceBuffer())
+            source_buffer.add(request_id, instance, frame_count, timestamp, output_dict)
+            full = source_buffer.rows >= self.chunk_rows
+            if full:
+                del self.buffers[source]
+        if full:
+            # outside the lock, the writer may take a while to make room
+            with self.put_lock:
+                if not self.closed.is_set():
+                    self.chunks.put((source, source_buffer))
+                    return
+            # closed meanwhile, the writer thread may be gone
+            self._write(source, source_buffer)
+
+    def _flush_stale(self, everything=False):
+        now = time.monotonic()
+        with self.lock:
+            stale = [(source, source_buffer) for source, source_buffer in self.buffers.items()
+                     if everything or now - source_buffer.started >= self.flush_interval]
+            for source, _ in stale:
+                del self.buffers[source]
+        for source, source_buffer in stale:
+            self._write(source, source_buffer)
+
+    def _write(self, source, source_buffer):
+        """ write a chunk, counting its rows as written or, whatever went wrong, as failed """
+        try:
+            self._write_chunk(source, source_buffer)
+            written = True
+        except Exception:
+            # the writer thread keeps going, or add() would wait forever once the queue is full
+            logging.exception(f'failed to write a detection archive chunk of {source}')
+            written = False
+        with self.lock:
+            if written:
+                self.rows += source_buffer.rows
+            else:
+                self.failed += source_buffer.rows
+
+    def _write_chunk(self, source, source_buffer):
+        chunk = source_buffer.chunk()
+        source_directory = os.path.join(self.directory, source_key(source))
+        os.makedirs(source_directory, exist_ok=True)
+        with self.lock:
+            sequence = self.sequence
+            self.sequence += 1
+        name = f"{chunk['timestamp'].min():.6f}-{chunk['timestamp'].max():.6f}-{sequence:06d}{CHUNK_SUFFIX}"
+        path = os.path.join(source_directory, name)
+        # scans never see a partly written chunk
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as f:
+            numpy.savez(f, source=numpy.array(source), **chunk)
+        os.replace(temporary_path, path)
+
+    def _run(self):
+        while not self.closed.is_set():
+            try:
+                source, source_buffer = self.chunks.get(timeout=min(self.flush_interval, 1.0))
+                self._write(source, source_buffer)
+            except queue.Empty:
+                pass
+            self._flush_stale()
+
+    def close(self):
+        """ write what is buffered and stop the background thread """
+        with self.put_lock:
+            self.closed.set()
+        self.thread.join()
+        while not self.chunks.empty():
+            self._write(*self.chunks.get())
+        self._flush_stale(everything=True)
+
+
+def chunk_paths(directory, source=None, start=None, end=None):
+    """ the paths of the chunks of a source, or of all sources, that may have rows between start and end """
+    sources = [source_key(source)] if source is not None else sorted(os.listdir(directory))
+    paths = []
+    for key in sources:
+        source_directory = os.path.join(directory, key)
+        if not os.path.isdir(source_directory):
+            continue
+        for name in os.listdir(source_directory):
+            if not name.endswith(CHUNK_SUFFIX):
+                continue
+            first, last, _ = name[:-len(CHUNK_SUFFIX)].split('-')
+            if (start is None or float(last) >= start) and (end is None or float(first) <= end):
+                paths.append((float(first), os.path.join(source_directory, name)))
+    return [path for _, path in sorted(paths)]
+
+
+def scan(directory, source=None, start=None, end=None):
+    """
+    read the archived rows of a source, or of all sources, with timestamps between start and end inclusive
+
+    returns a generator of dicts with the COLUMNS and 'source' as arrays, one per chunk, in timestamp order of the
+    chunks' first rows
+    """
+    for path in chunk_paths(directory, source, start, end):
+        with numpy.load(path) as chunk:
+            columns = {column: chunk[column] for column in COLUMNS}
+            chunk_source = str(chunk['source'])
+        selected = numpy.ones(len(columns['timestamp']), dtype=bool)
+        if start is not None:
+            selected &= columns['timestamp'] >= start
+        if end is not None:
+            selected &= columns['timestamp'] <= end
+        if not selected.all():
+            columns = {column: values[selected] for column, values in columns.items()}
+        columns['source'] = numpy.full(len(columns['timestamp']), chunk_source)
+        yield columns
+
+
+def read(directory, source=None, start=None, end=None):
+    """ the rows scan() returns joined into one dict of arrays """
+    chunks = list(scan(directory, source, start, end))
+    if not chunks:
+        return {}
+    return {column: numpy.concatenate([chunk[column] for chunk in chunks]) for column in chunks[0]}
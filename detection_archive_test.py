@@ -0,0 +1,99 @@
+import os
+
+import numpy
+
+import detection_archive
+
+
+def detections(count, class_id=1):
+    return {'detection_classes': numpy.full(count, class_id, dtype=numpy.int64),
+            'detection_scores': numpy.linspace(0.5, 1, count).astype(numpy.float32),
+            'detection_boxes': numpy.tile(numpy.array([0.1, 0.2, 0.3, 0.4], dtype=numpy.float32), (count, 1))}
+
+
+def test_archive_writes_chunks_by_row_count(tmp_path):
+    archive = detection_archive.DetectionArchive(str(tmp_path), chunk_rows=4, flush_interval=60)
+    for frame_count in range(5):
+        archive.add('cam1', 'box1', f'id{frame_count}', frame_count, detections(2), timestamp=1000.0 + frame_count)
+    archive.close()
+    paths = detection_archive.chunk_paths(str(tmp_path), 'cam1')
+    # 2 full chunks of 4 rows and the remaining 2 rows written on close
+    assert len(paths) == 3
+    rows = detection_archive.read(str(tmp_path), 'cam1')
+    assert rows['frame_count'].tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+    assert rows['request_id'][2] == 'id1'
+    assert rows['box'].shape == (10, 4)
+    assert set(rows['source'].tolist()) == {'cam1'}
+    assert set(rows['instance'].tolist()) == {'box1'}
+    assert archive.rows == 10
+
+
+def test_archive_writes_chunks_after_flush_interval(tmp_path):
+    archive = detection_archive.DetectionArchive(str(tmp_path), chunk_rows=1000, flush_interval=0.05)
+    archive.add('cam1', 'box1', 'id0', 0, detections(3))
+    for _ in range(100):
+        if detection_archive.chunk_paths(str(tmp_path)):
+            break
+        archive.thread.join(0.02)
+    assert len(detection_archive.chunk_paths(str(tmp_path))) == 1
+    archive.close()
+
+
+def test_scan_selects_source_and_time_range(tmp_path):
+    archive = detection_archive.DetectionArchive(str(tmp_path), chunk_rows=2, flush_interval=60)
+    for frame_count in range(6):
+        archive.add('cam1', 'box1', f'a{frame_count}', frame_count, detections(1, 3), timestamp=100.0 + frame_count)
+        archive.add('cam2', 'box1', f'b{frame_count}', frame_count, detections(1, 5), timestamp=100.0 + frame_count)
+    archive.close()
+    # chunks outside the time range are not opened
+    assert len(detection_archive.chunk_paths(str(tmp_path), 'cam1', start=102.5, end=103.5)) == 1
+    rows = detection_archive.read(str(tmp_path), 'cam1', start=102.5, end=104)
+    assert rows['frame_count'].tolist() == [3, 4]
+    assert rows['class_id'].tolist() == [3, 3]
+    assert len(detection_archive.read(str(tmp_path), start=102.5, end=104)['frame_count']) == 4
+    assert detection_archive.read(str(tmp_path), 'cam3') == {}
+    assert not [name for name in os.listdir(tmp_path / detection_archive.source_key('cam1')) if name.endswith('.tmp')]
+
+
+def test_archive_keeps_writing_after_a_chunk_fails(tmp_path, monkeypatch):
+    savez = numpy.savez
+    calls = []
+
+    def failing_savez(f, **columns):
+        calls.append(1)
+        if len(calls) == 1:
+            raise ValueError('cannot save')
+        savez(f, **columns)
+
+    monkeypatch.setattr(detection_archive.numpy, 'savez', failing_savez)
+    archive = detection_archive.DetectionArchive(str(tmp_path), chunk_rows=1, flush_interval=60, queue_size=1)
+    # more chunks than the queue holds, add() would wait forever if the writer thread had stopped
+    for frame_count in range(5):
+        archive.add('cam1', 'box1', f'id{frame_count}', frame_count, detections(1), timestamp=1000.0 + frame_count)
+    archive.close()
+    assert archive.failed == 1
+    assert archive.rows == 4
+    assert detection_archive.read(str(tmp_path), 'cam1')['frame_count'].tolist() == [1, 2, 3, 4]
+
+
+def test_archive_writes_chunks_added_while_closing(tmp_path):
+    archive = detection_archive.DetectionArchive(str(tmp_path), chunk_rows=1, flush_interval=60)
+    archive.add('cam1', 'box1', 'id0', 0, detections(1), timestamp=1000.0)
+    put_lock = archive.put_lock
+
+    class ClosingLock(object):
+        """ close() begins after add() checked closed but before it queues its chunk """
+
+        def __enter__(self):
+            archive.closed.set()
+            return put_lock.__enter__()
+
+        def __exit__(self, *exc_info):
+            return put_lock.__exit__(*exc_info)
+
+    archive.put_lock = ClosingLock()
+    archive.add('cam1', 'box1', 'id1', 1, detections(1), timestamp=1001.0)
+    archive.close()
+    assert archive.chunks.empty()
+    assert archive.rows == 2
+    assert detection_archive.read(str(tmp_path), 'cam1')['frame_count'].tolist() == [0, 1]
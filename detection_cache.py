@@ -0,0 +1,209 @@
+"""
+a persistent cache of the predictions for the frames of file sources, so re-running a video skips inference for
+the frames it has already seen
+
+Predictions are keyed by the model, a hash of the source file's content, the frame index and the preprocessing
+settings, so a changed file, model or resize setting misses the cache.
+
+On disk, a cache is a directory of append-only segments, each a data file holding the serialized predictions and
+an index file of fixed size records (key digest, offset, length) into it. The indexes are read when the cache is
+opened and the data files are memory mapped for reading. Once a segment reaches its size a new one is started and
+when the segments add up to more than max_size the oldest ones are deleted with their predictions.
+Only one process should write to a cache directory at a time, the streams of a process can share it.
+"""
+import hashlib
+import io
+import logging
+import mmap
+import os
+import threading
+
+import numpy
+
+# bytes
+MAX_SIZE = 1024 ** 3
+SEGMENT_COUNT = 8
+HASH_CHUNK_SIZE = 1024 * 1024
+INDEX_DTYPE = numpy.dtype([('key', 'S32'), ('offset', '<i8'), ('length', '<i8')])
+DATA_SUFFIX = '.data'
+INDEX_SUFFIX = '.index'
+
+
+def source_content_hash(path, chunk_size=HASH_CHUNK_SIZE):
+    """ the sha256 hex digest of a file's content """
+    content_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def cache_key(model_key, source_hash, frame_index, preprocessing_key):
+    """ the 32 byte digest a prediction is stored under """
+    return hashlib.sha256(f'{model_key}\0{source_hash}\0{frame_index}\0{preprocessing_key}'.encode('utf-8')).digest()
+
+
+def encode_arrays(arrays):
+    """ serialize a dict of numpy arrays e.g. a prediction from video_object_detection.LocalDetector """
+    buffer = io.BytesIO()
+    numpy.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def decode_arrays(data):
+    with numpy.load(io.BytesIO(data)) as arrays:
+        return {name: arrays[name] for name in arrays.files}
+
+
+class Segment(object):
+    """ one data file and its index """
+
+    def __init__(self, path_prefix):
+        self.data_path = path_prefix + DATA_SUFFIX
+        self.index_path = path_prefix + INDEX_SUFFIX
+        for path in (self.data_path, self.index_path):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        index = numpy.fromfile(self.index_path, dtype=INDEX_DTYPE)
+        self.size = os.path.getsize(self.data_path)
+        # the records after a partly written record, or one past the end of the data, e.g. the process was killed
+        # while writing, are dropped from the file too, so the records appended next line up and are not taken
+        # for valid ones once the data grows past them
+        valid = (index['offset'] >= 0) & (index['length'] >= 0) & (index['offset'] + index['length'] <= self.size)
+        records = len(index) if valid.all() else int(numpy.argmin(valid))
+        if records * INDEX_DTYPE.itemsize != os.path.getsize(self.index_path):
+            logging.warning(f'dropping the incomplete records at the end of {self.index_path}')
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(records * INDEX_DTYPE.itemsize)
+        self.entries = {bytes(key): (int(offset), int(length)) for key, offset, length in index[:records].tolist()}
+        self.data_file = open(self.data_path, 'ab')
+        self.index_file = open(self.index_path, 'ab')
+        self.buffer = None
+
+    def append(self, key, value):
+        offset = self.size
+        self.data_file.write(value)
+        self.data_file.flush()
+        self.index_file.write(numpy.array([(key, offset, len(value))], dtype=INDEX_DTYPE).tobytes())
+        self.index_file.flush()
+        self.size += len(value)
+        self.entries[key] = (offset, len(value))
+
+    def read(self, key):
+        offset, length = self.entries[key]
+        if self.buffer is None or len(self.buffer) < offset + length:
+            # map the data again once it has grown past the mapped part
+            if self.buffer is not None:
+                self.buffer.close()
+            with open(self.data_path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.buffer[offset:offset + length]
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+        if self.buffer is not None:
+            self.buffer.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.data_path)
+        os.remove(self.index_path)
+
+
+class DetectionCache(object):
+    """ the predictions in a cache directory, by cache_key() """
+
+    def __init__(self, directory, max_size=MAX_SIZE, segment_count=SEGMENT_COUNT):
+        """
+        :param directory: created if it does not exist
+        :param max_size: the bytes of predictions kept, the oldest are deleted beyond it
+        :param segment_count: how many segments max_size is split into, a segment is the unit of deletion
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.segment_size = max(1, max_size // segment_count)
+        self.lock = threading.Lock()
+        numbers = sorted(int(name[:-len(DATA_SUFFIX)]) for name in os.listdir(directory)
+                         if name.endswith(DATA_SUFFIX) and name[:-len(DATA_SUFFIX)].isdigit())
+        self.segments = [Segment(self._segment_prefix(number)) for number in numbers]
+        self.next_number = numbers[-1] + 1 if numbers else 0
+        if not self.segments:
+            self._start_segment()
+        # key: the segment holding it, later segments override earlier ones
+        self.index = {key: segment for segment in self.segments for key in segment.entries}
+
+    def _segment_prefix(self, number):
+        return os.path.join(self.directory, f'{number:08d}')
+
+    def _start_segment(self):
+        self.segments.append(Segment(self._segment_prefix(self.next_number)))
+        self.next_number += 1
+
+    def size(self):
+        return sum(segment.size for segment in self.segments)
+
+    def get(self, key):
+        """ returns the bytes stored under key, None if they are not in the cache """
+        with self.lock:
+            segment = self.index.get(key)
+            return segment.read(key) if segment else None
+
+    def put(self, key, value):
+        """ store value under key, deleting the oldest segments if the cache grows beyond max_size """
+        with self.lock:
+            if self.segments[-1].size >= self.segment_size:
+                self._start_segment()
+            self.segments[-1].append(key, value)
+            self.index[key] = self.segments[-1]
+            while len(self.segments) > 1 and self.size() > self.max_size:
+                oldest = self.segments.pop(0)
+                for old_key in oldest.entries:
+                    if self.index.get(old_key) is oldest:
+                        del self.index[old_key]
+                oldest.delete()
+                logging.debug(f'deleted detection cache segment {oldest.data_path}')
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                segment.close()
+
+    def __len__(self):
+        return len(self.index)
+
+
+class StreamCache(object):
+    """ the view of a DetectionCache for one stream, used by detect_video_stream_pipeline.predict_frames() """
+
+    def __init__(self, cache, model_key, source_hash, preprocessing_key, encode, decode, stats=None):
+        """
+        :param cache: a DetectionCache
+        :param model_key: identifies the model and its version e.g. 'ssd_mobilenet_v1_coco:1'
+        :param source_hash: see source_content_hash()
+        :param preprocessing_key: identifies the settings that change the frames sent to the model e.g. the resize
+        :param encode: serializes the prediction for a frame
+        :param decode: the reverse of encode
+        :param stats: an optional collections.Counter updated with 'cache_hits' and 'cache_misses'
+        """
+        self.cache = cache
+        self.model_key = model_key
+        self.source_hash = source_hash
+        self.preprocessing_key = preprocessing_key
+        self.encode = encode
+        self.decode = decode
+        self.stats = stats if stats is not None else {}
+
+    def _key(self, frame_count):
+        return cache_key(self.model_key, self.source_hash, frame_count, self.preprocessing_key)
+
+    def get(self, frame_count):
+        """ returns the cached prediction for the frame, None if it is not cached """
+        value = self.cache.get(self._key(frame_count))
+        counter = 'cache_misses' if value is None else 'cache_hits'
+        self.stats[counter] = self.stats.get(counter, 0) + 1
+        return None if value is None else self.decode(value)
+
+    def put(self, frame_count, prediction):
+        self.cache.put(self._key(frame_count), self.encode(prediction))
@@ -0,0 +1,116 @@
+import collections
+from concurrent import futures
+
+import numpy
+
+import detect_video_stream_pipeline
+import detection_cache
+import video_sources
+
+
+def test_detection_cache_keeps_predictions_across_restarts(tmp_path):
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    key = detection_cache.cache_key('ssd:1', 'abc', 7, '300x300:nearest')
+    assert cache.get(key) is None
+    cache.put(key, b'prediction')
+    assert cache.get(key) == b'prediction'
+    cache.close()
+
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    assert cache.get(key) == b'prediction'
+    assert cache.get(detection_cache.cache_key('ssd:1', 'abc', 8, '300x300:nearest')) is None
+    assert cache.get(detection_cache.cache_key('ssd:2', 'abc', 7, '300x300:nearest')) is None
+    cache.close()
+
+
+def test_detection_cache_deletes_oldest_predictions_beyond_max_size(tmp_path):
+    cache = detection_cache.DetectionCache(str(tmp_path), max_size=1000, segment_count=4)
+    keys = [detection_cache.cache_key('ssd', 'abc', frame_count, '') for frame_count in range(20)]
+    for key in keys:
+        cache.put(key, bytes(100))
+    assert cache.size() <= 1000
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[-1]) == bytes(100)
+    assert len(cache) == len([key for key in keys if cache.get(key) is not None])
+    cache.close()
+
+
+def test_detection_cache_ignores_incomplete_records(tmp_path):
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    first, second = (detection_cache.cache_key('ssd', 'abc', frame_count, '') for frame_count in range(2))
+    cache.put(first, b'first')
+    cache.put(second, b'second')
+    data_path = cache.segments[-1].data_path
+    cache.close()
+    # the process was killed after writing the index record but before all the data
+    with open(data_path, 'r+b') as f:
+        f.truncate(len(b'first') + 2)
+
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    assert cache.get(first) == b'first'
+    assert cache.get(second) is None
+    cache.close()
+
+
+def test_encode_arrays_round_trip():
+    arrays = {'detection_scores': numpy.array([0.9, 0.5], dtype=numpy.float32),
+              'detection_boxes': numpy.zeros((2, 4), dtype=numpy.float32), 'num_detections': 2}
+    decoded = detection_cache.decode_arrays(detection_cache.encode_arrays(arrays))
+    numpy.testing.assert_array_equal(decoded['detection_scores'], arrays['detection_scores'])
+    assert decoded['detection_boxes'].shape == (2, 4)
+    assert int(decoded['num_detections']) == 2
+
+
+def test_run_pipeline_skips_inference_for_cached_frames(tmp_path):
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    predicted = []
+
+    def predict_async(frames):
+        predicted.extend(frames)
+        future = futures.Future()
+        future.set_result([[frame * 10] for frame in frames])
+        return future
+
+    def run(stats, sample_rate=2):
+        handled = []
+        stream_cache = detection_cache.StreamCache(cache, 'ssd', 'abc', '', encode=lambda values: bytes(values),
+                                                   decode=list, stats=stats)
+        detect_video_stream_pipeline.run_pipeline(
+            video_sources.sample_every(range(10), sample_rate), predict_async,
+            lambda frame_count, frame, prediction: handled.append((frame_count, prediction)) or True,
+            batch_size=2, cache=stream_cache, stats=stats)
+        return handled
+
+    first = run(collections.Counter())
+    assert predicted == [0, 2, 4, 6, 8]
+    stats = collections.Counter()
+    assert run(stats) == first == [(frame, [frame * 10]) for frame in range(0, 10, 2)]
+    assert predicted == [0, 2, 4, 6, 8]
+    assert stats['cache_hits'] == 5
+    # batches mixing cached and new frames only send the new ones and keep the frame order
+    assert run(collections.Counter(), sample_rate=1) == [(frame, [frame * 10]) for frame in range(10)]
+    assert predicted == [0, 2, 4, 6, 8, 1, 3, 5, 7, 9]
+    cache.close()
+
+
+def test_detection_cache_drops_partly_written_index_records(tmp_path):
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    first, second, third = (detection_cache.cache_key('ssd', 'abc', frame_count, '') for frame_count in range(3))
+    cache.put(first, b'first')
+    index_path = cache.segments[-1].index_path
+    cache.close()
+    # the process was killed in the middle of writing an index record, one with a negative offset
+    record = numpy.array([(second, -3, 2)], dtype=detection_cache.INDEX_DTYPE).tobytes()
+    with open(index_path, 'ab') as f:
+        f.write(record + record[:10])
+
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    assert cache.get(second) is None
+    # records appended after reopening line up with the earlier ones
+    cache.put(third, b'third')
+    cache.close()
+    cache = detection_cache.DetectionCache(str(tmp_path))
+    assert cache.get(first) == b'first'
+    assert cache.get(third) == b'third'
+    assert cache.get(second) is None
+    cache.close()
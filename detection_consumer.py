@@ -0,0 +1,331 @@
+"""
+consume the detection messages published to redis with asyncio handlers
+
+Messages are read from a pub/sub channel or a redis stream in batches and deserialized a batch at a time.
+Each message is wrapped in a Detection, which only decodes the frame when a handler asks for it. A raw frame is a
+read only view of the bytes read from the message or frame store, while the scores, classes and boxes are copied out
+of the message into numpy arrays the first time they are used. Payloads that are not messages are logged, counted
+as 'malformed' and skipped. Every handler has its own bounded queue and a number of tasks consuming it,
+so a slow handler holds back reading instead of piling up messages, and handlers run concurrently with each other.
+
+For each handler, metrics (see metrics.py) labelled with the handler's name record
+    'lag': seconds from reading a message to the handler starting on it
+    'publish_lag': seconds from publishing a message to the handler starting on it, for streams, whose entry ids
+        carry the time they were added
+    'handle': seconds the handler took
+and count the 'handled' and 'failed' messages. The consumer's own metrics, labelled {'consumer': 'read'}, count the
+'read' and 'malformed' payloads.
+
+e.g.
+    consumer = DetectionConsumer(StreamSource(redis.asyncio.Redis(), 'predictions'))
+
+    @consumer.handler(concurrency=4)
+    async def save_people(detection):
+        if 'person' in detection.class_names:
+            await save(await detection.fetch_frame())
+
+    asyncio.run(consumer.run())
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import time
+
+import numpy
+import redis.asyncio
+
+import detection_sinks
+import frame_encoding
+import frame_store
+import metrics
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+BATCH_SIZE = 64
+# the number of messages that can wait for each handler
+QUEUE_SIZE = 256
+CONCURRENCY = 1
+# seconds to wait for messages before checking whether to stop
+READ_TIMEOUT = 1.0
+# marks a frame that has not been decoded yet, None is a message without a frame
+UNSET = object()
+
+
+class PubSubSource(object):
+    """ reads messages published on a redis pub/sub channel, messages published while not subscribed are missed """
+
+    def __init__(self, redis_client, channel_name):
+        """
+        :param redis_client: a redis.asyncio.Redis
+        """
+        self.pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        self.channel_name = channel_name
+        self.subscribed = False
+
+    async def read(self, batch_size, timeout=READ_TIMEOUT):
+        """ returns a list of (payload, publish time or None) tuples, empty if none arrived within timeout seconds """
+        if not self.subscribed:
+            await self.pubsub.subscribe(self.channel_name)
+            self.subscribed = True
+        batch = []
+        message = await self.pubsub.get_message(timeout=timeout)
+        while message is not None:
+            batch.append((message['data'], None))
+            if len(batch) >= batch_size:
+                break
+            # take what has already arrived without waiting
+            message = await self.pubsub.get_message(timeout=0)
+        return batch
+
+    async def close(self):
+        await self.pubsub.close()
+
+
+class StreamSource(object):
+    """ reads a redis stream written by detection_sinks.RedisStreamSink, from new entries onwards by default """
+
+    def __init__(self, redis_client, stream_name, last_id='$'):
+        """
+        :param redis_client: a redis.asyncio.Redis
+        :param last_id: the entry id to read after, '$' for entries added from now on, '0' for the whole stream
+        """
+        self.redis_client = redis_client
+        self.stream_name = stream_name
+        self.last_id = last_id
+
+    async def read(self, batch_size, timeout=READ_TIMEOUT):
+        """ returns a list of (payload, publish time) tuples, empty if none arrived within timeout seconds """
+        response = await self.redis_client.xread({self.stream_name: self.last_id}, count=batch_size,
+                                                 block=int(timeout * 1000))
+        batch = []
+        for _, entries in response:
+            for entry_id, fields in entries:
+                self.last_id = entry_id
+                # entry ids start with the time they were added in milliseconds
+                milliseconds = int(entry_id.split(b'-')[0] if isinstance(entry_id, bytes) else entry_id.split('-')[0])
+                batch.append((fields[detection_sinks.STREAM_FIELD.encode()], milliseconds / 1000))
+        return batch
+
+    async def close(self):
+        pass
+
+
+class Detection(object):
+    """
+    a detection message with numpy views of its detections and its frame decoded on first use
+
+    handlers running in the event loop should await fetch_frame() rather than read frame, fetching a frame from a
+    frame store is blocking and fetch_frame() does it in a worker thread
+    """
+
+    def __init__(self, message, received_time, published_time=None, frame_store=None):
+        """
+        :param message: a detection_handler_pb2.handle_detection_request
+        :param received_time: time.monotonic() when the message was read
+        :param published_time: time.time() when the message was published, if known
+        :param frame_store: the frame store to fetch frames from, see frame_store.py
+        """
+        self.message = message
+        self.received_time = received_time
+        self.published_time = published_time
+        self.frame_store = frame_store
+        # decoded on first use
+        self._frame = UNSET
+        self._scores = None
+        self._classes = None
+        self._boxes = None
+        self._class_names = None
+
+    @property
+    def frame(self):
+        """ the frame as a numpy array, None if the message has none or the stored frame expired """
+        if self._frame is UNSET:
+            self._frame = frame_encoding.decode_frame(self.message, self.frame_store)
+        return self._frame
+
+    async def fetch_frame(self):
+        """ the frame like frame, fetching it from the frame store without blocking the event loop """
+        if self._frame is UNSET and frame_encoding.REF_KEY in self.message.string_map:
+            frame = await asyncio.get_running_loop().run_in_executor(
+                None, frame_encoding.decode_frame, self.message, self.frame_store)
+            if self._frame is UNSET:
+                self._frame = frame
+        return self.frame
+
+    @property
+    def scores(self):
+        if self._scores is None:
+            self._scores = numpy.array(self.message.detection_scores, dtype=numpy.float32)
+        return self._scores
+
+    @property
+    def classes(self):
+        if self._classes is None:
+            self._classes = numpy.array(self.message.detection_classes, dtype=numpy.int64)
+        return self._classes
+
+    @property
+    def boxes(self):
+        """ an array of shape (n, 4) of [ymin, xmin, ymax, xmax] normalized boxes """
+        if self._boxes is None:
+            self._boxes = numpy.array(self.message.detection_boxes.numbers, dtype=numpy.float32).reshape(-1, 4)
+        return self._boxes
+
+    @property
+    def class_names(self):
+        """ the class name of each detection """
+        if self._class_names is None:
+            self._class_names = [self.message.category_index.get(int(class_id), str(class_id))
+                                 for class_id in self.classes]
+        return self._class_names
+
+
+class DetectionConsumer(object):
+    """ reads detection messages from a source and passes each one to every handler """
+
+    def __init__(self, source, batch_size=BATCH_SIZE, frame_store=None, registry=None,
+                 parse=detection_handler_pb2.handle_detection_request.FromString):
+        """
+        :param source: a PubSubSource, a StreamSource or another object with the same read() and close() coroutines
+        :param batch_size: the most messages read and deserialized at a time
+        :param frame_store: passed to each Detection
+        :param registry: the metrics.MetricsRegistry to record the handlers' metrics in, created if absent
+        :param parse: turns a payload into a message
+        """
+        self.source = source
+        self.batch_size = batch_size
+        self.frame_store = frame_store
+        self.registry = registry or metrics.MetricsRegistry()
+        self.parse = parse
+        # name: (handler coroutine function, concurrency, queue size)
+        self.handlers = {}
+        self.read_metrics = self.registry.stream_metrics({'consumer': 'read'})
+
+    def add_handler(self, handler, name=None, concurrency=CONCURRENCY, queue_size=QUEUE_SIZE):
+        """
+        :param handler: a coroutine function taking a Detection
+        :param name: the handler's name in the metrics, the function's name by default
+        :param concurrency: how many messages the handler can work on at a time
+        :param queue_size: how many messages can wait for the handler before reading waits for it
+        """
+        self.handlers[name or handler.__name__] = (handler, concurrency, queue_size)
+        return handler
+
+    def handler(self, name=None, concurrency=CONCURRENCY, queue_size=QUEUE_SIZE):
+        """ a decorator that adds the decorated coroutine function as a handler, see add_handler() """
+        return functools.partial(self.add_handler, name=name, concurrency=concurrency, queue_size=queue_size)
+
+    async def _work(self, handler, handler_queue, handler_metrics):
+        while True:
+            detection = await handler_queue.get()
+            start = time.monotonic()
+            handler_metrics.observe('lag', start - detection.received_time)
+            if detection.published_time is not None:
+                handler_metrics.observe('publish_lag', max(0.0, time.time() - detection.published_time))
+            try:
+                await handler(detection)
+                handler_metrics.increment('handled')
+            except Exception:
+                logging.exception(f'failed to handle message {detection.message.string_map.get("id")}')
+                handler_metrics.increment('failed')
+            finally:
+                handler_metrics.observe('handle', time.monotonic() - start)
+                handler_queue.task_done()
+
+    async def run(self, stop=None, read_timeout=READ_TIMEOUT):
+        """
+        read and handle messages until stop is set, then let the handlers finish the messages already read
+
+        :param stop: an asyncio.Event, messages are read until the task is cancelled if absent
+        :param read_timeout: seconds to wait for messages before checking stop
+        """
+        if not self.handlers:
+            raise ValueError('add a handler before running the consumer')
+        queues = []
+        workers = []
+        for name, (handler, concurrency, queue_size) in self.handlers.items():
+            handler_queue = asyncio.Queue(maxsize=queue_size)
+            handler_metrics = self.registry.stream_metrics({'handler': name})
+            queues.append(handler_queue)
+            workers.extend(asyncio.create_task(self._work(handler, handler_queue, handler_metrics))
+                           for _ in range(concurrency))
+        try:
+            while stop is None or not stop.is_set():
+                batch = await self.source.read(self.batch_size, read_timeout)
+                received_time = time.monotonic()
+                detections = []
+                for payload, published_time in batch:
+                    try:
+                        message = self.parse(payload)
+                    except Exception as e:
+                        # anyone can publish to a channel, one stray payload must not stop the consumer
+                        logging.warning(f'skipping a payload of {len(payload)} bytes that is not a message: {e!r}')
+                        self.read_metrics.increment('malformed')
+                        continue
+                    detections.append(Detection(message, received_time, published_time, self.frame_store))
+                self.read_metrics.increment('read', len(batch))
+                for detection in detections:
+                    for handler_queue in queues:
+                        await handler_queue.put(detection)
+            for handler_queue in queues:
+                await handler_queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.source.close()
+
+
+async def log_detection(detection):
+    """ log a one line summary of a message, without its frame """
+    message = detection.message
+    summary = ', '.join(f'{name} {score:.2f}' for name, score in zip(detection.class_names, detection.scores))
+    logging.info(f'{message.instance_name} {message.source} frame {message.frame_count}: {summary}')
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="log the detection messages published to redis")
+    parser.add_argument("channel_name", help="the channel or stream the detections are published to")
+    parser.add_argument("--redis-url", help="e.g. redis://localhost:6379/0, defaults to redis on localhost")
+    parser.add_argument("--sink", choices=detection_sinks.SINK_TYPES, default=detection_sinks.PUBSUB,
+                        help="read from a pub/sub channel (default) or a redis stream")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="the most messages to read at a time")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="how many messages the handler works on at a time")
+    parser.add_argument("--metrics-port", type=int, help="serve the handler metrics for prometheus on this port")
+    parser.add_argument("--metrics-host", default=metrics.HOST,
+                        help="the address --metrics-port listens on, 0.0.0.0 for all interfaces")
+    parser.add_argument("--frame-store", choices=frame_store.STORE_TYPES,
+                        help="where the publisher's --frame-store keeps frames")
+    parser.add_argument("--frame-store-path", default=frame_store.MMAP_PATH,
+                        help="the file backing --frame-store mmap")
+    args = parser.parse_args()
+
+    async def main():
+        redis_client = redis.asyncio.Redis.from_url(args.redis_url) if args.redis_url else redis.asyncio.Redis()
+        if args.sink == detection_sinks.STREAM:
+            source = StreamSource(redis_client, args.channel_name)
+        else:
+            source = PubSubSource(redis_client, args.channel_name)
+        store = None
+        if args.frame_store:
+            # Detection.fetch_frame() reads the store in a worker thread, so it gets a blocking client
+            store = frame_store.create_frame_store(args.frame_store, redis.Redis.from_url(args.redis_url)
+                                                   if args.redis_url else redis.Redis(),
+                                                   path=args.frame_store_path, create=False)
+        consumer = DetectionConsumer(source, args.batch_size, store)
+        consumer.add_handler(log_detection, concurrency=args.concurrency)
+        server = metrics.MetricsServer(consumer.registry, args.metrics_port, args.metrics_host) \
+            if args.metrics_port else None
+        try:
+            await consumer.run()
+        finally:
+            if server:
+                server.close()
+            await redis_client.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,147 @@
+import asyncio
+
+import numpy
+
+import detection_consumer
+import fake_services
+import frame_encoding
+import frame_store
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+
+class ListSource(object):
+    """ hands out the payloads in batches, then sets stop """
+
+    def __init__(self, payloads, stop, published_time=None):
+        self.payloads = list(payloads)
+        self.stop = stop
+        self.published_time = published_time
+        self.batch_sizes = []
+        self.closed = False
+
+    async def read(self, batch_size, timeout):
+        batch, self.payloads = self.payloads[:batch_size], self.payloads[batch_size:]
+        self.batch_sizes.append(len(batch))
+        if not self.payloads:
+            self.stop.set()
+        return [(payload, self.published_time) for payload in batch]
+
+    async def close(self):
+        self.closed = True
+
+
+def create_payload(frame_count, frame=None):
+    frame_numbers, string_map = (None, {}) if frame is None else frame_encoding.encode_frame(frame, frame_encoding.RAW)
+    string_map['id'] = str(frame_count)
+    return detection_handler_pb2.handle_detection_request(
+        frame_count=frame_count, detection_scores=[0.9, 0.6], detection_classes=[1.0, 3.0],
+        detection_boxes=detection_handler_pb2.float_array(numbers=[0.1, 0.1, 0.5, 0.5, 0.2, 0.2, 0.6, 0.6],
+                                                          shape=[2, 4]),
+        category_index={1: 'person', 3: 'car'}, string_map=string_map).SerializeToString()
+
+
+def test_consumer_dispatches_batches_to_every_handler():
+    async def run():
+        stop = asyncio.Event()
+        source = ListSource([create_payload(i) for i in range(10)], stop)
+        consumer = detection_consumer.DetectionConsumer(source, batch_size=4)
+        handled = {'first': [], 'second': []}
+
+        @consumer.handler(concurrency=2)
+        async def first(detection):
+            handled['first'].append(detection.message.frame_count)
+
+        @consumer.handler(name='second')
+        async def record(detection):
+            await asyncio.sleep(0.001)
+            handled['second'].append(detection.message.frame_count)
+            assert detection.class_names == ['person', 'car']
+            assert detection.boxes.shape == (2, 4)
+
+        await consumer.run(stop)
+        return source, consumer, handled
+
+    source, consumer, handled = asyncio.run(run())
+    assert source.batch_sizes == [4, 4, 2]
+    assert source.closed
+    assert sorted(handled['first']) == list(range(10))
+    assert handled['second'] == list(range(10))
+    summaries = {summary['labels'].get('handler'): summary for summary in consumer.registry.summary()}
+    assert summaries['second']['counters'] == {'handled': 10}
+    assert summaries['second']['stages']['lag']['count'] == 10
+    assert 'publish_lag' not in summaries['second']['stages']
+
+
+def test_consumer_skips_malformed_payloads():
+    async def run():
+        stop = asyncio.Event()
+        consumer = detection_consumer.DetectionConsumer(
+            ListSource([create_payload(1), b'\xff\xff\xff not a message', create_payload(2)], stop))
+        handled = []
+
+        @consumer.handler()
+        async def record(detection):
+            handled.append(detection.message.frame_count)
+
+        await consumer.run(stop)
+        return consumer, handled
+
+    consumer, handled = asyncio.run(run())
+    assert handled == [1, 2]
+    assert consumer.read_metrics.counters == {'read': 3, 'malformed': 1}
+
+
+def test_consumer_decodes_frames_lazily_and_counts_failures():
+    frame = numpy.random.RandomState(5).randint(0, 256, size=(6, 8, 3)).astype(numpy.uint8)
+
+    async def run():
+        stop = asyncio.Event()
+        consumer = detection_consumer.DetectionConsumer(ListSource([create_payload(1, frame), create_payload(2)],
+                                                                   stop, published_time=0.0))
+        frames = []
+
+        @consumer.handler()
+        async def check_frame(detection):
+            assert detection._frame is detection_consumer.UNSET
+            frames.append(detection.frame)
+            if detection.frame is None:
+                raise ValueError('no frame')
+
+        await consumer.run(stop)
+        return consumer, frames
+
+    consumer, frames = asyncio.run(run())
+    numpy.testing.assert_array_equal(frames[0], frame)
+    assert frames[1] is None
+    summary = consumer.registry.stream_metrics({'handler': 'check_frame'}).summary()
+    assert summary['counters'] == {'handled': 1, 'failed': 1}
+    assert summary['stages']['publish_lag']['count'] == 2
+
+
+def test_fetch_frame_reads_the_frame_store_off_the_event_loop():
+    frame = numpy.random.RandomState(6).randint(0, 256, size=(6, 8, 3)).astype(numpy.uint8)
+    store = frame_store.RedisFrameStore(fake_services.FakeRedis(latency=0.05))
+    frame_numbers, string_map = frame_encoding.encode_frame(frame, frame_encoding.RAW, frame_store=store,
+                                                            request_id='abc')
+    message = detection_handler_pb2.handle_detection_request(frame_count=1, string_map=string_map)
+
+    async def run():
+        detection = detection_consumer.Detection(message, 0.0, frame_store=store)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.ensure_future(tick())
+        fetched = await detection.fetch_frame()
+        ticker.cancel()
+        return fetched, ticks, detection
+
+    fetched, ticks, detection = asyncio.run(run())
+    numpy.testing.assert_array_equal(fetched, frame)
+    # the loop kept running while the store was read
+    assert ticks > 2
+    assert detection.frame is fetched
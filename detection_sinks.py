@@ -0,0 +1,212 @@
+"""
+sinks that deliver serialized detection messages
+
+Messages are buffered and written to redis in batches through a pipeline by a background thread, a batch is
+written once it is full or flush_interval seconds after its first message arrived. When redis is slower than
+the detections, the buffer fills up and the overflow policy decides what happens to new messages:
+    'block': the caller waits for room in the buffer, slowing down the detection pipeline
+    'drop-newest': the new message is dropped
+    'drop-oldest': the oldest buffered message is dropped to make room
+A batch redis fails to write is tried again after RETRY_DELAY seconds, up to RETRIES times, before its messages are
+counted as failed. Messages are only counted as sent once redis has accepted them.
+"""
+import abc
+import collections
+import logging
+import threading
+import time
+
+import redis
+
+PUBSUB = 'pubsub'
+STREAM = 'stream'
+SINK_TYPES = (PUBSUB, STREAM)
+
+BLOCK = 'block'
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+OVERFLOW_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+BATCH_SIZE = 32
+# seconds
+FLUSH_INTERVAL = 0.05
+BUFFER_SIZE = 256
+# streams are trimmed to about this many messages
+STREAM_MAXLEN = 10000
+# times a batch is written again after redis failed, waiting twice as long before each
+RETRIES = 1
+# seconds to wait before writing again after redis failed
+RETRY_DELAY = 1.0
+# the field holding the serialized message in each stream entry
+STREAM_FIELD = 'data'
+
+
+class BufferedRedisSink(abc.ABC):
+    """ buffers messages and writes them to redis in batches, subclasses decide how each message is written """
+
+    def __init__(self, redis_client, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, buffer_size=BUFFER_SIZE,
+                 overflow=BLOCK, retries=RETRIES, retry_delay=RETRY_DELAY):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy {overflow}, expected one of {OVERFLOW_POLICIES}')
+        self.redis_client = redis_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer_size = max(buffer_size, batch_size)
+        self.overflow = overflow
+        self.retries = retries
+        self.retry_delay = retry_delay
+        # (payload, counters) tuples
+        self.buffer = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        # message counts
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    @abc.abstractmethod
+    def write(self, pipeline, payload):
+        """ queue the command that writes one message on the redis pipeline """
+
+    def send(self, payload, counters=None):
+        """
+        buffer a serialized message for writing to redis
+
+        :param counters: an optional collections.Counter e.g. a stream's stats, updated once the message is written
+            with 'sent' and 'payload_bytes', or 'send_failed' if redis failed, or 'send_dropped' if a later message
+            pushed it out of the buffer
+        returns False if the message was dropped because the buffer is full
+        """
+        with self.condition:
+            if self.closed:
+                raise ValueError('the sink is closed')
+            while len(self.buffer) >= self.buffer_size:
+                if self.overflow == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if self.overflow == DROP_OLDEST:
+                    _, dropped_counters = self.buffer.popleft()
+                    self.dropped += 1
+                    if dropped_counters is not None:
+                        dropped_counters['send_dropped'] += 1
+                    break
+                self.condition.wait()
+            self.buffer.append((payload, counters))
+            self.condition.notify_all()
+        return True
+
+    def close(self):
+        """ write the buffered messages and stop the writer thread """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_batch(self):
+        """ wait for a batch to fill up or for the flush interval to pass, returns an empty list once closed """
+        with self.condition:
+            while not self.buffer and not self.closed:
+                self.condition.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while not self.closed and len(self.buffer) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            # wake up senders waiting for room in the buffer
+            self.condition.notify_all()
+            return batch
+
+    def _write_batch(self, batch):
+        """ write a batch to redis, trying again after redis failed, returns True once redis accepted it """
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                # a new pipeline each time, a failed one may have been partly sent
+                pipeline = self.redis_client.pipeline(transaction=False)
+                for payload, _ in batch:
+                    self.write(pipeline, payload)
+                pipeline.execute()
+                return True
+            except redis.RedisError:
+                logging.exception(f'failed to write {len(batch)} messages to redis, attempt {attempt + 1}')
+                if attempt < self.retries:
+                    time.sleep(delay)
+                    delay *= 2
+        return False
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                written = self._write_batch(batch)
+            except Exception:
+                # e.g. a payload write() cannot queue, the thread keeps going so senders waiting for room do not
+                # wait forever
+                logging.exception(f'failed to write {len(batch)} messages')
+                written = False
+            if written:
+                self.sent += len(batch)
+            else:
+                self.failed += len(batch)
+            for payload, counters in batch:
+                if counters is None:
+                    continue
+                if written:
+                    counters['sent'] += 1
+                    counters['payload_bytes'] += len(payload)
+                else:
+                    counters['send_failed'] += 1
+
+
+class PubSubSink(BufferedRedisSink):
+    """ publishes each message on a redis pub/sub channel, only subscribers listening at the time receive it """
+
+    def __init__(self, redis_client, channel_name, **kwargs):
+        self.channel_name = channel_name
+        super().__init__(redis_client, **kwargs)
+
+    def write(self, pipeline, payload):
+        pipeline.publish(self.channel_name, payload)
+
+
+class RedisStreamSink(BufferedRedisSink):
+    """
+    appends each message to a redis stream (XADD) that consumers can read at their own pace,
+    the stream is trimmed to about maxlen messages
+    """
+
+    def __init__(self, redis_client, stream_name, maxlen=STREAM_MAXLEN, **kwargs):
+        self.stream_name = stream_name
+        self.maxlen = maxlen
+        super().__init__(redis_client, **kwargs)
+
+    def write(self, pipeline, payload):
+        pipeline.xadd(self.stream_name, {STREAM_FIELD: payload}, maxlen=self.maxlen, approximate=True)
+
+
+def create_sink(sink_type, redis_client, name, maxlen=STREAM_MAXLEN, **kwargs):
+    """
+    parameters:
+        sink_type: one of SINK_TYPES
+        redis_client: e.g. redis.Redis()
+        name: the channel or stream name
+        maxlen: the approximate maximum length of a stream
+        kwargs: batch_size, flush_interval, buffer_size, overflow, retries and retry_delay, see BufferedRedisSink
+    """
+    if sink_type == PUBSUB:
+        return PubSubSink(redis_client, name, **kwargs)
+    if sink_type == STREAM:
+        return RedisStreamSink(redis_client, name, maxlen=maxlen, **kwargs)
+    raise ValueError(f'unknown sink {sink_type}, expected one of {SINK_TYPES}')
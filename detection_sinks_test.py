@@ -0,0 +1,140 @@
+import collections
+import time
+
+import pytest
+import redis
+
+import detection_sinks
+import fake_services
+
+
+class FlakyRedis(fake_services.FakeRedis):
+    """ fails the first failures pipelines it executes """
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def _command(self):
+        super()._command()
+        if self.failures:
+            self.failures -= 1
+            raise redis.ConnectionError('connection refused')
+
+
+def test_pubsub_sink_publishes_in_batches():
+    redis_client = fake_services.FakeRedis()
+    counters = collections.Counter()
+    with detection_sinks.PubSubSink(redis_client, 'predictions', batch_size=10, flush_interval=5) as sink:
+        for i in range(25):
+            sink.send(b'message %d' % i, counters)
+    assert redis_client.published['predictions'] == [b'message %d' % i for i in range(25)]
+    assert sink.sent == 25
+    assert counters == {'sent': 25, 'payload_bytes': sum(len(b'message %d' % i) for i in range(25))}
+    # 3 pipelines instead of 25 commands
+    assert redis_client.commands == 3
+
+
+def test_stream_sink_flushes_after_interval():
+    redis_client = fake_services.FakeRedis()
+    sink = detection_sinks.RedisStreamSink(redis_client, 'predictions', maxlen=100, batch_size=10,
+                                           flush_interval=0.01)
+    sink.send(b'message')
+    time.sleep(0.2)
+    # written before the batch filled up or the sink was closed
+    assert redis_client.xlen('predictions') == 1
+    sink.close()
+    entry_id, fields = redis_client.xrange('predictions')[0]
+    assert fields[detection_sinks.STREAM_FIELD.encode()] == b'message'
+
+
+def test_stream_sink_trims_stream():
+    redis_client = fake_services.FakeRedis()
+    with detection_sinks.RedisStreamSink(redis_client, 'predictions', maxlen=5, batch_size=4) as sink:
+        for i in range(12):
+            sink.send(b'%d' % i)
+    assert [fields[b'data'] for _, fields in redis_client.xrange('predictions')] == [b'7', b'8', b'9', b'10', b'11']
+
+
+@pytest.mark.parametrize('overflow', [detection_sinks.DROP_NEWEST, detection_sinks.DROP_OLDEST])
+def test_sink_drops_messages_when_redis_is_slow(overflow):
+    redis_client = fake_services.FakeRedis(latency=0.2)
+    with detection_sinks.PubSubSink(redis_client, 'predictions', batch_size=2, buffer_size=2,
+                                    flush_interval=0, overflow=overflow) as sink:
+        counters = collections.Counter()
+        results = [sink.send(b'%d' % i, counters) for i in range(20)]
+    assert sink.dropped > 0
+    assert sink.sent + sink.dropped == 20
+    assert len(redis_client.published['predictions']) == sink.sent
+    if overflow == detection_sinks.DROP_NEWEST:
+        assert results.count(False) == sink.dropped
+    else:
+        # the newest message is never the one dropped
+        assert redis_client.published['predictions'][-1] == b'19'
+        assert counters['send_dropped'] == sink.dropped
+    assert counters['sent'] == sink.sent
+
+
+def test_sink_blocks_when_redis_is_slow():
+    redis_client = fake_services.FakeRedis(latency=0.05)
+    start = time.monotonic()
+    with detection_sinks.PubSubSink(redis_client, 'predictions', batch_size=2, buffer_size=2,
+                                    flush_interval=0) as sink:
+        for i in range(10):
+            assert sink.send(b'%d' % i)
+    # the sender had to wait for several round trips
+    assert time.monotonic() - start > 0.1
+    assert sink.dropped == 0
+    assert len(redis_client.published['predictions']) == 10
+
+
+def test_create_sink_unknown_type():
+    with pytest.raises(ValueError):
+        detection_sinks.create_sink('kafka', fake_services.FakeRedis(), 'predictions')
+
+
+def test_sink_writes_a_failed_batch_again():
+    redis_client = FlakyRedis(failures=1)
+    counters = collections.Counter()
+    with detection_sinks.PubSubSink(redis_client, 'predictions', batch_size=10, flush_interval=5,
+                                    retry_delay=0.01) as sink:
+        for i in range(3):
+            sink.send(b'%d' % i, counters)
+    assert redis_client.published['predictions'] == [b'0', b'1', b'2']
+    assert (sink.sent, sink.failed) == (3, 0)
+    assert counters['sent'] == 3
+
+
+def test_sink_counts_messages_redis_keeps_failing_as_failed():
+    redis_client = FlakyRedis(failures=2)
+    counters = collections.Counter()
+    with detection_sinks.PubSubSink(redis_client, 'predictions', batch_size=10, flush_interval=5,
+                                    retries=1, retry_delay=0.01) as sink:
+        for i in range(3):
+            sink.send(b'%d' % i, counters)
+    assert redis_client.published['predictions'] == []
+    assert (sink.sent, sink.failed) == (0, 3)
+    assert counters == {'send_failed': 3}
+
+
+def test_sink_keeps_writing_after_an_unexpected_error():
+    class PickySink(detection_sinks.PubSubSink):
+        def write(self, pipeline, payload):
+            if payload == b'bad':
+                raise TypeError('not a message')
+            super().write(pipeline, payload)
+
+    redis_client = fake_services.FakeRedis()
+    counters = collections.Counter()
+    # senders would wait forever for room in the buffer if the writer thread had stopped
+    with PickySink(redis_client, 'predictions', batch_size=1, buffer_size=1, flush_interval=0) as sink:
+        for payload in [b'bad', b'1', b'bad', b'2', b'3']:
+            assert sink.send(payload, counters)
+    assert redis_client.published['predictions'] == [b'1', b'2', b'3']
+    assert (sink.sent, sink.failed) == (3, 2)
+    assert counters['send_failed'] == 2
+
+
+def test_sinks_must_write():
+    with pytest.raises(TypeError):
+        detection_sinks.BufferedRedisSink(fake_services.FakeRedis())
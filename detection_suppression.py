@@ -0,0 +1,83 @@
+"""
+only publish a stream's detections when they change, so a static scene e.g. a parked car is not published for
+every sampled frame
+
+The detections of a frame are unchanged when every box matches a box of the same class in the last published
+frame with an iou of at least iou_threshold, and the other way round. A keyframe is published every
+keyframe_interval seconds even when nothing changed, so consumers know the stream is alive.
+"""
+import time
+
+import numpy
+
+import detect_video_stream_utils
+
+IOU_THRESHOLD = 0.5
+# seconds
+KEYFRAME_INTERVAL = 60.0
+
+# keys in message.string_map
+SUPPRESSED_KEY = 'suppressed_frames'
+KEYFRAME_KEY = 'keyframe'
+
+
+def detections_match(classes, boxes, other_classes, other_boxes, iou_threshold=IOU_THRESHOLD):
+    """ True if every box has a box of the same class among the other boxes with an iou of at least iou_threshold """
+    if len(classes) != len(other_classes):
+        return False
+    if len(classes) == 0:
+        return True
+    ious = detect_video_stream_utils.iou_matrix(boxes, other_boxes)
+    ious[numpy.asarray(classes)[:, numpy.newaxis] != numpy.asarray(other_classes)[numpy.newaxis, :]] = 0
+    matched = ious >= iou_threshold
+    return bool(matched.any(axis=1).all() and matched.any(axis=0).all())
+
+
+class ChangeSuppressor(object):
+    """ decides which frames of one stream are published, keeping the detections last published """
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, keyframe_interval=KEYFRAME_INTERVAL, clock=time.monotonic):
+        """
+        :param iou_threshold: how much a box must overlap the box it is compared with to count as unchanged
+        :param keyframe_interval: seconds after which unchanged detections are published anyway
+        """
+        self.iou_threshold = iou_threshold
+        self.keyframe_interval = keyframe_interval
+        self.clock = clock
+        self.classes = None
+        self.boxes = None
+        self.published_time = None
+        # frames suppressed since the last published one
+        self.suppressed = 0
+        self.keyframe = False
+
+    def should_publish(self, classes, boxes):
+        """
+        compare a frame's filtered detections with the last published ones
+        returns True if the frame should be published, it then becomes the last published frame
+        """
+        now = self.clock()
+        unchanged = self.classes is not None and detections_match(classes, boxes, self.classes, self.boxes,
+                                                                  self.iou_threshold)
+        self.keyframe = unchanged and now - self.published_time >= self.keyframe_interval
+        if unchanged and not self.keyframe:
+            self.suppressed += 1
+            return False
+        self.classes, self.boxes, self.published_time = classes, boxes, now
+        return True
+
+    def string_map(self):
+        """
+        entries to add to the string_map of a frame that is published: how many frames were suppressed before it and
+        whether it is a keyframe; the suppressed count then starts again
+        """
+        string_map = {SUPPRESSED_KEY: str(self.suppressed)}
+        if self.keyframe:
+            string_map[KEYFRAME_KEY] = 'true'
+        self.suppressed = 0
+        return string_map
+
+    def reset(self):
+        """ forget the last published detections e.g. when a frame has none, so the next detections are published """
+        self.classes = None
+        self.boxes = None
@@ -0,0 +1,50 @@
+import numpy
+
+import detection_suppression
+
+CAR = 3
+PERSON = 1
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_detections_match():
+    boxes = numpy.array([[0.1, 0.1, 0.5, 0.5], [0.5, 0.5, 0.9, 0.9]])
+    moved = boxes + 0.02
+    assert detection_suppression.detections_match([CAR, PERSON], boxes, [PERSON, CAR], moved[::-1])
+    assert not detection_suppression.detections_match([CAR, PERSON], boxes, [CAR, CAR], moved)
+    assert not detection_suppression.detections_match([CAR], boxes[:1], [CAR, PERSON], boxes)
+    assert not detection_suppression.detections_match([CAR], boxes[:1], [CAR], boxes[1:])
+    assert detection_suppression.detections_match([], numpy.zeros((0, 4)), [], numpy.zeros((0, 4)))
+
+
+def test_change_suppressor_publishes_changes_and_keyframes():
+    clock = FakeClock()
+    suppressor = detection_suppression.ChangeSuppressor(iou_threshold=0.5, keyframe_interval=10, clock=clock)
+    parked = numpy.array([[0.1, 0.1, 0.5, 0.5]])
+    assert suppressor.should_publish([CAR], parked)
+    assert suppressor.string_map() == {detection_suppression.SUPPRESSED_KEY: '0'}
+    for _ in range(3):
+        clock.now += 1
+        assert not suppressor.should_publish([CAR], parked + 0.01)
+    assert suppressor.should_publish([CAR, PERSON], numpy.vstack([parked, [[0.6, 0.6, 0.9, 0.9]]]))
+    assert suppressor.string_map() == {detection_suppression.SUPPRESSED_KEY: '3'}
+    clock.now += 10
+    assert suppressor.should_publish([CAR, PERSON], numpy.vstack([parked, [[0.6, 0.6, 0.9, 0.9]]]))
+    assert suppressor.string_map() == {detection_suppression.SUPPRESSED_KEY: '0',
+                                       detection_suppression.KEYFRAME_KEY: 'true'}
+
+
+def test_change_suppressor_publishes_again_after_reset():
+    suppressor = detection_suppression.ChangeSuppressor(clock=FakeClock())
+    parked = numpy.array([[0.1, 0.1, 0.5, 0.5]])
+    assert suppressor.should_publish([CAR], parked)
+    assert not suppressor.should_publish([CAR], parked)
+    suppressor.reset()
+    assert suppressor.should_publish([CAR], parked)
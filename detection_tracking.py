@@ -0,0 +1,150 @@
+"""
+give the detections of a stream track ids that stay the same for an object across sampled frames
+
+Each frame's detections are associated with the tracks from earlier frames through a cost matrix of all the
+pairs at once, either their iou or the distance between their centers, only boxes of the same class are
+associated. Pairs are matched greedily, best first. Detections left unmatched start new tracks and tracks
+that go unmatched for more than max_age sampled frames are dropped.
+With constant velocity, a track's box is moved along its last velocity to the frame being matched, which keeps
+fast objects matched at low sample rates.
+"""
+import numpy
+
+import detect_video_stream_utils
+
+IOU = 'iou'
+CENTROID = 'centroid'
+METRICS = (IOU, CENTROID)
+# the lowest iou for a detection to continue a track
+IOU_THRESHOLD = 0.3
+# the largest distance between centers, as a fraction of the frame's size, for a detection to continue a track
+CENTROID_DISTANCE = 0.1
+# sampled frames a track can go unmatched before it is dropped
+MAX_AGE = 5
+# how much of a track's velocity comes from its latest move, the rest is the velocity it had
+VELOCITY_SMOOTHING = 0.5
+
+# key in message.string_map
+TRACK_IDS_KEY = 'track_ids'
+
+
+def centroid_distances(boxes, other_boxes):
+    """ the distance between the centers of every pair of boxes, an array of shape (len(boxes), len(other_boxes)) """
+    boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+    other_boxes = numpy.asarray(other_boxes, dtype=numpy.float64).reshape(-1, 4)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    other_centers = (other_boxes[:, :2] + other_boxes[:, 2:]) / 2
+    return numpy.linalg.norm(centers[:, numpy.newaxis, :] - other_centers[numpy.newaxis, :, :], axis=2)
+
+
+def greedy_match(scores, threshold):
+    """
+    pair rows with columns, highest score first, each row and column at most once
+
+    :param scores: an array of shape (rows, columns), higher is better
+    :param threshold: the lowest score a pair can have
+    :return: a list of (row, column) tuples
+    """
+    order = numpy.argsort(-scores, axis=None, kind='stable')
+    rows, columns = numpy.unravel_index(order, scores.shape)
+    keep = scores[rows, columns] >= threshold
+    matched_rows, matched_columns = set(), set()
+    pairs = []
+    for row, column in zip(rows[keep].tolist(), columns[keep].tolist()):
+        if row in matched_rows or column in matched_columns:
+            continue
+        matched_rows.add(row)
+        matched_columns.add(column)
+        pairs.append((row, column))
+    return pairs
+
+
+class Tracker(object):
+    """ keeps the tracks of one stream, call update() with the detections of each sampled frame in order """
+
+    def __init__(self, metric=IOU, iou_threshold=IOU_THRESHOLD, centroid_distance=CENTROID_DISTANCE,
+                 max_age=MAX_AGE, constant_velocity=False):
+        """
+        :param metric: how detections are associated with tracks, one of METRICS
+        :param iou_threshold: the lowest iou for a detection to continue a track, for IOU
+        :param centroid_distance: the largest distance between centers for a detection to continue a track, for
+            CENTROID
+        :param max_age: sampled frames a track can go unmatched before it is dropped
+        :param constant_velocity: move each track's box along its velocity before matching
+        """
+        if metric not in METRICS:
+            raise ValueError(f'unknown tracking metric {metric}, expected one of {METRICS}')
+        self.metric = metric
+        self.iou_threshold = iou_threshold
+        self.centroid_distance = centroid_distance
+        self.max_age = max_age
+        self.constant_velocity = constant_velocity
+        self.next_id = 1
+        # one entry per track, in parallel arrays
+        self.ids = numpy.zeros(0, dtype=numpy.int64)
+        self.classes = numpy.zeros(0, dtype=numpy.int64)
+        self.boxes = numpy.zeros((0, 4))
+        # box change per frame
+        self.velocities = numpy.zeros((0, 4))
+        self.frame_counts = numpy.zeros(0, dtype=numpy.int64)
+        self.ages = numpy.zeros(0, dtype=numpy.int64)
+
+    def predicted_boxes(self, frame_count):
+        """ where the tracks' boxes are expected in the frame """
+        if not self.constant_velocity:
+            return self.boxes
+        return self.boxes + self.velocities * (frame_count - self.frame_counts)[:, numpy.newaxis]
+
+    def update(self, frame_count, classes, boxes):
+        """
+        associate a frame's detections with the tracks
+
+        :param frame_count: the frame's position in the video, used for the velocities
+        :param classes: the detections' class ids
+        :param boxes: the detections' boxes, an array of shape (n, 4)
+        :return: an int64 array with the track id of each detection
+        """
+        classes = numpy.asarray(classes, dtype=numpy.int64)
+        boxes = numpy.asarray(boxes, dtype=numpy.float64).reshape(-1, 4)
+        predicted = self.predicted_boxes(frame_count)
+        if self.metric == IOU:
+            scores = detect_video_stream_utils.iou_matrix(boxes, predicted)
+            threshold = self.iou_threshold
+        else:
+            # a smaller distance is better
+            scores = -centroid_distances(boxes, predicted)
+            threshold = -self.centroid_distance
+        scores[classes[:, numpy.newaxis] != self.classes[numpy.newaxis, :]] = -numpy.inf
+        pairs = greedy_match(scores, threshold)
+        track_ids = numpy.zeros(len(boxes), dtype=numpy.int64)
+        matched_tracks = numpy.zeros(len(self.ids), dtype=bool)
+        if pairs:
+            detections, tracks = (numpy.array(indices) for indices in zip(*pairs))
+            track_ids[detections] = self.ids[tracks]
+            matched_tracks[tracks] = True
+            elapsed = numpy.maximum(frame_count - self.frame_counts[tracks], 1)[:, numpy.newaxis]
+            moves = (boxes[detections] - self.boxes[tracks]) / elapsed
+            self.velocities[tracks] = (VELOCITY_SMOOTHING * moves
+                                       + (1 - VELOCITY_SMOOTHING) * self.velocities[tracks])
+            self.boxes[tracks] = boxes[detections]
+            self.frame_counts[tracks] = frame_count
+            self.ages[tracks] = 0
+        self.ages[~matched_tracks] += 1
+        alive = self.ages <= self.max_age
+        new = track_ids == 0
+        new_ids = numpy.arange(self.next_id, self.next_id + new.sum(), dtype=numpy.int64)
+        self.next_id += len(new_ids)
+        track_ids[new] = new_ids
+        self.ids = numpy.concatenate([self.ids[alive], new_ids])
+        self.classes = numpy.concatenate([self.classes[alive], classes[new]])
+        self.boxes = numpy.concatenate([self.boxes[alive], boxes[new]])
+        self.velocities = numpy.concatenate([self.velocities[alive], numpy.zeros((len(new_ids), 4))])
+        self.frame_counts = numpy.concatenate([self.frame_counts[alive],
+                                               numpy.full(len(new_ids), frame_count, dtype=numpy.int64)])
+        self.ages = numpy.concatenate([self.ages[alive], numpy.zeros(len(new_ids), dtype=numpy.int64)])
+        return track_ids
+
+
+def track_ids_string_map(track_ids):
+    """ the entry to add to a message's string_map, the track id of each detection in order e.g. '3,7,12' """
+    return {TRACK_IDS_KEY: ','.join(str(track_id) for track_id in track_ids.tolist())}
@@ -0,0 +1,64 @@
+import numpy
+import pytest
+
+import detection_tracking
+
+CAR = 3
+PERSON = 1
+
+
+def test_greedy_match_takes_best_pairs_first():
+    scores = numpy.array([[0.9, 0.8], [0.85, 0.1], [0.2, 0.2]])
+    assert detection_tracking.greedy_match(scores, 0.15) == [(0, 0), (2, 1)]
+    assert detection_tracking.greedy_match(numpy.zeros((2, 0)), 0.5) == []
+
+
+def test_tracker_keeps_ids_for_moving_objects():
+    tracker = detection_tracking.Tracker()
+    car = numpy.array([0.1, 0.1, 0.4, 0.4])
+    person = numpy.array([0.5, 0.5, 0.9, 0.7])
+    first = tracker.update(0, [CAR, PERSON], [car, person])
+    assert first.tolist() == [1, 2]
+    # listed in another order and moved a little
+    second = tracker.update(5, [PERSON, CAR], [person + 0.02, car + 0.05])
+    assert second.tolist() == [2, 1]
+    # a new car far away gets a new track
+    third = tracker.update(10, [CAR, CAR], [car + 0.05, car + 0.5])
+    assert third.tolist() == [1, 3]
+
+
+def test_tracker_does_not_match_other_classes():
+    tracker = detection_tracking.Tracker()
+    box = numpy.array([[0.1, 0.1, 0.4, 0.4]])
+    assert tracker.update(0, [CAR], box).tolist() == [1]
+    assert tracker.update(1, [PERSON], box).tolist() == [2]
+
+
+def test_tracker_drops_tracks_after_max_age():
+    tracker = detection_tracking.Tracker(max_age=2)
+    box = numpy.array([[0.1, 0.1, 0.4, 0.4]])
+    assert tracker.update(0, [CAR], box).tolist() == [1]
+    for frame_count in (1, 2):
+        assert len(tracker.update(frame_count, [], numpy.zeros((0, 4)))) == 0
+    assert tracker.update(3, [CAR], box).tolist() == [1]
+    for frame_count in (4, 5, 6):
+        tracker.update(frame_count, [], numpy.zeros((0, 4)))
+    assert tracker.update(7, [CAR], box).tolist() == [2]
+
+
+@pytest.mark.parametrize('metric', detection_tracking.METRICS)
+def test_constant_velocity_follows_fast_objects(metric):
+    """ after two close frames the car is sampled every 5 frames, when it moves more than half its width """
+    def boxes(frame_count):
+        left = 0.012 * frame_count
+        return numpy.array([[0.4, left, 0.5, left + 0.1]])
+
+    frame_counts = [0, 1, 6, 11, 16, 21]
+    with_velocity = detection_tracking.Tracker(metric, centroid_distance=0.05, constant_velocity=True)
+    without_velocity = detection_tracking.Tracker(metric, centroid_distance=0.05)
+    assert [with_velocity.update(i, [CAR], boxes(i)).tolist() for i in frame_counts] == [[1]] * 6
+    assert [without_velocity.update(i, [CAR], boxes(i)).tolist() for i in frame_counts[:3]] == [[1], [1], [2]]
+
+
+def test_track_ids_string_map():
+    assert detection_tracking.track_ids_string_map(numpy.array([3, 7])) == {'track_ids': '3,7'}
@@ -0,0 +1,151 @@
+"""
+in process stand ins for the services the detection scripts talk to, for tests and benchmarks
+"""
+import collections
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+PREDICT_METHOD = '/tensorflow.serving.PredictionService/Predict'
+
+
+class FakeRedis(object):
+    """
+    a stand in for redis.Redis that keeps published messages and streams in memory
+    supports the commands used by detection_sinks, each command can be slowed down by latency seconds
+    """
+
+    def __init__(self, latency=0.0, keep_messages=True):
+        """
+        :param latency: seconds each command or pipeline takes
+        :param keep_messages: False to only count published messages e.g. in long benchmarks
+        """
+        self.latency = latency
+        self.keep_messages = keep_messages
+        self.lock = threading.Lock()
+        # channel name: list of published messages
+        self.published = collections.defaultdict(list)
+        # stream name: list of (entry id, fields) tuples
+        self.streams = collections.defaultdict(list)
+        self.next_entry_id = 0
+        # key: (value, expiry time or None)
+        self.values = {}
+        self.commands = 0
+
+    def _command(self):
+        with self.lock:
+            self.commands += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def publish(self, channel, message):
+        self._command()
+        return self._publish(channel, message)
+
+    def xadd(self, name, fields, id='*', maxlen=None, approximate=True):
+        self._command()
+        return self._xadd(name, fields, maxlen=maxlen)
+
+    def set(self, name, value, ex=None):
+        self._command()
+        with self.lock:
+            self.values[name] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def get(self, name):
+        self._command()
+        with self.lock:
+            value, expiry = self.values.get(name, (None, None))
+            if expiry is not None and time.monotonic() >= expiry:
+                del self.values[name]
+                return None
+            return value
+
+    def _publish(self, channel, message):
+        with self.lock:
+            self.published[channel].append(message if self.keep_messages else None)
+        # the number of subscribers that received the message
+        return 0
+
+    def _xadd(self, name, fields, maxlen=None, **kwargs):
+        with self.lock:
+            self.next_entry_id += 1
+            entry_id = f'{self.next_entry_id}-0'.encode()
+            stream = self.streams[name]
+            stream.append((entry_id, {key.encode() if isinstance(key, str) else key: value
+                                      for key, value in fields.items()} if self.keep_messages else None))
+            if maxlen is not None and len(stream) > maxlen:
+                del stream[:len(stream) - maxlen]
+        return entry_id
+
+    def xlen(self, name):
+        return len(self.streams[name])
+
+    def xrange(self, name, min='-', max='+', count=None):
+        entries = list(self.streams[name])
+        return entries[:count] if count else entries
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    """ queues commands and runs them on the FakeRedis when executed, paying the latency once """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def publish(self, channel, message):
+        self.commands.append(('publish', (channel, message), {}))
+        return self
+
+    def xadd(self, name, fields, **kwargs):
+        self.commands.append(('xadd', (name, fields), kwargs))
+        return self
+
+    def execute(self):
+        self.redis_client._command()
+        commands, self.commands = self.commands, []
+        return [getattr(self.redis_client, '_' + command)(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class FakePredictionService(object):
+    """
+    a grpc server on localhost answering tensorflow serving Predict calls with a recorded response
+    e.g. samples/predict_response_01.bin, after latency seconds
+
+    requests and responses are handled as serialized bytes, so the server does not need the generated protos
+    """
+
+    def __init__(self, response, latency=0.0, port=0, max_workers=8):
+        """
+        :param response: the serialized PredictResponse to answer with, or a function that takes the serialized
+            PredictRequest and returns it e.g. to answer batched requests
+        :param latency: seconds to wait before answering each request
+        :param port: the port to listen on, 0 picks a free one, see self.port
+        :param max_workers: how many requests are answered concurrently
+        """
+        self.respond = response if callable(response) else lambda request: response
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers),
+                                  options=[('grpc.max_receive_message_length', -1)])
+        service, method = PREDICT_METHOD.strip('/').split('/')
+        self.server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(
+            service, {method: grpc.unary_unary_rpc_method_handler(self._predict)})])
+        self.port = self.server.add_insecure_port(f'localhost:{port}')
+        self.server.start()
+
+    def _predict(self, request, context):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(request)
+
+    def close(self):
+        self.server.stop(grace=None)
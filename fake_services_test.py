@@ -0,0 +1,26 @@
+import time
+
+import grpc
+
+import fake_services
+
+
+def test_fake_prediction_service_answers_after_latency():
+    service = fake_services.FakePredictionService(lambda request: request[::-1], latency=0.05)
+    try:
+        with grpc.insecure_channel(f'localhost:{service.port}') as channel:
+            predict = channel.unary_unary(fake_services.PREDICT_METHOD)
+            start = time.monotonic()
+            assert predict(b'request', timeout=5) == b'tseuqer'
+            assert time.monotonic() - start >= 0.05
+        assert service.requests == 1
+    finally:
+        service.close()
+
+
+def test_fake_redis_without_keeping_messages_counts_them():
+    redis_client = fake_services.FakeRedis(keep_messages=False)
+    redis_client.publish('predictions', b'message')
+    redis_client.xadd('detections', {'data': b'message'})
+    assert redis_client.published['predictions'] == [None]
+    assert redis_client.xlen('detections') == 1
@@ -0,0 +1,127 @@
+"""
+encode the frame carried by a detection_handler_pb2.handle_detection_request and decode it for consumers
+
+The 'float' encoding is the original one: every pixel value becomes a float in message.frame, which makes the
+message roughly 4 times the size of the frame. The other encodings leave message.frame empty and place the
+frame in message.string_map (base64, since the map only takes strings) together with what is needed to decode it:
+    'raw': the frame's bytes, its shape and dtype
+    'jpeg'/'png': the compressed image, jpeg at a configurable quality
+    'none': no frame at all, for consumers that only need the detections
+With a frame store (see frame_store.py), the frame's bytes are written to the store and string_map only carries
+a reference to them.
+"""
+import base64
+
+import imageio.v2 as imageio
+import numpy
+
+FLOAT = 'float'
+RAW = 'raw'
+JPEG = 'jpeg'
+PNG = 'png'
+NONE = 'none'
+ENCODINGS = (FLOAT, RAW, JPEG, PNG, NONE)
+JPEG_QUALITY = 90
+
+# keys in message.string_map
+ENCODING_KEY = 'frame_encoding'
+DATA_KEY = 'frame_data'
+SHAPE_KEY = 'frame_shape'
+DTYPE_KEY = 'frame_dtype'
+# a reference to the frame in a frame store, in place of DATA_KEY
+REF_KEY = 'frame_ref'
+
+
+def frame_to_bytes(frame, encoding, quality=JPEG_QUALITY):
+    """ returns the bytes of the frame in the RAW, JPEG or PNG encoding """
+    if encoding == RAW:
+        return numpy.ascontiguousarray(frame).tobytes()
+    if encoding == JPEG:
+        return imageio.imwrite('<bytes>', frame, format='jpg', quality=int(quality))
+    if encoding == PNG:
+        return imageio.imwrite('<bytes>', frame, format='png')
+    raise ValueError(f'frame encoding {encoding} has no bytes, expected one of {(RAW, JPEG, PNG)}')
+
+
+def frame_from_bytes(data, encoding, shape=None, dtype=None):
+    """
+    the reverse of frame_to_bytes(), shape and dtype are needed for RAW frames
+    raw frames are a read only view of data, use numpy.array(frame) to get a writable copy
+    """
+    if encoding == RAW:
+        return numpy.frombuffer(data, dtype=numpy.dtype(dtype)).reshape(shape)
+    if encoding in (JPEG, PNG):
+        return numpy.asarray(imageio.imread(data))
+    raise ValueError(f'unknown frame encoding {encoding}, expected one of {(RAW, JPEG, PNG)}')
+
+
+def encode_frame(frame, encoding=FLOAT, quality=JPEG_QUALITY, frame_store=None, request_id=None):
+    """
+    parameters:
+        frame: a numpy array of shape (height, width, 3), typically uint8
+        encoding: one of ENCODINGS
+        quality: jpeg quality between 1 and 100, ignored by the other encodings
+        frame_store: an optional frame store (see frame_store.py) to write the frame to instead of the message,
+            the message then carries a reference to the frame, FLOAT frames are stored RAW. A frame the store cannot
+            keep is placed in the message as if there was no store
+        request_id: the id the frame is stored under, see detect_video_stream_utils.create_detection_request_id()
+
+    returns a tuple of
+        the keyword arguments for detection_handler_pb2.float_array to set as message.frame, None if it stays empty
+        a dict of entries to add to message.string_map
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f'unknown frame encoding {encoding}, expected one of {ENCODINGS}')
+    if frame_store is not None and encoding == FLOAT:
+        encoding = RAW
+    if encoding == FLOAT:
+        return {'numbers': frame.ravel(), 'shape': frame.shape}, {}
+    string_map = {ENCODING_KEY: encoding, SHAPE_KEY: ','.join(str(size) for size in frame.shape)}
+    if encoding == NONE:
+        return None, string_map
+    if encoding == RAW:
+        string_map[DTYPE_KEY] = frame.dtype.str
+    data = frame_to_bytes(frame, encoding, quality)
+    reference = frame_store.put(request_id, data) if frame_store is not None else None
+    if reference is not None:
+        string_map[REF_KEY] = reference
+    else:
+        # also when the store cannot keep the frame e.g. it is larger than an mmap store's slots
+        string_map[DATA_KEY] = base64.b64encode(data).decode('ascii')
+    return None, string_map
+
+
+def frame_shape(message):
+    """ returns the shape of the frame in the message as a tuple e.g. (480, 640, 3), None if there is no frame """
+    if ENCODING_KEY in message.string_map:
+        return tuple(int(size) for size in message.string_map[SHAPE_KEY].split(','))
+    if message.frame.shape:
+        return tuple(message.frame.shape)
+    return None
+
+
+def decode_frame(message, frame_store=None):
+    """
+    parameters:
+        message: a detection_handler_pb2.handle_detection_request with a frame in any of ENCODINGS
+        frame_store: the frame store to fetch the frame from when the message only carries a reference to it
+
+    returns the frame as a numpy array, None if the message has no frame or the stored frame has expired
+        raw frames are a read only view of the decoded bytes, use numpy.array(frame) to get a writable copy
+    """
+    encoding = message.string_map.get(ENCODING_KEY, FLOAT)
+    if encoding == FLOAT:
+        if not message.frame.shape:
+            return None
+        return numpy.array(message.frame.numbers, dtype=numpy.float32).reshape(message.frame.shape)
+    if encoding == NONE:
+        return None
+    if REF_KEY in message.string_map:
+        if frame_store is None:
+            raise ValueError(f'the frame is in a frame store, {message.string_map[REF_KEY]}, pass the store to fetch it')
+        data = frame_store.get(message.string_map[REF_KEY])
+        if data is None:
+            return None
+    else:
+        data = base64.b64decode(message.string_map[DATA_KEY])
+    return frame_from_bytes(data, encoding, frame_shape(message), message.string_map.get(DTYPE_KEY))
@@ -0,0 +1,53 @@
+import numpy
+import pytest
+
+import frame_encoding
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+
+def create_message(frame, encoding, quality=frame_encoding.JPEG_QUALITY):
+    frame_numbers, string_map = frame_encoding.encode_frame(frame, encoding, quality)
+    return detection_handler_pb2.handle_detection_request(
+        frame=detection_handler_pb2.float_array(**frame_numbers) if frame_numbers else None,
+        string_map=string_map)
+
+
+@pytest.fixture
+def frame():
+    return numpy.random.RandomState(7).randint(0, 256, size=(36, 48, 3)).astype(numpy.uint8)
+
+
+@pytest.mark.parametrize('encoding', [frame_encoding.FLOAT, frame_encoding.RAW, frame_encoding.PNG])
+def test_lossless_encodings_round_trip(frame, encoding):
+    msg = detection_handler_pb2.handle_detection_request()
+    msg.ParseFromString(create_message(frame, encoding).SerializeToString())
+    decoded = frame_encoding.decode_frame(msg)
+    assert decoded.shape == frame.shape
+    numpy.testing.assert_array_equal(decoded, frame)
+    assert frame_encoding.frame_shape(msg) == frame.shape
+
+
+def test_jpeg_encoding_is_close_and_smaller_than_float(frame):
+    smooth = numpy.tile(numpy.arange(48, dtype=numpy.uint8)[None, :, None] * 5, (36, 1, 3))
+    jpeg_msg = create_message(smooth, frame_encoding.JPEG, quality=95)
+    decoded = frame_encoding.decode_frame(jpeg_msg)
+    assert decoded.shape == smooth.shape
+    assert numpy.abs(decoded.astype(float) - smooth).mean() < 5
+    assert jpeg_msg.ByteSize() < create_message(smooth, frame_encoding.FLOAT).ByteSize() / 4
+
+
+def test_raw_encoding_is_a_quarter_of_float_or_less(frame):
+    # base64 adds a third to the raw bytes
+    assert create_message(frame, frame_encoding.RAW).ByteSize() < create_message(frame, frame_encoding.FLOAT).ByteSize() / 2.5
+
+
+def test_no_frame(frame):
+    msg = create_message(frame, frame_encoding.NONE)
+    assert frame_encoding.decode_frame(msg) is None
+    assert not msg.HasField('frame')
+    assert frame_encoding.frame_shape(msg) == frame.shape
+
+
+def test_unknown_encoding(frame):
+    with pytest.raises(ValueError):
+        frame_encoding.encode_frame(frame, 'gif')
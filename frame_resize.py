@@ -0,0 +1,100 @@
+"""
+downscale frames on the client before they are sent for detection
+
+Models such as ssd mobilenet resize every frame to a fixed input size (300x300) themselves, so sending full
+resolution frames only adds to the request size and the server's work. Detection boxes are normalized to the
+frame's size, so they apply to the full resolution frame whatever size the model was given.
+    'nearest': picks the nearest source pixel, the fastest
+    'bilinear': blends the 4 nearest source pixels, smoother but slower
+The row and column lookups are computed once per frame size and applied to the whole frame at once.
+"""
+import numpy
+
+NEAREST = 'nearest'
+BILINEAR = 'bilinear'
+METHODS = (NEAREST, BILINEAR)
+AUTO = 'auto'
+
+# (height, width) of the input of models with a fixed input size, by model name prefix, longest prefix wins
+MODEL_INPUT_SIZES = {
+    'ssd_mobilenet': (300, 300),
+    'ssd_mobilenet_v1_fpn': (640, 640),
+    'ssd_resnet50_v1_fpn': (640, 640),
+    'ssdlite_mobilenet': (300, 300),
+    'ssd_inception': (300, 300),
+}
+
+
+def parse_size(size):
+    """ returns (height, width) for a size given as <width>x<height> e.g. 300x300 or 640x360 """
+    try:
+        width, height = (int(value) for value in size.lower().split('x'))
+    except ValueError:
+        raise ValueError(f'expected a size like 300x300 (width x height), got {size}')
+    return height, width
+
+
+def model_input_size(model_name):
+    """ returns the (height, width) input size of a model from MODEL_INPUT_SIZES by its name """
+    prefixes = [prefix for prefix in MODEL_INPUT_SIZES if model_name.startswith(prefix)]
+    if not prefixes:
+        raise ValueError(f'the input size of model {model_name} is not known, give it as <width>x<height>')
+    return MODEL_INPUT_SIZES[max(prefixes, key=len)]
+
+
+def nearest_indices(in_size, out_size):
+    """ the index of the source pixel nearest to the center of each output pixel along one axis """
+    return numpy.minimum(((numpy.arange(out_size) + 0.5) * in_size / out_size).astype(numpy.intp), in_size - 1)
+
+
+def bilinear_weights(in_size, out_size):
+    """ the two source pixels around the center of each output pixel along one axis and the weight of the second """
+    centers = numpy.clip((numpy.arange(out_size) + 0.5) * in_size / out_size - 0.5, 0, in_size - 1)
+    low = numpy.floor(centers).astype(numpy.intp)
+    high = numpy.minimum(low + 1, in_size - 1)
+    return low, high, (centers - low).astype(numpy.float32)
+
+
+class Resizer(object):
+    """ resizes frames to a fixed size, call it with a frame """
+
+    def __init__(self, size, method=NEAREST):
+        """
+        :param size: the (height, width) to resize to
+        :param method: one of METHODS
+        """
+        if method not in METHODS:
+            raise ValueError(f'unknown resize method {method}, expected one of {METHODS}')
+        self.height, self.width = size
+        self.method = method
+        # frame (height, width): the lookups for resizing it
+        self.lookups = {}
+
+    def _lookups(self, shape):
+        lookups = self.lookups.get(shape)
+        if lookups is None:
+            in_height, in_width = shape
+            if self.method == NEAREST:
+                lookups = nearest_indices(in_height, self.height), nearest_indices(in_width, self.width)
+            else:
+                lookups = bilinear_weights(in_height, self.height), bilinear_weights(in_width, self.width)
+            self.lookups[shape] = lookups
+        return lookups
+
+    def __call__(self, frame):
+        """ returns the frame resized to (height, width), frames that already have that size are returned as is """
+        if frame.shape[:2] == (self.height, self.width):
+            return frame
+        rows, columns = self._lookups(frame.shape[:2])
+        if self.method == NEAREST:
+            return frame.take(rows, axis=0).take(columns, axis=1)
+        (top, bottom, row_weights), (left, right, column_weights) = rows, columns
+        # blend rows first, that leaves fewer pixels to blend when downscaling
+        channels = (1,) * (frame.ndim - 2)
+        upper = frame.take(top, axis=0).astype(numpy.float32)
+        blended = upper + (frame.take(bottom, axis=0) - upper) * row_weights.reshape((-1, 1) + channels)
+        left_columns = blended.take(left, axis=1)
+        blended = left_columns + (blended.take(right, axis=1) - left_columns) * column_weights.reshape((-1,) + channels)
+        if numpy.issubdtype(frame.dtype, numpy.integer):
+            blended = numpy.rint(blended)
+        return blended.astype(frame.dtype)
@@ -0,0 +1,56 @@
+import numpy
+import pytest
+
+import frame_resize
+
+
+def test_parse_size():
+    assert frame_resize.parse_size('640x360') == (360, 640)
+    with pytest.raises(ValueError):
+        frame_resize.parse_size('640')
+
+
+def test_model_input_size():
+    assert frame_resize.model_input_size('ssd_mobilenet_v1_coco') == (300, 300)
+    assert frame_resize.model_input_size('ssd_mobilenet_v1_fpn_coco') == (640, 640)
+    with pytest.raises(ValueError):
+        frame_resize.model_input_size('faster_rcnn_resnet50_coco')
+
+
+def test_nearest_resize_picks_source_pixels():
+    frame = numpy.arange(4 * 6).reshape(4, 6).astype(numpy.uint8)
+    resized = frame_resize.Resizer((2, 3))(frame)
+    numpy.testing.assert_array_equal(resized, frame[1::2, 1::2])
+
+
+@pytest.mark.parametrize('method', frame_resize.METHODS)
+def test_resize_keeps_dtype_and_constant_frames(method):
+    frame = numpy.full((1080, 1920, 3), 77, dtype=numpy.uint8)
+    resized = frame_resize.Resizer((300, 300), method)(frame)
+    assert resized.shape == (300, 300, 3)
+    assert resized.dtype == numpy.uint8
+    assert (resized == 77).all()
+
+
+def test_bilinear_resize_interpolates():
+    frame = numpy.array([[0, 100]], dtype=numpy.uint8)
+    resized = frame_resize.Resizer((1, 4), frame_resize.BILINEAR)(frame)
+    numpy.testing.assert_array_equal(resized, [[0, 25, 75, 100]])
+    gray = numpy.tile(numpy.arange(0, 200, 2, dtype=numpy.uint8), (10, 1))
+    numpy.testing.assert_allclose(frame_resize.Resizer((5, 50), frame_resize.BILINEAR)(gray)[0],
+                                  numpy.arange(1, 200, 4), atol=1)
+
+
+def test_resize_returns_frames_of_the_right_size_as_is():
+    frame = numpy.zeros((300, 300, 3), dtype=numpy.uint8)
+    assert frame_resize.Resizer((300, 300))(frame) is frame
+
+
+def test_nearest_resize_of_a_full_hd_frame():
+    # how fast it is, is measured by benchmarks/frame_resize_benchmark.py
+    frame = numpy.random.RandomState(0).randint(0, 256, size=(1080, 1920, 3)).astype(numpy.uint8)
+    resized = frame_resize.Resizer((300, 300))(frame)
+    assert resized.shape == (300, 300, 3)
+    rows = frame_resize.nearest_indices(1080, 300)
+    columns = frame_resize.nearest_indices(1920, 300)
+    numpy.testing.assert_array_equal(resized, frame[rows[:, numpy.newaxis], columns])
@@ -0,0 +1,71 @@
+"""
+decide which frames are worth sending for object detection
+"""
+import numpy
+
+# frames are reduced to roughly this width before they are compared
+MOTION_WIDTH = 160
+# how much a pixel's gray level (0 - 255) must change for it to count as changed
+PIXEL_THRESHOLD = 25
+# the percentage of changed pixels that counts as motion
+MOTION_THRESHOLD = 1.0
+# the most sampled frames that can be skipped in a row, so a static scene is still checked now and then
+MAX_SKIP = 30
+# weights used to convert rgb to gray (ITU-R BT.601)
+GRAY_WEIGHTS = numpy.array([0.299, 0.587, 0.114], dtype=numpy.float32)
+
+
+def downscale_gray(frame, width=MOTION_WIDTH):
+    """
+    reduce a frame to a small gray image by keeping every nth pixel in both directions
+
+    :param frame: a numpy array of shape (height, width, 3) or (height, width)
+    :param width: the approximate width of the result
+    :return: a float32 array of shape (about height * width / frame width, about width)
+    """
+    step = max(1, frame.shape[1] // width)
+    small = frame[::step, ::step]
+    if small.ndim == 3:
+        return small[..., :3].astype(numpy.float32) @ GRAY_WEIGHTS
+    return small.astype(numpy.float32)
+
+
+def motion_score(gray, reference_gray, pixel_threshold=PIXEL_THRESHOLD):
+    """ the percentage of pixels whose gray level differs by more than pixel_threshold between the two images """
+    return float(numpy.count_nonzero(numpy.abs(gray - reference_gray) > pixel_threshold)) * 100 / gray.size
+
+
+class MotionGate(object):
+    """
+    compares each sampled frame with the last frame that was sent for detection and only lets it through when
+    enough of it has changed, or when max_skip frames have been skipped in a row
+    """
+
+    def __init__(self, threshold=MOTION_THRESHOLD, max_skip=MAX_SKIP, pixel_threshold=PIXEL_THRESHOLD,
+                 width=MOTION_WIDTH):
+        """
+        :param threshold: the percentage of changed pixels that counts as motion
+        :param max_skip: the most frames that can be skipped in a row
+        :param pixel_threshold: how much a pixel's gray level must change for it to count as changed
+        :param width: the approximate width frames are reduced to before they are compared
+        """
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.pixel_threshold = pixel_threshold
+        self.width = width
+        self.reference = None
+        self.skipped_in_a_row = 0
+        # the total number of frames skipped
+        self.skipped = 0
+
+    def should_detect(self, frame):
+        """ returns True if the frame should be sent for detection, it then becomes the reference frame """
+        gray = downscale_gray(frame, self.width)
+        if (self.reference is None or self.reference.shape != gray.shape or self.skipped_in_a_row >= self.max_skip
+                or motion_score(gray, self.reference, self.pixel_threshold) >= self.threshold):
+            self.reference = gray
+            self.skipped_in_a_row = 0
+            return True
+        self.skipped_in_a_row += 1
+        self.skipped += 1
+        return False
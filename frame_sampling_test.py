@@ -0,0 +1,43 @@
+import numpy
+
+import frame_sampling
+
+
+def create_frame(value=0, height=120, width=320):
+    return numpy.full((height, width, 3), value, dtype=numpy.uint8)
+
+
+def test_downscale_gray():
+    gray = frame_sampling.downscale_gray(create_frame(100), width=160)
+    assert gray.shape == (60, 160)
+    assert gray.dtype == numpy.float32
+    numpy.testing.assert_allclose(gray, 100, rtol=1e-5)
+
+
+def test_motion_gate_skips_static_frames():
+    gate = frame_sampling.MotionGate(threshold=1.0, max_skip=100)
+    assert gate.should_detect(create_frame())
+    # a little sensor noise is not motion
+    noisy = create_frame() + numpy.random.RandomState(1).randint(0, 10, size=(120, 320, 3)).astype(numpy.uint8)
+    assert not gate.should_detect(noisy)
+    assert not gate.should_detect(create_frame())
+    assert gate.skipped == 2
+
+
+def test_motion_gate_detects_motion():
+    gate = frame_sampling.MotionGate(threshold=1.0, max_skip=100)
+    assert gate.should_detect(create_frame())
+    moved = create_frame()
+    # an object covering 5% of the frame
+    moved[:24, :80] = 255
+    assert gate.should_detect(moved)
+    # the moved frame is now the reference
+    assert not gate.should_detect(moved.copy())
+    assert gate.skipped == 1
+
+
+def test_motion_gate_heartbeat():
+    gate = frame_sampling.MotionGate(threshold=1.0, max_skip=3)
+    decisions = [gate.should_detect(create_frame()) for _ in range(9)]
+    assert decisions == [True, False, False, False, True, False, False, False, True]
+    assert gate.skipped == 6
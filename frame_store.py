@@ -0,0 +1,171 @@
+"""
+stores that hold published frames outside the messages, so consumers that only need the detections never
+download the frames and those that do fetch them when needed
+
+A store writes each frame once under the message's request id and returns a reference that the message carries
+in string_map (see frame_encoding.REF_KEY), or None if it cannot keep the frame, which then stays in the message.
+Consumers pass the same kind of store to frame_encoding.decode_frame().
+    RedisFrameStore: a redis key per frame that expires after a ttl
+    MmapFrameStore: a ring buffer in a memory mapped file e.g. in /dev/shm, for consumers on the same host,
+        the oldest frames are overwritten once the ring is full
+"""
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+REDIS = 'redis'
+MMAP = 'mmap'
+STORE_TYPES = (REDIS, MMAP)
+
+# seconds a frame is kept in redis
+TTL = 60
+KEY_PREFIX = 'frame:'
+MMAP_PATH = '/dev/shm/video-object-detection-frames'
+SLOTS = 16
+# bytes, enough for a raw 720p frame, about 44MB of /dev/shm with SLOTS
+SLOT_SIZE = 1280 * 720 * 3
+
+
+class RedisFrameStore(object):
+    """ keeps each frame in a redis key that expires after ttl seconds """
+
+    def __init__(self, redis_client, ttl=TTL, key_prefix=KEY_PREFIX):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    def put(self, request_id, data):
+        """ store the frame's bytes, returns the reference to place in the message """
+        key = self.key_prefix + request_id
+        self.redis_client.set(key, data, ex=self.ttl)
+        return key
+
+    def get(self, reference):
+        """ returns the frame's bytes, None if the frame has expired """
+        return self.redis_client.get(reference)
+
+    def close(self):
+        pass
+
+
+class MmapFrameStore(object):
+    """
+    a ring buffer of fixed size slots in a memory mapped file, shared by the publisher and consumers on one host
+
+    file layout: a header (magic, slot count, slot size) followed by the slots
+    slot layout: a sequence number, the request id (64 bytes), the data length and the data
+    The sequence number is odd while a slot is being written, readers check it before and after copying the data
+    so they never return a frame that was overwritten meanwhile.
+    """
+    MAGIC = b'VODFRMS1'
+    HEADER = struct.Struct('<8sqq')
+    SLOT_HEADER = struct.Struct('<q64sq')
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self, path=MMAP_PATH, slots=SLOTS, slot_size=SLOT_SIZE, create=True):
+        """
+        :param path: the file to map, in /dev/shm it is backed by memory
+        :param slots: the number of frames kept, used when creating the file
+        :param slot_size: the largest frame in bytes, used when creating the file
+        :param create: True for the publisher, which creates the file, or reuses it if it has the same layout, False
+            for consumers, who read its header. Only one publisher can have a file open at a time
+        """
+        self.path = path
+        # the publisher holds an exclusive lock on path + LOCK_SUFFIX for as long as the store is open, a second
+        # publisher on the same path would interleave its writes with the first one's
+        self.owner = None
+        if create:
+            self.owner = open(path + self.LOCK_SUFFIX, 'a')
+            try:
+                fcntl.flock(self.owner, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.owner.close()
+                raise ValueError(f'another publisher is writing to {path}, give each one its own frame store path')
+        if create and self._read_header(path) != (self.MAGIC, slots, slot_size):
+            # written aside and moved in place, consumers that still map an earlier file keep their mapping instead of
+            # having it truncated under them
+            temporary_path = f'{path}.{os.getpid()}.tmp'
+            with open(temporary_path, 'wb') as f:
+                f.truncate(self.HEADER.size + slots * (self.SLOT_HEADER.size + slot_size))
+                f.write(self.HEADER.pack(self.MAGIC, slots, slot_size))
+            os.replace(temporary_path, path)
+        with open(path, 'r+b') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0)
+        magic, self.slots, self.slot_size = self.HEADER.unpack_from(self.buffer, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f'{path} is not a frame store')
+        self.next_slot = 0
+        self.lock = threading.Lock()
+        # frames larger than slot_size, left in their messages
+        self.oversized = 0
+
+    @classmethod
+    def _read_header(cls, path):
+        """ returns the header of an existing file as a tuple (magic, slots, slot size), None if there is none """
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(cls.HEADER.size)
+        except FileNotFoundError:
+            return None
+        return cls.HEADER.unpack(header) if len(header) == cls.HEADER.size else None
+
+    def _slot_offset(self, slot):
+        return self.HEADER.size + slot * (self.SLOT_HEADER.size + self.slot_size)
+
+    def put(self, request_id, data):
+        """
+        store the frame's bytes in the next slot, returns the reference to place in the message, None if the frame is
+        larger than slot_size
+        """
+        if len(data) > self.slot_size:
+            with self.lock:
+                self.oversized += 1
+            return None
+        with self.lock:
+            slot = self.next_slot
+            self.next_slot = (slot + 1) % self.slots
+            offset = self._slot_offset(slot)
+            sequence = self.SLOT_HEADER.unpack_from(self.buffer, offset)[0]
+            # odd while writing
+            self.SLOT_HEADER.pack_into(self.buffer, offset, sequence + 1, b'', 0)
+            data_offset = offset + self.SLOT_HEADER.size
+            self.buffer[data_offset:data_offset + len(data)] = data
+            self.SLOT_HEADER.pack_into(self.buffer, offset, sequence + 2, request_id.encode('ascii'), len(data))
+        return f'{slot}:{request_id}'
+
+    def get(self, reference):
+        """ returns the frame's bytes, None if its slot has been reused for a later frame """
+        slot, request_id = reference.split(':', 1)
+        offset = self._slot_offset(int(slot))
+        sequence, stored_id, length = self.SLOT_HEADER.unpack_from(self.buffer, offset)
+        if sequence % 2 or stored_id.rstrip(b'\0').decode('ascii') != request_id:
+            return None
+        data_offset = offset + self.SLOT_HEADER.size
+        data = self.buffer[data_offset:data_offset + length]
+        if self.SLOT_HEADER.unpack_from(self.buffer, offset)[0] != sequence:
+            return None
+        return data
+
+    def close(self):
+        self.buffer.close()
+        if self.owner:
+            # releases the lock for the next publisher
+            self.owner.close()
+
+
+def create_frame_store(store_type, redis_client=None, ttl=TTL, path=MMAP_PATH, slots=SLOTS, slot_size=SLOT_SIZE,
+                       create=True):
+    """
+    parameters:
+        store_type: one of STORE_TYPES
+        redis_client: e.g. redis.Redis(), for the redis store
+        ttl: seconds a frame is kept by the redis store
+        path, slots, slot_size, create: see MmapFrameStore
+    """
+    if store_type == REDIS:
+        return RedisFrameStore(redis_client, ttl)
+    if store_type == MMAP:
+        return MmapFrameStore(path, slots, slot_size, create)
+    raise ValueError(f'unknown frame store {store_type}, expected one of {STORE_TYPES}')
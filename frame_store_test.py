@@ -0,0 +1,94 @@
+import os
+import time
+
+import numpy
+import pytest
+
+import fake_services
+import frame_encoding
+import frame_store
+
+
+class Message(object):
+    """ a stand in for handle_detection_request with the fields frame_encoding uses """
+    def __init__(self, string_map):
+        self.string_map = string_map
+
+
+def test_redis_frame_store_round_trip():
+    store = frame_store.RedisFrameStore(fake_services.FakeRedis(), ttl=60)
+    frame = numpy.random.RandomState(3).randint(0, 256, size=(12, 16, 3)).astype(numpy.uint8)
+    frame_numbers, string_map = frame_encoding.encode_frame(frame, frame_encoding.FLOAT, frame_store=store,
+                                                            request_id='abc123')
+    assert frame_numbers is None
+    assert frame_encoding.DATA_KEY not in string_map
+    assert string_map[frame_encoding.REF_KEY] == 'frame:abc123'
+    assert string_map[frame_encoding.ENCODING_KEY] == frame_encoding.RAW
+    numpy.testing.assert_array_equal(frame_encoding.decode_frame(Message(string_map), store), frame)
+    with pytest.raises(ValueError):
+        frame_encoding.decode_frame(Message(string_map))
+
+
+def test_redis_frame_store_expires_frames():
+    store = frame_store.RedisFrameStore(fake_services.FakeRedis(), ttl=0.05)
+    reference = store.put('abc123', b'frame')
+    assert store.get(reference) == b'frame'
+    time.sleep(0.1)
+    assert store.get(reference) is None
+
+
+def test_mmap_frame_store_round_trip(tmp_path):
+    path = str(tmp_path / 'frames')
+    publisher_store = frame_store.MmapFrameStore(path, slots=4, slot_size=2000)
+    frame = numpy.random.RandomState(3).randint(0, 256, size=(20, 30, 3)).astype(numpy.uint8)
+    _, string_map = frame_encoding.encode_frame(frame, frame_encoding.RAW, frame_store=publisher_store,
+                                                request_id='abc123')
+    consumer_store = frame_store.MmapFrameStore(path, create=False)
+    assert consumer_store.slots == 4
+    numpy.testing.assert_array_equal(frame_encoding.decode_frame(Message(string_map), consumer_store), frame)
+
+
+def test_mmap_frame_store_overwrites_oldest_frames(tmp_path):
+    store = frame_store.MmapFrameStore(str(tmp_path / 'frames'), slots=2, slot_size=16)
+    references = [store.put(f'id{i}', b'frame %d' % i) for i in range(3)]
+    assert store.get(references[0]) is None
+    assert store.get(references[1]) == b'frame 1'
+    assert store.get(references[2]) == b'frame 2'
+    assert store.put('id3', b'a frame that is too large') is None
+    assert store.oversized == 1
+
+
+def test_mmap_frame_store_leaves_oversized_frames_in_the_message(tmp_path):
+    store = frame_store.MmapFrameStore(str(tmp_path / 'frames'), slots=2, slot_size=100)
+    frame = numpy.random.RandomState(3).randint(0, 256, size=(20, 30, 3)).astype(numpy.uint8)
+    _, string_map = frame_encoding.encode_frame(frame, frame_encoding.RAW, frame_store=store, request_id='abc123')
+    assert frame_encoding.REF_KEY not in string_map
+    numpy.testing.assert_array_equal(frame_encoding.decode_frame(Message(string_map), store), frame)
+
+
+def test_mmap_frame_store_restart_keeps_consumers_mapped(tmp_path):
+    path = str(tmp_path / 'frames')
+    publisher_store = frame_store.MmapFrameStore(path, slots=2, slot_size=16)
+    reference = publisher_store.put('id0', b'frame 0')
+    publisher_store.close()
+    consumer_store = frame_store.MmapFrameStore(path, create=False)
+    # a publisher restarting with the same layout reuses the file
+    frame_store.MmapFrameStore(path, slots=2, slot_size=16).close()
+    assert consumer_store.get(reference) == b'frame 0'
+    # one with another layout replaces it, the consumer's mapping of the old file stays readable
+    publisher_store = frame_store.MmapFrameStore(path, slots=4, slot_size=32)
+    assert consumer_store.get(reference) == b'frame 0'
+    assert publisher_store.get(reference) is None
+    assert frame_store.MmapFrameStore(path, create=False).slots == 4
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+
+def test_mmap_frame_store_refuses_a_second_publisher(tmp_path):
+    path = str(tmp_path / 'frames')
+    publisher_store = frame_store.MmapFrameStore(path, slots=2, slot_size=16)
+    with pytest.raises(ValueError):
+        frame_store.MmapFrameStore(path, slots=2, slot_size=16)
+    # consumers can still open it
+    frame_store.MmapFrameStore(path, create=False).close()
+    publisher_store.close()
+    frame_store.MmapFrameStore(path, slots=2, slot_size=16).close()
@@ -0,0 +1,97 @@
+"""
+read the object detection api's label maps (.pbtxt) without importing tensorflow or the object detection api
+
+A label map is a list of items in the protobuf text format e.g.
+    item {
+      name: "/m/01g317"
+      id: 1
+      display_name: "person"
+    }
+create_category_index_from_labelmap() returns the same category index as
+object_detection.utils.label_map_util.create_category_index_from_labelmap().
+"""
+import re
+
+# strings in single or double quotes, braces, colons, comments and bare words or numbers
+TOKEN_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|[{}:]|#[^\n]*|[^\s{}:"\'#]+')
+# fields of an item that hold strings
+STRING_FIELDS = ('name', 'display_name')
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text) if not token.startswith('#')]
+
+
+def parse_value(token):
+    if token[0] in '"\'':
+        return re.sub(r'\\(.)', r'\1', token[1:-1])
+    try:
+        return int(token)
+    except ValueError:
+        return token
+
+
+def parse_message(tokens, position):
+    """
+    parse the fields of a message up to its closing brace or the end of the tokens
+
+    returns a tuple of a dict of {field: list of values} and the position after the message
+    """
+    fields = {}
+    while position < len(tokens) and tokens[position] != '}':
+        name = tokens[position]
+        position += 1
+        if position < len(tokens) and tokens[position] == ':':
+            position += 1
+        if position >= len(tokens):
+            raise ValueError(f'label map ends in the middle of field {name}')
+        if tokens[position] == '{':
+            value, position = parse_message(tokens, position + 1)
+            if position >= len(tokens):
+                raise ValueError(f'label map is missing a closing brace for field {name}')
+            position += 1
+        else:
+            value = parse_value(tokens[position])
+            position += 1
+        fields.setdefault(name, []).append(value)
+    return fields, position
+
+
+def parse_label_map(text):
+    """ returns the items of a label map as a list of dicts with 'id', 'name' and, if present, 'display_name' """
+    tokens = tokenize(text)
+    fields, position = parse_message(tokens, 0)
+    if position < len(tokens):
+        raise ValueError('label map has an unexpected closing brace')
+    items = []
+    for item in fields.get('item', []):
+        if 'id' not in item:
+            raise ValueError(f'label map item {item} has no id')
+        parsed = {'id': int(item['id'][0])}
+        for field in STRING_FIELDS:
+            if field in item:
+                parsed[field] = str(item[field][0])
+        items.append(parsed)
+    return items
+
+
+def create_category_index_from_labelmap(label_map_path, use_display_name=True):
+    """
+    parameters:
+        label_map_path: path to a .pbtxt label map
+        use_display_name: name categories by their display_name when they have one, otherwise by their name
+
+    returns a dict of {id: {'id': id, 'name': name}}, items with ids below 1 e.g. background are left out
+    """
+    with open(label_map_path, 'r', encoding='utf-8') as f:
+        items = parse_label_map(f.read())
+    category_index = {}
+    for item in items:
+        if item['id'] < 0 or (item['id'] == 0 and item.get('name') != 'background'
+                              and item.get('display_name') != 'background'):
+            raise ValueError(f'label map ids should be at least 1, 0 is reserved for background, got {item}')
+        if item['id'] < 1:
+            continue
+        name = item.get('display_name') if use_display_name and 'display_name' in item else item.get('name')
+        category_index[item['id']] = {'id': item['id'], 'name': name}
+    return category_index
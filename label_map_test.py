@@ -0,0 +1,47 @@
+import pytest
+
+import label_map
+
+LABEL_MAP = '''
+# a comment
+item {
+  name: "/m/01g317"
+  id: 1
+  display_name: "person"
+}
+item {
+  name: '/m/0k4j'
+  id: 3
+  display_name: "car \\"sedan\\""
+}
+item { name: "bicycle" id: 2 }
+item {
+  name: "background"
+  id: 0
+  keypoints { id: 0 label: "nose" }
+}
+'''
+
+
+def test_parse_label_map():
+    items = label_map.parse_label_map(LABEL_MAP)
+    assert items[0] == {'id': 1, 'name': '/m/01g317', 'display_name': 'person'}
+    assert items[1]['display_name'] == 'car "sedan"'
+    assert items[2] == {'id': 2, 'name': 'bicycle'}
+    assert len(items) == 4
+
+
+def test_create_category_index_from_labelmap(tmp_path):
+    path = tmp_path / 'label_map.pbtxt'
+    path.write_text(LABEL_MAP)
+    assert label_map.create_category_index_from_labelmap(str(path)) == {
+        1: {'id': 1, 'name': 'person'}, 3: {'id': 3, 'name': 'car "sedan"'}, 2: {'id': 2, 'name': 'bicycle'}}
+    assert label_map.create_category_index_from_labelmap(str(path), use_display_name=False)[1]['name'] == '/m/01g317'
+
+
+@pytest.mark.parametrize('text', ['item { id: 0 name: "cat" }', 'item { name: "cat" }', 'item { id: 1', '}'])
+def test_invalid_label_maps(tmp_path, text):
+    path = tmp_path / 'label_map.pbtxt'
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        label_map.create_category_index_from_labelmap(str(path))
@@ -0,0 +1,119 @@
+"""
+build the serialized detection messages of one stream
+
+What stays the same for every message of a stream is worked out once: the request id hash of the instance and
+source, the class names in a lookup table indexed by class id and the fields that never change (instance name,
+source, start timestamp, float_map), which are serialized once. Each message then only serializes what changes
+and is joined to the constant bytes, protobuf parses concatenated messages as one message.
+A float frame (frame_encoding.FLOAT) is written straight from the numpy array as a packed float field instead of
+through protobuf, which converts each value separately.
+
+The messages and request ids are the same as those built field by field with detection_handler_pb2 and
+detect_video_stream_utils.create_detection_request_id().
+"""
+import hashlib
+
+import numpy
+
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+# field numbers from the generated classes, so the bytes written by hand follow the proto if it changes
+FRAME_FIELD = detection_handler_pb2.handle_detection_request.DESCRIPTOR.fields_by_name['frame'].number
+NUMBERS_FIELD = detection_handler_pb2.float_array.DESCRIPTOR.fields_by_name['numbers'].number
+SHAPE_FIELD = detection_handler_pb2.float_array.DESCRIPTOR.fields_by_name['shape'].number
+# the protobuf wire type of length delimited fields, which includes packed repeated fields and messages
+LENGTH_DELIMITED = 2
+
+
+def encode_varint(value):
+    """ encode a non negative integer as a protobuf varint """
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_tag(field_number, wire_type=LENGTH_DELIMITED):
+    return encode_varint(field_number << 3 | wire_type)
+
+
+def float_array_parts(field_number, numbers, shape):
+    """
+    the serialized parts of a detection_handler_pb2.float_array field, to be joined with the rest of the message
+
+    :param field_number: the message field holding the float_array
+    :param numbers: a numpy array, written as float32
+    :param shape: the shape to record
+    :return: a list of bytes objects
+    """
+    numbers_bytes = numpy.ascontiguousarray(numbers, dtype='<f4').tobytes()
+    shape_bytes = b''.join(encode_varint(int(size)) for size in shape)
+    parts = []
+    if numbers_bytes:
+        parts += [encode_tag(NUMBERS_FIELD), encode_varint(len(numbers_bytes)), numbers_bytes]
+    if shape_bytes:
+        parts += [encode_tag(SHAPE_FIELD), encode_varint(len(shape_bytes)), shape_bytes]
+    size = sum(len(part) for part in parts)
+    return [encode_tag(field_number), encode_varint(size)] + parts
+
+
+class MessageBuilder(object):
+    """ builds the serialized handle_detection_request messages of one stream """
+
+    def __init__(self, instance_name, source, start_timestamp, float_map, category_index):
+        """
+        :param instance_name: see detect_video_stream_utils.determine_instance_name()
+        :param source: see detect_video_stream_utils.determine_source_name()
+        :param start_timestamp: when the stream started, seconds since the epoch
+        :param float_map: a dict of float values added to every message e.g. the frame size
+        :param category_index: the category index dict e.g. {1: {'id': 1, 'name': 'person'}}
+        """
+        # the request id is a hash of the instance name, the source and the frame count, the first two never change
+        self.id_hash = hashlib.sha256(f'{instance_name}{source}'.encode('utf-8'))
+        self.constant_bytes = detection_handler_pb2.handle_detection_request(
+            instance_name=instance_name, source=source, start_timestamp=start_timestamp,
+            float_map=float_map).SerializeToString()
+        # class names by class id, None for ids that are not in the category index
+        self.class_names = [None] * (max(category_index, default=0) + 1)
+        for class_id, category in category_index.items():
+            self.class_names[class_id] = category['name']
+
+    def request_id(self, frame_count):
+        """ the same id as detect_video_stream_utils.create_detection_request_id(instance_name, source, frame_count) """
+        id_hash = self.id_hash.copy()
+        id_hash.update(str(frame_count).encode('utf-8'))
+        return id_hash.hexdigest()
+
+    def category_index(self, classes):
+        """ returns a dict of {class_id: class_name} for the classes, like detect_video_stream_utils.class_names_from_index() """
+        category_index = {}
+        for class_id in set(numpy.asarray(classes, dtype=numpy.int64).tolist()):
+            name = self.class_names[class_id] if 0 <= class_id < len(self.class_names) else None
+            if name is None:
+                raise KeyError(f'class id {class_id} is not in the category index')
+            category_index[class_id] = name
+        return category_index
+
+    def build(self, frame_count, output_dict, string_map, frame_numbers=None):
+        """
+        :param frame_count: the frame's position in the video
+        :param output_dict: the filtered detections, see detect_video_stream_utils.filter_detections()
+        :param string_map: a dict of string values for the message's string_map
+        :param frame_numbers: the frame to set as message.frame, a dict with 'numbers' and 'shape' as returned by
+            frame_encoding.encode_frame(), None to leave it empty
+        :return: the serialized message
+        """
+        boxes = output_dict['detection_boxes']
+        message = detection_handler_pb2.handle_detection_request(
+            frame_count=frame_count,
+            detection_scores=output_dict['detection_scores'],
+            detection_classes=output_dict['detection_classes'].astype(numpy.float32),
+            detection_boxes=detection_handler_pb2.float_array(numbers=boxes.ravel(), shape=boxes.shape),
+            category_index=self.category_index(output_dict['detection_classes']),
+            string_map=string_map)
+        parts = [self.constant_bytes, message.SerializeToString()]
+        if frame_numbers:
+            parts += float_array_parts(FRAME_FIELD, frame_numbers['numbers'], frame_numbers['shape'])
+        return b''.join(parts)
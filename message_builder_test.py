@@ -0,0 +1,81 @@
+import numpy
+import pytest
+
+import detect_video_stream_utils
+import frame_encoding
+import message_builder
+from juu_object_detection_protos.api.generated import detection_handler_pb2
+
+CATEGORY_INDEX = {1: {'id': 1, 'name': 'person'}, 3: {'id': 3, 'name': 'car'}}
+FLOAT_MAP = {'frame_height': 640.0, 'frame_width': 480.0}
+OUTPUT_DICT = {'detection_scores': numpy.array([0.9, 0.7], dtype=numpy.float32),
+               'detection_classes': numpy.array([3, 1], dtype=numpy.int64),
+               'detection_boxes': numpy.array([[0.1, 0.2, 0.3, 0.4], [0.5, 0.6, 0.7, 0.8]], dtype=numpy.float32)}
+
+
+def build_message(frame_count, output_dict, string_map, frame_numbers):
+    """ the message as detect_video_stream built it field by field """
+    detection_boxes = detection_handler_pb2.float_array(numbers=output_dict['detection_boxes'].ravel(),
+                                                        shape=output_dict['detection_boxes'].shape)
+    return detection_handler_pb2.handle_detection_request(
+        start_timestamp=1565000000.0,
+        detection_classes=output_dict['detection_classes'].astype(numpy.float32),
+        detection_scores=output_dict['detection_scores'],
+        detection_boxes=detection_boxes,
+        instance_name='eric-aspire',
+        frame=detection_handler_pb2.float_array(**frame_numbers) if frame_numbers else None,
+        frame_count=frame_count,
+        source='/videos/train.mp4',
+        float_map=FLOAT_MAP,
+        category_index=detect_video_stream_utils.class_names_from_index(output_dict['detection_classes'],
+                                                                        CATEGORY_INDEX),
+        string_map=string_map)
+
+
+@pytest.fixture
+def builder():
+    return message_builder.MessageBuilder('eric-aspire', '/videos/train.mp4', 1565000000.0, FLOAT_MAP, CATEGORY_INDEX)
+
+
+def test_request_ids_match_create_detection_request_id(builder):
+    for frame_count in (0, 7, 12345):
+        assert builder.request_id(frame_count) == detect_video_stream_utils.create_detection_request_id(
+            'eric-aspire', '/videos/train.mp4', frame_count)
+
+
+@pytest.mark.parametrize('encoding', [frame_encoding.FLOAT, frame_encoding.RAW, frame_encoding.NONE])
+def test_build_matches_message_built_field_by_field(builder, encoding):
+    frame = numpy.random.RandomState(1).randint(0, 256, size=(24, 32, 3)).astype(numpy.uint8)
+    frame_numbers, string_map = frame_encoding.encode_frame(frame, encoding)
+    string_map['id'] = builder.request_id(42)
+    payload = builder.build(42, OUTPUT_DICT, string_map, frame_numbers)
+    assert detection_handler_pb2.handle_detection_request.FromString(payload) == \
+        build_message(42, OUTPUT_DICT, string_map, frame_numbers)
+    decoded = frame_encoding.decode_frame(detection_handler_pb2.handle_detection_request.FromString(payload))
+    if encoding != frame_encoding.NONE:
+        numpy.testing.assert_array_equal(decoded, frame)
+
+
+@pytest.mark.parametrize('encoding', [frame_encoding.FLOAT, frame_encoding.NONE])
+def test_build_serializes_like_the_generated_class(builder, encoding):
+    frame = numpy.random.RandomState(2).randint(0, 256, size=(24, 32, 3)).astype(numpy.uint8)
+    frame_numbers, string_map = frame_encoding.encode_frame(frame, encoding)
+    string_map['id'] = builder.request_id(7)
+    parsed = detection_handler_pb2.handle_detection_request.FromString(builder.build(7, OUTPUT_DICT, string_map,
+                                                                                     frame_numbers))
+    expected = build_message(7, OUTPUT_DICT, string_map, frame_numbers)
+    # every field the builder wrote by hand lands where the generated class puts it
+    assert parsed.SerializeToString(deterministic=True) == expected.SerializeToString(deterministic=True)
+
+
+def test_category_index_lookup(builder):
+    assert builder.category_index(numpy.array([3, 1, 3])) == {1: 'person', 3: 'car'}
+    for classes in ([2], [4], [-1]):
+        with pytest.raises(KeyError):
+            builder.category_index(numpy.array(classes))
+
+
+def test_encode_varint():
+    assert message_builder.encode_varint(1) == b'\x01'
+    assert message_builder.encode_varint(300) == b'\xac\x02'
+    assert message_builder.encode_varint(1920000) == b'\x80\x98\x75'
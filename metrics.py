@@ -0,0 +1,241 @@
+"""
+per stage latency histograms and frame counters for the detection streams
+
+Each stream records into its own StreamMetrics, labelled with the stream's source:
+    stages (histograms of seconds): 'decode' (reading and decoding up to a sampled frame), 'request' (building the
+        prediction request), 'predict' (until the prediction is back), 'filter', 'serialize' (building and
+        serializing the message, including the frame), 'publish' (handing the message to the sink, which includes
+        waiting on a full buffer), 'capture_to_publish' (from capturing a published frame of a live source)
+    counters: 'read', 'sampled', 'static', 'detected', 'suppressed', 'published' frames (handed to the sink), 'sent'
+        messages and their 'payload_bytes' once redis accepted them, 'send_failed' and 'send_dropped' messages (see
+        detection_sinks.BufferedRedisSink.send), 'cache_hits' and 'cache_misses' of the detection cache (see detection_cache.py) and the frames of live sources
+        'dropped' to keep up (see video_sources.LiveSource)
+A MetricsRegistry holds the metrics of all the streams in a process, they can be scraped in the prometheus text
+format from a MetricsServer or logged as json lines by a MetricsLogger.
+
+Recording is a lock and a bisect per observation, cheap enough to leave on.
+"""
+import bisect
+import collections
+import http.server
+import json
+import logging
+import threading
+import time
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = 'video_detection'
+METRICS_PATH = '/metrics'
+# only this host can scrape by default, e.g. '0.0.0.0' for a prometheus server elsewhere
+HOST = '127.0.0.1'
+# seconds
+LOG_INTERVAL = 60.0
+
+
+class Histogram(object):
+    """ counts observations into buckets, with their sum, like a prometheus histogram """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # the last count is for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """ an estimate of the q quantile, the upper bound of the bucket it falls in, None without observations """
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """ a dict with the count, mean and estimated median and 99th percentile """
+        with self.lock:
+            count, total = self.count, self.sum
+        return {'count': count, 'mean': total / count if count else None,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+
+class StreamMetrics(object):
+    """ the stage histograms and frame counters of one stream """
+
+    def __init__(self, labels, counters=None, buckets=BUCKETS):
+        """
+        :param labels: a dict of labels identifying the stream e.g. {'source': 'front-door.mp4'}
+        :param counters: a collections.Counter to keep the counters in e.g. the stats passed to run_pipeline(),
+            created if absent
+        """
+        self.labels = labels
+        self.counters = collections.Counter() if counters is None else counters
+        self.buckets = buckets
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """ record how long a stage took for one frame or batch """
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.stages.setdefault(stage, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    def increment(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def timed(self, stage, function):
+        """ returns a function that calls function and records how long it took as the stage """
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.observe(stage, time.perf_counter() - start)
+
+        return timed_function
+
+    def summary(self):
+        """ a json friendly dict of the labels, counters and a summary of each stage """
+        return {'labels': self.labels, 'counters': dict(self.counters),
+                'stages': {stage: histogram.summary() for stage, histogram in list(self.stages.items())}}
+
+
+def format_labels(labels):
+    """ returns labels in the prometheus text format e.g. {source="a.mp4",stage="decode"} """
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricsRegistry(object):
+    """ the metrics of all the streams in a process """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.streams = []
+        self.lock = threading.Lock()
+
+    def stream_metrics(self, labels, counters=None):
+        """
+        returns the StreamMetrics of the stream with these labels, see StreamMetrics for the parameters
+        a restarted stream gets its earlier metrics back so its histograms and counters keep adding up
+        """
+        with self.lock:
+            for metrics in self.streams:
+                if metrics.labels == labels:
+                    return metrics
+            metrics = StreamMetrics(labels, counters, self.buckets)
+            self.streams.append(metrics)
+        return metrics
+
+    def summary(self):
+        """ a list with the summary of each stream, see StreamMetrics.summary() """
+        with self.lock:
+            streams = list(self.streams)
+        return [metrics.summary() for metrics in streams]
+
+    def to_prometheus(self):
+        """ returns the metrics of all streams in the prometheus text exposition format """
+        with self.lock:
+            streams = list(self.streams)
+        counter_lines = collections.defaultdict(list)
+        histogram_lines = []
+        for metrics in streams:
+            for counter, value in list(metrics.counters.items()):
+                counter_lines[counter].append(f'{PREFIX}_{counter}_total{format_labels(metrics.labels)} {value}')
+            for stage, histogram in list(metrics.stages.items()):
+                labels = dict(metrics.labels, stage=stage)
+                with histogram.lock:
+                    counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    histogram_lines.append(
+                        f'{PREFIX}_stage_seconds_bucket{format_labels(dict(labels, le=le))} {cumulative}')
+                histogram_lines.append(f'{PREFIX}_stage_seconds_sum{format_labels(labels)} {total}')
+                histogram_lines.append(f'{PREFIX}_stage_seconds_count{format_labels(labels)} {count}')
+        lines = []
+        for counter, counter_samples in sorted(counter_lines.items()):
+            lines.append(f'# TYPE {PREFIX}_{counter}_total counter')
+            lines.extend(counter_samples)
+        if histogram_lines:
+            lines.append(f'# TYPE {PREFIX}_stage_seconds histogram')
+            lines.extend(histogram_lines)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    """ serves the metrics of a registry in the prometheus text format over http from a background thread """
+
+    def __init__(self, registry, port, host=HOST):
+        """
+        :param port: the port to listen on, 0 picks a free one, see self.port
+        :param host: the address to listen on, the loopback interface by default, '' for all interfaces
+        """
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != METRICS_PATH:
+                    self.send_error(404)
+                    return
+                body = registry.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics server', daemon=True)
+        self.thread.start()
+        logging.debug(f'serving metrics on {host}:{self.port}{METRICS_PATH}')
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLogger(object):
+    """ logs the summary of a registry as a json line every interval seconds from a background thread """
+
+    def __init__(self, registry, interval=LOG_INTERVAL):
+        self.registry = registry
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics logger', daemon=True)
+        self.thread.start()
+
+    def log(self):
+        logging.info(json.dumps({'metrics': self.registry.summary()}))
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.log()
+
+    def close(self):
+        """ stop logging, after logging a last summary """
+        self.stopping.set()
+        self.thread.join()
+        self.log()
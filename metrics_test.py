@@ -0,0 +1,77 @@
+import json
+import logging
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+def test_histogram_counts_observations_into_buckets():
+    histogram = metrics.Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == pytest.approx(5.565)
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == float('inf')
+    assert metrics.Histogram().quantile(0.5) is None
+
+
+def test_stream_metrics_timed_records_stage():
+    stream_metrics = metrics.StreamMetrics({'source': 'test'})
+    assert stream_metrics.timed('request', lambda x: x * 2)(4) == 8
+    stream_metrics.increment('published')
+    summary = stream_metrics.summary()
+    assert summary['counters'] == {'published': 1}
+    assert summary['stages']['request']['count'] == 1
+
+
+def test_registry_returns_the_same_metrics_for_a_restarted_stream():
+    registry = metrics.MetricsRegistry()
+    first = registry.stream_metrics({'source': 'a'})
+    assert registry.stream_metrics({'source': 'a'}) is first
+    assert registry.stream_metrics({'source': 'b'}) is not first
+
+
+def test_registry_to_prometheus():
+    registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+    for source in ('a', 'b"c'):
+        stream_metrics = registry.stream_metrics({'source': source})
+        stream_metrics.increment('read', 10)
+        stream_metrics.observe('decode', 0.5)
+    text = registry.to_prometheus()
+    lines = text.splitlines()
+    assert lines.count('# TYPE video_detection_read_total counter') == 1
+    assert 'video_detection_read_total{source="a"} 10' in lines
+    assert 'video_detection_read_total{source="b\\"c"} 10' in lines
+    assert lines.count('# TYPE video_detection_stage_seconds histogram') == 1
+    assert 'video_detection_stage_seconds_bucket{source="a",stage="decode",le="0.1"} 0' in lines
+    assert 'video_detection_stage_seconds_bucket{source="a",stage="decode",le="1.0"} 1' in lines
+    assert 'video_detection_stage_seconds_bucket{source="a",stage="decode",le="+Inf"} 1' in lines
+    assert 'video_detection_stage_seconds_count{source="a",stage="decode"} 1' in lines
+
+
+def test_metrics_server_serves_prometheus_text():
+    registry = metrics.MetricsRegistry()
+    registry.stream_metrics({'source': 'a'}).increment('published', 3)
+    server = metrics.MetricsServer(registry, 0, host='127.0.0.1')
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+            assert 'video_detection_published_total{source="a"} 3' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f'http://127.0.0.1:{server.port}/other')
+    finally:
+        server.close()
+
+
+def test_metrics_logger_logs_json_summary(caplog):
+    registry = metrics.MetricsRegistry()
+    registry.stream_metrics({'source': 'a'}).observe('publish', 0.002)
+    with caplog.at_level(logging.INFO):
+        metrics.MetricsLogger(registry, interval=60).close()
+    summary = json.loads(caplog.records[-1].getMessage())['metrics']
+    assert summary[0]['labels'] == {'source': 'a'}
+    assert summary[0]['stages']['publish']['count'] == 1
@@ -0,0 +1,124 @@
+"""
+send each batch of frames to several models and join their detections into one result per frame
+
+The frames are decoded and encoded into a request once, the same request is sent to every model. Responses are
+joined per frame, so downstream gets one merged message per frame instead of one per model. Models that have
+not responded within the join timeout are left out of the result and listed as missing.
+"""
+import logging
+import time
+
+import numpy
+
+# seconds to wait for all models to respond before publishing what has arrived
+JOIN_TIMEOUT = 5.0
+
+
+class FanOutFuture(object):
+    """ waits on the futures of several models, with one deadline for all of them """
+
+    def __init__(self, futures_by_model, timeout=JOIN_TIMEOUT, clock=time.monotonic):
+        """
+        :param futures_by_model: a dict of {model_name: future}, in the order results should be merged
+        :param timeout: seconds to wait for all futures from now
+        """
+        self.futures_by_model = futures_by_model
+        self.clock = clock
+        self.deadline = clock() + timeout
+
+    def done(self):
+        return self.clock() >= self.deadline or all(future.done() for future in self.futures_by_model.values())
+
+    def result(self):
+        """
+        returns a dict with
+            'responses': a dict of {model_name: prediction} for the models that responded in time
+            'missing': a list of the names of the models that failed or did not respond in time
+        """
+        responses = {}
+        missing = []
+        for model_name, future in self.futures_by_model.items():
+            try:
+                responses[model_name] = future.result(timeout=max(0.0, self.deadline - self.clock()))
+            except Exception as e:
+                logging.debug(f'no prediction from {model_name}: {e!r}')
+                future.cancel()
+                missing.append(model_name)
+        return {'responses': responses, 'missing': missing}
+
+
+def fan_out_predictor(tensorflow_serving_stub, build_prediction_request, model_names, predict_timeout,
+                      join_timeout=JOIN_TIMEOUT):
+    """
+    parameters:
+        tensorflow_serving_stub: a prediction_service_pb2_grpc.PredictionServiceStub or a serving_client.BalancedClient
+        build_prediction_request: see detect_video_stream_utils.predict_request_builder()
+        model_names: the names of the models to send each request to
+        predict_timeout: the grpc deadline in seconds for each model's request
+        join_timeout: seconds to wait for all models to respond
+
+    returns a predict_async function for detect_video_stream_pipeline.run_pipeline()
+    """
+    def predict_async(frames):
+        prediction_request = build_prediction_request(frames)
+        futures_by_model = {}
+        for model_name in model_names:
+            # the request is serialized before Predict.future() returns, so only the model name needs changing
+            prediction_request.model_spec.name = model_name
+            futures_by_model[model_name] = tensorflow_serving_stub.Predict.future(prediction_request, predict_timeout)
+        return FanOutFuture(futures_by_model, join_timeout)
+
+    return predict_async
+
+
+def split_fan_out(result, frame_total, split_prediction):
+    """
+    split the joined result for a batch into one per frame
+
+    :param result: returned by FanOutFuture.result()
+    :param frame_total: the number of frames in the batch
+    :param split_prediction: splits one model's prediction for the batch e.g. detect_video_stream_utils.split_prediction_response
+    :return: a list of results in the same format as FanOutFuture.result(), one per frame
+    """
+    split_responses = {model_name: split_prediction(response, frame_total)
+                       for model_name, response in result['responses'].items()}
+    return [{'responses': {model_name: responses[i] for model_name, responses in split_responses.items()},
+             'missing': result['missing']}
+            for i in range(frame_total)]
+
+
+def merge_detections(filter_prediction, result, cut_off_score, class_cut_off_scores=None, top_k=None):
+    """
+    filter each model's prediction for a frame and merge the detections
+
+    :param filter_prediction: filters one model's prediction, called with the prediction, cut_off_score,
+        class_cut_off_scores and top_k
+    :param result: the joined result for one frame, see FanOutFuture.result()
+    :param top_k: the most detections kept for the frame, the highest scores of all models are kept
+    :return: a filtered output dict (see detect_video_stream_utils.filter_detections()) with the detections of all
+        models in model order, and a 'string_map' dict telling consumers which detections came from which model:
+            'models': the models that responded e.g. 'ssd,faster_rcnn'
+            'model_detection_counts': how many detections came from each of those models e.g. '2,0'
+            'missing_models': the models that did not respond in time
+    """
+    output_dicts = [filter_prediction(response, cut_off_score, class_cut_off_scores, top_k)
+                    for response in result['responses'].values()]
+    if output_dicts:
+        merged = {key: numpy.concatenate([output_dict[key] for output_dict in output_dicts])
+                  for key in ('detection_scores', 'detection_classes', 'detection_boxes')}
+    else:
+        merged = {'detection_scores': numpy.zeros(0, numpy.float32),
+                  'detection_classes': numpy.zeros(0, numpy.int64),
+                  'detection_boxes': numpy.zeros((0, 4), numpy.float32)}
+    models = numpy.repeat(numpy.arange(len(output_dicts)),
+                          [len(output_dict['detection_scores']) for output_dict in output_dicts]).astype(numpy.int64)
+    if top_k is not None and len(models) > top_k:
+        # each model kept its own top_k, keep the top_k of them all, still in model order so the counts hold
+        retained = numpy.sort(numpy.argsort(-merged['detection_scores'], kind='stable')[:top_k])
+        merged = {key: values[retained] for key, values in merged.items()}
+        models = models[retained]
+    merged['string_map'] = {
+        'models': ','.join(result['responses']),
+        'model_detection_counts': ','.join(str(count) for count in numpy.bincount(models, minlength=len(output_dicts))),
+        'missing_models': ','.join(result['missing'])}
+    return merged
@@ -0,0 +1,88 @@
+import time
+import types
+from concurrent import futures
+
+import numpy
+
+import detect_video_stream_utils
+import model_fanout
+
+
+def create_output_dict(scores, classes):
+    return {'detection_scores': scores, 'detection_classes': classes,
+            'detection_boxes': numpy.arange(len(scores) * 4, dtype=numpy.float32).reshape(-1, 4)}
+
+
+def test_fan_out_future_leaves_out_stragglers():
+    executor = futures.ThreadPoolExecutor(max_workers=3)
+    futures_by_model = {'fast': executor.submit(lambda: 'fast response'),
+                        'slow': executor.submit(lambda: time.sleep(0.5) or 'slow response'),
+                        'broken': executor.submit(lambda: 1 / 0)}
+    future = model_fanout.FanOutFuture(futures_by_model, timeout=0.1)
+    result = future.result()
+    assert result['responses'] == {'fast': 'fast response'}
+    assert sorted(result['missing']) == ['broken', 'slow']
+    assert future.done()
+
+
+def test_fan_out_predictor_sends_one_request_to_each_model():
+    executor = futures.ThreadPoolExecutor(max_workers=2)
+    sent = []
+
+    class Predict(object):
+        """ a stand in for stub.Predict """
+        def future(self, request, timeout):
+            # a grpc stub serializes the request before returning
+            model_name = request.model_spec.name
+            sent.append(model_name)
+            return executor.submit(lambda: model_name + ' response')
+
+    stub = types.SimpleNamespace(Predict=Predict())
+    built = []
+
+    def build_prediction_request(frames):
+        built.append(frames)
+        return types.SimpleNamespace(model_spec=types.SimpleNamespace(name=None))
+
+    predict_async = model_fanout.fan_out_predictor(stub, build_prediction_request, ['ssd', 'rcnn'],
+                                                   predict_timeout=10, join_timeout=1)
+    result = predict_async(['frame']).result()
+    assert built == [['frame']], "the request is built once for all models"
+    assert sent == ['ssd', 'rcnn']
+    assert result == {'responses': {'ssd': 'ssd response', 'rcnn': 'rcnn response'}, 'missing': []}
+
+
+def test_split_fan_out():
+    result = {'responses': {'ssd': [1, 2], 'rcnn': [3, 4]}, 'missing': ['yolo']}
+    frames = model_fanout.split_fan_out(result, 2, lambda response, frame_total: response)
+    assert frames == [{'responses': {'ssd': 1, 'rcnn': 3}, 'missing': ['yolo']},
+                      {'responses': {'ssd': 2, 'rcnn': 4}, 'missing': ['yolo']}]
+
+
+def test_merge_detections():
+    result = {'responses': {'ssd': create_output_dict([.9, .2], [1, 3]),
+                            'rcnn': create_output_dict([.8, .7], [3, 4])},
+              'missing': ['yolo']}
+    merged = model_fanout.merge_detections(detect_video_stream_utils.filter_detection_output, result, .5)
+    assert list(merged['detection_scores']) == [.9, .8, .7]
+    assert list(merged['detection_classes']) == [1, 3, 4]
+    assert merged['detection_boxes'].shape == (3, 4)
+    assert merged['string_map'] == {'models': 'ssd,rcnn', 'model_detection_counts': '1,2', 'missing_models': 'yolo'}
+
+
+def test_merge_detections_keeps_the_top_k_of_all_models():
+    result = {'responses': {'ssd': create_output_dict([.9, .6, .55], [1, 3, 1]),
+                            'rcnn': create_output_dict([.8, .7, .5], [3, 4, 4])},
+              'missing': []}
+    merged = model_fanout.merge_detections(detect_video_stream_utils.filter_detection_output, result, .5, None, 3)
+    assert list(merged['detection_scores']) == [.9, .8, .7]
+    assert list(merged['detection_classes']) == [1, 3, 4]
+    assert merged['detection_boxes'].shape == (3, 4)
+    assert merged['string_map']['model_detection_counts'] == '1,2'
+
+
+def test_merge_detections_no_responses():
+    merged = model_fanout.merge_detections(detect_video_stream_utils.filter_detection_output,
+                                           {'responses': {}, 'missing': ['ssd']}, .5)
+    assert merged['detection_boxes'].shape == (0, 4)
+    assert merged['string_map']['missing_models'] == 'ssd'
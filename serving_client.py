@@ -0,0 +1,335 @@
+"""
+send Predict requests to several tensorflow serving endpoints, a drop in for PredictionServiceStub.Predict.future
+
+Each request goes to the endpoint with the fewest requests in flight, endpoints with max_inflight requests in
+flight are not picked and the caller waits for one to free up. Every request has a deadline:
+    - a request that fails with a transient error is retried on another endpoint while there is time left
+    - with hedge_delay set, a request that has not been answered after that many seconds is also sent to another
+      endpoint and the first response wins, so a stalled endpoint costs hedge_delay instead of the whole deadline
+    - retries and hedges are only sent when the time left is more than the endpoint usually takes
+An endpoint that fails eject_after times in a row is not picked for eject_time seconds, then it gets requests
+again until it fails once more or answers.
+
+For each endpoint, metrics (see metrics.py) labelled with its address record the 'rpc' latency and count the
+'requests', 'failures', 'retries', 'hedges' and 'ejections'.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import grpc
+
+import metrics
+
+PREDICT_METHOD = '/tensorflow.serving.PredictionService/Predict'
+# seconds
+DEADLINE = 10.0
+MAX_INFLIGHT = 8
+MAX_ATTEMPTS = 3
+EJECT_AFTER = 3
+EJECT_TIME = 5.0
+# how much each response moves an endpoint's latency estimate
+LATENCY_SMOOTHING = 0.2
+# errors that say nothing about the request itself, so another endpoint may answer it
+RETRYABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                   grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.ABORTED, grpc.StatusCode.CANCELLED)
+
+
+def parse_endpoints(endpoints, default_port=None):
+    """
+    :param endpoints: comma separated host:port addresses e.g. 'serving-1:8500,serving-2:8500', a host without a
+        port gets default_port
+    :return: a list of addresses
+    """
+    addresses = []
+    for endpoint in endpoints.split(','):
+        endpoint = endpoint.strip()
+        if not endpoint:
+            continue
+        if ':' not in endpoint:
+            if default_port is None:
+                raise ValueError(f'endpoint {endpoint} has no port')
+            endpoint = f'{endpoint}:{default_port}'
+        addresses.append(endpoint)
+    if not addresses:
+        raise ValueError(f'no endpoints in {endpoints!r}')
+    return addresses
+
+
+class Endpoint(object):
+    """ one tensorflow serving address and its health """
+
+    def __init__(self, address, response_deserializer, registry, clock=time.monotonic):
+        self.address = address
+        self.channel = grpc.insecure_channel(address, options=[('grpc.max_receive_message_length', -1)])
+        # requests are serialized once by the client and sent as bytes to every endpoint they go to
+        self.predict = self.channel.unary_unary(PREDICT_METHOD, response_deserializer=response_deserializer)
+        self.metrics = registry.stream_metrics({'endpoint': address})
+        self.clock = clock
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = None
+        # seconds, None until the endpoint answers
+        self.latency = None
+
+    def available(self, now):
+        return self.ejected_until is None or now >= self.ejected_until
+
+    def record(self, seconds, failed, eject_after, eject_time):
+        """ update the health after a request, called with the client's lock held """
+        self.metrics.observe('rpc', seconds)
+        if not failed:
+            self.consecutive_failures = 0
+            self.ejected_until = None
+            self.latency = seconds if self.latency is None else \
+                self.latency + LATENCY_SMOOTHING * (seconds - self.latency)
+            return
+        self.metrics.increment('failures')
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= eject_after:
+            if self.ejected_until is None or self.clock() >= self.ejected_until:
+                logging.warning(f'ejecting tensorflow serving endpoint {self.address} for {eject_time} seconds after '
+                                f'{self.consecutive_failures} failures in a row')
+                self.metrics.increment('ejections')
+            self.ejected_until = self.clock() + eject_time
+
+    def close(self):
+        self.channel.close()
+
+
+class Scheduler(object):
+    """ runs functions at given times in one background thread, for the hedges of all requests """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.condition = threading.Condition()
+        # (time, sequence, function)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='Scheduler', daemon=True)
+        self.thread.start()
+
+    def call_at(self, when, function):
+        with self.condition:
+            heapq.heappush(self.heap, (when, next(self.sequence), function))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.heap or self.heap[0][0] > self.clock()):
+                    self.condition.wait(self.heap[0][0] - self.clock() if self.heap else None)
+                if self.closed:
+                    return
+                _, _, function = heapq.heappop(self.heap)
+            try:
+                function()
+            except Exception:
+                logging.exception('scheduled call failed')
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+class BalancedFuture(object):
+    """ the result of a request that may be sent to several endpoints, the first response is the result """
+
+    def __init__(self, client, payload, deadline):
+        self.client = client
+        self.payload = payload
+        self.deadline = deadline
+        self.done_event = threading.Event()
+        self.response = None
+        self.error = None
+        # (endpoint, grpc future) of the attempts in flight
+        self.attempts = []
+        self.attempt_count = 0
+        self.tried = set()
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def result(self, timeout=None):
+        if not self.done_event.wait(timeout):
+            raise TimeoutError('the prediction is not done')
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def exception(self, timeout=None):
+        if not self.done_event.wait(timeout):
+            raise TimeoutError('the prediction is not done')
+        return self.error
+
+    def cancel(self):
+        """ stop waiting on the endpoints, the future fails with grpc.FutureCancelledError """
+        with self.client.lock:
+            if self.done():
+                return False
+            self._finish(None, grpc.FutureCancelledError())
+        return True
+
+    def cancelled(self):
+        return isinstance(self.error, grpc.FutureCancelledError)
+
+    def _finish(self, response, error):
+        """ called with the client's lock held, cancels the attempts still in flight """
+        self.response, self.error = response, error
+        attempts, self.attempts = self.attempts, []
+        self.done_event.set()
+        for _, attempt in attempts:
+            attempt.cancel()
+
+
+class Predict(object):
+    """ the Predict method of a BalancedClient, like a grpc unary unary multi callable """
+
+    def __init__(self, client):
+        self.client = client
+
+    def future(self, request, timeout=DEADLINE):
+        return self.client.predict_future(request, timeout)
+
+    def __call__(self, request, timeout=DEADLINE):
+        return self.client.predict_future(request, timeout).result()
+
+
+class BalancedClient(object):
+    """ spreads Predict requests over tensorflow serving endpoints, see the module docstring """
+
+    def __init__(self, addresses, request_serializer=None, response_deserializer=None, max_inflight=MAX_INFLIGHT,
+                 hedge_delay=None, max_attempts=MAX_ATTEMPTS, eject_after=EJECT_AFTER, eject_time=EJECT_TIME,
+                 registry=None, clock=time.monotonic):
+        """
+        :param addresses: host:port addresses, see parse_endpoints()
+        :param request_serializer: turns a request into bytes e.g. predict_pb2.PredictRequest.SerializeToString,
+            requests must already be bytes if absent
+        :param response_deserializer: turns bytes into a response e.g. predict_pb2.PredictResponse.FromString,
+            responses are bytes if absent
+        :param max_inflight: the most requests in flight at each endpoint
+        :param hedge_delay: seconds after which an unanswered request is also sent to another endpoint, None to
+            only send it again after a failure
+        :param max_attempts: the most endpoints a request is sent to, counting retries and hedges
+        :param eject_after: failures in a row after which an endpoint is ejected
+        :param eject_time: seconds an ejected endpoint gets no requests
+        :param registry: the metrics.MetricsRegistry to record each endpoint's metrics in, created if absent
+        """
+        self.request_serializer = request_serializer
+        self.registry = registry or metrics.MetricsRegistry()
+        self.endpoints = [Endpoint(address, response_deserializer, self.registry, clock) for address in addresses]
+        self.max_inflight = max_inflight
+        self.hedge_delay = hedge_delay
+        self.max_attempts = max_attempts
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.clock = clock
+        self.lock = threading.Condition()
+        self.scheduler = Scheduler(clock) if hedge_delay else None
+        self.Predict = Predict(self)
+
+    def _pick(self, exclude=()):
+        """ the endpoint with room and the fewest requests in flight, None if there is none, with the lock held """
+        now = self.clock()
+        candidates = [endpoint for endpoint in self.endpoints
+                      if endpoint.inflight < self.max_inflight and endpoint not in exclude]
+        available = [endpoint for endpoint in candidates if endpoint.available(now)]
+        if not available and candidates and not any(endpoint.available(now) for endpoint in self.endpoints):
+            # every endpoint is ejected, try the one whose ejection ends first rather than failing outright
+            available = [min(candidates, key=lambda endpoint: endpoint.ejected_until)]
+        if not available:
+            return None
+        return min(available, key=lambda endpoint: (endpoint.inflight, endpoint.latency or 0.0))
+
+    def _has_time_for(self, endpoint, future):
+        """ whether the endpoint usually answers before the request's deadline """
+        return self.clock() + (endpoint.latency or 0.0) < future.deadline
+
+    def predict_future(self, request, timeout=DEADLINE):
+        """ send the request to the least loaded endpoint, waiting until timeout for one to have room """
+        payload = self.request_serializer(request) if self.request_serializer else request
+        future = BalancedFuture(self, payload, self.clock() + timeout)
+        with self.lock:
+            endpoint = self._pick()
+            while endpoint is None:
+                remaining = future.deadline - self.clock()
+                if remaining <= 0:
+                    future._finish(None, TimeoutError('every tensorflow serving endpoint is at its in flight limit'))
+                    return future
+                self.lock.wait(remaining)
+                endpoint = self._pick()
+            self._send(future, endpoint)
+        if self.scheduler:
+            self.scheduler.call_at(self.clock() + self.hedge_delay, lambda: self._hedge(future))
+        return future
+
+    def _send(self, future, endpoint):
+        """ send an attempt of the request to the endpoint, with the lock held """
+        endpoint.inflight += 1
+        endpoint.metrics.increment('requests')
+        future.attempt_count += 1
+        future.tried.add(endpoint)
+        start = self.clock()
+        attempt = endpoint.predict.future(future.payload, max(0.0, future.deadline - start))
+        future.attempts.append((endpoint, attempt))
+        # the callback runs right away if the attempt is already done, it takes the lock again
+        attempt.add_done_callback(lambda done: self._completed(future, endpoint, done, start))
+
+    def _hedge(self, future):
+        with self.lock:
+            if future.done() or future.attempt_count >= self.max_attempts:
+                return
+            endpoint = self._pick(exclude=future.tried)
+            if endpoint is None or not self._has_time_for(endpoint, future):
+                return
+            endpoint.metrics.increment('hedges')
+            self._send(future, endpoint)
+
+    def _completed(self, future, endpoint, attempt, start):
+        error = attempt.exception() if not attempt.cancelled() else None
+        with self.lock:
+            endpoint.inflight -= 1
+            self.lock.notify()
+            if attempt.cancelled():
+                # cancelled because another attempt answered first, this says nothing about the endpoint
+                return
+            retryable = error is not None and isinstance(error, grpc.RpcError) and error.code() in RETRYABLE_CODES
+            # any error counts against the endpoint's health, only some are worth sending elsewhere
+            endpoint.record(self.clock() - start, error is not None, self.eject_after, self.eject_time)
+            future.attempts = [(other, other_attempt) for other, other_attempt in future.attempts
+                               if other_attempt is not attempt]
+            if future.done():
+                return
+            if error is None:
+                future._finish(attempt.result(), None)
+                return
+            if future.attempts:
+                # a hedge is still in flight and may answer
+                return
+            if retryable and future.attempt_count < self.max_attempts:
+                retry_endpoint = self._pick(exclude=future.tried) or self._pick()
+                if retry_endpoint is not None and self._has_time_for(retry_endpoint, future):
+                    logging.debug(f'retrying prediction on {retry_endpoint.address} after {endpoint.address} '
+                                  f'failed: {error.code()}')
+                    retry_endpoint.metrics.increment('retries')
+                    self._send(future, retry_endpoint)
+                    return
+            future._finish(None, error)
+
+    def summary(self):
+        """ a dict of {address: dict with the 'inflight' requests, whether it is 'ejected' and its 'latency'} """
+        now = self.clock()
+        with self.lock:
+            return {endpoint.address: {'inflight': endpoint.inflight, 'ejected': not endpoint.available(now),
+                                       'latency': endpoint.latency} for endpoint in self.endpoints}
+
+    def close(self):
+        if self.scheduler:
+            self.scheduler.close()
+        for endpoint in self.endpoints:
+            endpoint.close()
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import grpc
+import pytest
+
+import fake_services
+import serving_client
+
+
+@pytest.fixture
+def services():
+    started = []
+
+    def start(response=b'response', latency=0.0):
+        service = fake_services.FakePredictionService(response, latency)
+        started.append(service)
+        return service
+
+    yield start
+    for service in started:
+        service.close()
+
+
+def unused_address():
+    """ the address of a port nothing listens on """
+    service = fake_services.FakePredictionService(b'')
+    service.close()
+    return f'localhost:{service.port}'
+
+
+def address(service):
+    return f'localhost:{service.port}'
+
+
+def test_parse_endpoints():
+    assert serving_client.parse_endpoints('a:8500, b', default_port=9000) == ['a:8500', 'b:9000']
+    with pytest.raises(ValueError):
+        serving_client.parse_endpoints('a')
+    with pytest.raises(ValueError):
+        serving_client.parse_endpoints(' , ')
+
+
+def test_client_spreads_requests_over_endpoints(services):
+    first, second = services(latency=0.05), services(latency=0.05)
+    client = serving_client.BalancedClient([address(first), address(second)])
+    try:
+        futures = [client.Predict.future(b'request', 5) for _ in range(10)]
+        assert [future.result() for future in futures] == [b'response'] * 10
+    finally:
+        client.close()
+    assert first.requests == second.requests == 5
+    assert client.summary()[address(first)]['latency'] is not None
+
+
+def test_client_caps_requests_in_flight_per_endpoint(services):
+    lock = threading.Lock()
+    counts = {'inflight': 0, 'max': 0}
+
+    def respond(request):
+        with lock:
+            counts['inflight'] += 1
+            counts['max'] = max(counts['max'], counts['inflight'])
+        time.sleep(0.02)
+        with lock:
+            counts['inflight'] -= 1
+        return request
+
+    service = services(respond)
+    client = serving_client.BalancedClient([address(service)], max_inflight=2)
+    try:
+        futures = [client.Predict.future(bytes([index]), 5) for index in range(8)]
+        assert [future.result() for future in futures] == [bytes([index]) for index in range(8)]
+    finally:
+        client.close()
+    assert counts['max'] <= 2
+
+
+def test_client_retries_and_ejects_failing_endpoints(services):
+    service = services()
+    client = serving_client.BalancedClient([unused_address(), address(service)], eject_after=2, eject_time=60)
+    try:
+        for _ in range(4):
+            assert client.Predict(b'request', timeout=5) == b'response'
+        summary = client.summary()
+    finally:
+        client.close()
+    dead = [endpoint for endpoint in client.endpoints if endpoint.address != address(service)][0]
+    assert summary[dead.address]['ejected']
+    # once ejected, the dead endpoint gets no more requests
+    assert dead.metrics.counters['failures'] == 2
+    assert service.requests == 4
+
+
+def test_client_hedges_slow_requests(services):
+    slow, fast = services(b'slow', latency=2.0), services(b'fast')
+    client = serving_client.BalancedClient([address(slow), address(fast)], hedge_delay=0.05)
+    try:
+        # the slow endpoint has no requests in flight and is picked first
+        client.endpoints[1].inflight += 1
+        start = time.monotonic()
+        future = client.Predict.future(b'request', 5)
+        client.endpoints[1].inflight -= 1
+        assert future.result() == b'fast'
+        assert time.monotonic() - start < 1.0
+    finally:
+        client.close()
+    assert client.endpoints[1].metrics.counters['hedges'] == 1
+
+
+def test_client_fails_after_the_deadline(services):
+    service = services(latency=1.0)
+    client = serving_client.BalancedClient([address(service)])
+    try:
+        with pytest.raises(grpc.RpcError) as error:
+            client.Predict.future(b'request', 0.1).result()
+        assert error.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    finally:
+        client.close()
+
+
+def test_client_counts_every_error_against_the_endpoint(services):
+    def respond(request):
+        raise ValueError('bad request')
+
+    service = services(respond)
+    client = serving_client.BalancedClient([address(service)])
+    try:
+        with pytest.raises(grpc.RpcError) as error:
+            client.Predict(b'request', timeout=5)
+        assert error.value.code() not in serving_client.RETRYABLE_CODES
+    finally:
+        client.close()
+    # not retryable, so it was only sent once, but the endpoint's health and latency still reflect it
+    assert service.requests == 1
+    assert client.endpoints[0].metrics.counters['failures'] == 1
+    assert client.endpoints[0].latency is None
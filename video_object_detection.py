@@ -72,5 +72,67 @@ def load_frozen_model_into_memory(path_to_frozen_graph):
 
 
 def load_image_into_numpy_array(image):
-  (im_width, im_height) = image.size
-  return np.array(image.getdata()).reshape((im_height, im_width, 3)).astype(np.uint8)
+  """ returns a PIL image as a uint8 array of shape (height, width, 3), converted in one go rather than per pixel """
+  return np.asarray(image.convert('RGB'), dtype=np.uint8)
+
+
+class LocalDetector(object):
+  """
+  runs a detection graph in this process, keeping one session open for all frames
+  the input and output tensors are resolved once, when the detector is created
+  """
+  OUTPUT_KEYS = ['num_detections', 'detection_boxes', 'detection_scores', 'detection_classes']
+
+  def __init__(self, graph, config=None):
+    self.graph = graph
+    all_tensor_names = {output.name for op in graph.get_operations() for output in op.outputs}
+    self.tensor_dict = {key: graph.get_tensor_by_name(key + ':0')
+                        for key in self.OUTPUT_KEYS if key + ':0' in all_tensor_names}
+    self.image_tensor = graph.get_tensor_by_name('image_tensor:0')
+    self.session = tf.Session(graph=graph, config=config)
+
+  @classmethod
+  def from_frozen_model(cls, path_to_frozen_graph, config=None):
+    return cls(load_frozen_model_into_memory(path_to_frozen_graph), config)
+
+  def predict(self, frames):
+    """
+    run inference on a batch of frames of the same size
+
+    frames: a list of uint8 arrays of shape (height, width, 3)
+    returns a list with one output dict per frame, in the same format as run_inference_for_single_image()
+    """
+    output = self.session.run(self.tensor_dict, feed_dict={self.image_tensor: np.stack(frames)})
+    output_dicts = []
+    for i in range(len(frames)):
+      output_dict = {key: value[i] for key, value in output.items()}
+      # all outputs are float32 numpy arrays, so convert types as appropriate
+      if 'num_detections' in output_dict:
+        output_dict['num_detections'] = int(output_dict['num_detections'])
+      output_dict['detection_classes'] = output_dict['detection_classes'].astype(np.int64)
+      output_dicts.append(output_dict)
+    return output_dicts
+
+  def input_size(self):
+    """
+    returns the (height, width) the graph resizes frames to, e.g. (300, 300) for ssd models,
+    None if the graph takes frames of any size without resizing them to a fixed one
+    """
+    height, width = self.image_tensor.shape.as_list()[1:3]
+    if height and width:
+      return height, width
+    for op in self.graph.get_operations():
+      # the object detection api preprocessor's fixed shape resizer
+      if op.type == 'Const' and op.name.endswith('ResizeImage/size'):
+        height, width = tf.make_ndarray(op.get_attr('value'))
+        return int(height), int(width)
+    return None
+
+  def close(self):
+    self.session.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
@@ -0,0 +1,53 @@
+import numpy
+import tensorflow as tf
+from PIL import Image
+
+import video_object_detection as obj_detect
+
+
+def create_detection_graph():
+    """ a stand in for a detection model with the same input and output tensor names """
+    graph = tf.Graph()
+    with graph.as_default():
+        image_tensor = tf.placeholder(tf.uint8, shape=[None, None, None, 3], name='image_tensor')
+        # the mean pixel value of each image becomes the score of its only detection
+        mean = tf.reduce_mean(tf.cast(image_tensor, tf.float32), axis=[1, 2, 3]) / 255
+        batch_size = tf.shape(image_tensor)[0]
+        tf.identity(tf.expand_dims(mean, 1), name='detection_scores')
+        tf.ones([batch_size, 1], name='detection_classes')
+        tf.tile(tf.constant([[[0.1, 0.2, 0.3, 0.4]]]), [batch_size, 1, 1], name='detection_boxes')
+        tf.ones([batch_size], name='num_detections')
+    return graph
+
+
+def test_local_detector_batch():
+    frames = [numpy.full((4, 6, 3), 51, numpy.uint8), numpy.full((4, 6, 3), 204, numpy.uint8)]
+    with obj_detect.LocalDetector(create_detection_graph()) as detector:
+        output_dicts = detector.predict(frames)
+        # a second call reuses the session and tensors
+        assert len(detector.predict(frames[:1])) == 1
+    assert len(output_dicts) == 2
+    assert output_dicts[0]['detection_scores'][0] == numpy.float32(.2)
+    assert output_dicts[1]['detection_scores'][0] == numpy.float32(.8)
+    assert output_dicts[1]['num_detections'] == 1
+    assert output_dicts[1]['detection_classes'].dtype == numpy.int64
+    assert output_dicts[1]['detection_boxes'].shape == (1, 4)
+
+
+def test_local_detector_input_size():
+    graph = create_detection_graph()
+    with obj_detect.LocalDetector(graph) as detector:
+        assert detector.input_size() is None
+    with graph.as_default():
+        tf.constant([300, 300], name='Preprocessor/map/while/ResizeImage/size')
+    with obj_detect.LocalDetector(graph) as detector:
+        assert detector.input_size() == (300, 300)
+
+
+def test_load_image_into_numpy_array():
+    pixels = numpy.random.RandomState(1).randint(0, 256, size=(5, 7, 3)).astype(numpy.uint8)
+    image = obj_detect.load_image_into_numpy_array(Image.fromarray(pixels))
+    assert image.dtype == numpy.uint8
+    numpy.testing.assert_array_equal(image, pixels)
+    # grayscale images get 3 channels too
+    assert obj_detect.load_image_into_numpy_array(Image.fromarray(pixels[:, :, 0])).shape == (5, 7, 3)
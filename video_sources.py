@@ -0,0 +1,366 @@
+"""
+read and sample frames from a video source
+
+Sampling functions yield (frame_count, frame) tuples where frame_count is the frame's index in the source.
+Frames that are not sampled are either yielded with a frame of None, so that frames are still counted,
+or never decoded at all when the source allows it.
+
+A directory of images, or a glob pattern matching images, is read as a video whose frames are the images in name
+order, so frame counts and request ids are the same on every run. The sampled images are decoded by a pool of
+threads or processes while earlier ones are processed, up to a prefetch limit, see ImageReader.
+
+Live sources can be read with a LiveSource, which always hands out the newest frame and skips the ones detection
+had no time for, so a slow model delays detection by a bounded time instead of falling further behind.
+"""
+import collections
+import glob
+import logging
+import math
+import os
+import subprocess
+import threading
+import time
+from concurrent import futures
+
+import imageio
+import imageio_ffmpeg
+import numpy
+from PIL import Image
+
+import detect_video_stream_utils
+
+# frames this close to the start of a sampling interval, as a fraction of it, count as in it, so ffmpeg and
+# select_by_time() agree however the timestamps round
+TIME_EPSILON = 1e-6
+
+
+def sample_every(video_reader, sample_rate):
+    """
+    yield every frame whose index is a multiple of sample_rate, other frames are decoded then replaced by None
+
+    :param video_reader: an iterable of frames e.g. from imageio.get_reader()
+    :param sample_rate: e.g. 5 yields frames 0, 5, 10 ...
+    """
+    for frame_count, frame in enumerate(video_reader):
+        yield frame_count, frame if frame_count % sample_rate == 0 else None
+
+
+def sample_by_clock(video_reader, target_fps, clock=time.monotonic):
+    """
+    yield frames that arrive at least 1 / target_fps seconds after the last sampled frame, for live sources
+    other frames are replaced by None
+
+    :param video_reader: an iterable of frames e.g. from imageio.get_reader()
+    :param target_fps: the number of frames to sample per second
+    :param clock: returns the current time in seconds, useful for mocking
+    """
+    interval = 1.0 / target_fps
+    next_sample_time = None
+    for frame_count, frame in enumerate(video_reader):
+        now = clock()
+        if next_sample_time is None or now >= next_sample_time:
+            next_sample_time = now + interval
+            yield frame_count, frame
+        else:
+            yield frame_count, None
+
+
+def ffmpeg_sampling_params(sample_rate=None, target_fps=None):
+    """
+    ffmpeg output parameters that make ffmpeg drop frames before they are converted and passed to python
+
+    :param sample_rate: keep frames whose index is a multiple of this
+    :param target_fps: keep frames by presentation time at this rate instead, see select_by_time(), this takes
+        precedence over sample_rate
+    :return: a list of ffmpeg command line arguments
+    """
+    if target_fps:
+        # the same rule as select_by_time(), on the frames' own timestamps so variable frame rates are followed
+        expression = (f'isnan(prev_selected_t)+gt(floor((t-start_t)*{target_fps!r}+{TIME_EPSILON!r})\\,'
+                      f'floor((prev_selected_t-start_t)*{target_fps!r}+{TIME_EPSILON!r}))')
+    else:
+        expression = f'not(mod(n\\,{sample_rate}))'
+    # the comma in the expression is escaped since commas separate filters, passthrough stops ffmpeg from
+    # duplicating frames to fill the gaps left by the select filter, so the frames are the original ones
+    return ['-vf', f'select={expression}', '-fps_mode', 'passthrough']
+
+
+def probe_frame_times(path):
+    """
+    returns the presentation times in seconds of the frames of a file's first video stream, in presentation order
+
+    the packets are listed without decoding them, see ffmpeg's framemd5 format
+    """
+    result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-loglevel', 'error', '-i', path, '-map', '0:v:0',
+                             '-c', 'copy', '-f', 'framemd5', '-'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f'could not probe {path}: {result.stderr.decode(errors="replace").strip()}')
+    time_base = None
+    pts = []
+    for line in result.stdout.decode().splitlines():
+        if line.startswith('#tb 0:'):
+            numerator, denominator = line.split(':')[1].split('/')
+            time_base = int(numerator) / int(denominator)
+        elif line and not line.startswith('#'):
+            # stream, dts, pts, duration, size, hash
+            pts.append(int(line.split(',')[2]))
+    if time_base is None:
+        raise RuntimeError(f'{path} has no video stream')
+    return [value * time_base for value in sorted(pts)]
+
+
+def select_by_time(frame_times, target_fps):
+    """
+    returns the indices of the frames that start each 1 / target_fps seconds of video: the first frame at or after
+    the start of each interval, counted from the first frame, as ffmpeg_sampling_params() does
+
+    :param frame_times: the frames' presentation times in seconds, see probe_frame_times()
+    """
+    selected = []
+    last_interval = None
+    for frame_count, frame_time in enumerate(frame_times):
+        interval = math.floor((frame_time - frame_times[0]) * target_fps + TIME_EPSILON)
+        if last_interval is None or interval > last_interval:
+            selected.append(frame_count)
+            last_interval = interval
+    return selected
+
+
+def read_sampled_file(video_reader, sample_rate=None, frame_counts=None):
+    """
+    yield the frames of a reader opened with ffmpeg_sampling_params(), with the frame's index in the source file
+
+    :param video_reader: a reader from imageio.get_reader(path, 'ffmpeg', output_params=ffmpeg_sampling_params(...))
+    :param sample_rate: the value used to create the reader's output params
+    :param frame_counts: the indices of the frames the reader returns when it samples by time, see select_by_time()
+    """
+    if frame_counts is not None:
+        yield from zip(frame_counts, video_reader)
+    else:
+        for sample_count, frame in enumerate(video_reader):
+            yield sample_count * sample_rate, frame
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+DECODE_WORKERS = 4
+# decoded images waiting to be processed, per decode worker
+PREFETCH = 4
+
+
+def list_images(source):
+    """
+    returns the sorted paths of the images in a directory or matching a glob pattern,
+    an empty list if source is neither
+    """
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    elif glob.has_magic(source):
+        paths = glob.glob(source)
+    else:
+        return []
+    return sorted(path for path in paths if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS)
+
+
+def decode_image(path):
+    """ returns the image at path as a uint8 array of shape (height, width, 3) """
+    with Image.open(path) as image:
+        return numpy.asarray(image.convert('RGB'))
+
+
+class ImageReader(object):
+    """
+    reads a list of images as the frames of a video, decoding them in a pool of threads or processes
+
+    iterating yields a frame for each image, sample() only decodes the sampled ones
+    """
+
+    def __init__(self, paths, workers=DECODE_WORKERS, prefetch=None, processes=False, decode=decode_image):
+        """
+        :param paths: the image paths in frame order, see list_images()
+        :param workers: how many images are decoded at a time
+        :param prefetch: the most decoded images waiting to be processed, workers * PREFETCH by default
+        :param processes: decode in processes instead of threads, for formats whose decoders hold the GIL
+        :param decode: takes a path and returns a frame, must be picklable when processes is set
+        """
+        if not paths:
+            raise ValueError('there are no images to read')
+        self.paths = paths
+        self.workers = workers
+        self.prefetch = max(1, prefetch or workers * PREFETCH)
+        self.processes = processes
+        self.decode = decode
+
+    def get_meta_data(self):
+        """ the size of the first image as (width, height), like imageio's readers report it """
+        with Image.open(self.paths[0]) as image:
+            return {'size': image.size, 'nframes': len(self.paths)}
+
+    def sample(self, sample_rate=1):
+        """ yield (frame_count, frame) tuples like sample_every(), images that are not sampled are never decoded """
+        pool_type = futures.ProcessPoolExecutor if self.processes else futures.ThreadPoolExecutor
+        with pool_type(max_workers=self.workers) as pool:
+            # images are submitted in order and taken in the same order, however long each one takes to decode
+            pending = collections.deque()
+            decoding = 0
+            for frame_count, path in enumerate(self.paths):
+                sampled = frame_count % sample_rate == 0
+                pending.append((frame_count, pool.submit(self.decode, path) if sampled else None))
+                decoding += sampled
+                # unsampled frames cost nothing to hold, only the images being decoded count towards prefetch
+                while pending and (pending[0][1] is None or decoding > self.prefetch):
+                    frame_count, future = pending.popleft()
+                    decoding -= future is not None
+                    yield frame_count, future.result() if future else None
+            while pending:
+                frame_count, future = pending.popleft()
+                yield frame_count, future.result() if future else None
+
+    def __iter__(self):
+        return (frame for _, frame in self.sample())
+
+    def __len__(self):
+        return len(self.paths)
+
+
+# seconds from capturing a frame to handling its prediction that live sources aim to stay under
+TARGET_LATENCY = 0.5
+# the longest live sources wait between frames, however slow detection is
+MAX_INTERVAL = 2.0
+# how the interval between frames changes after a frame over the target latency, and one well under it
+INTERVAL_INCREASE = 1.5
+INTERVAL_DECREASE = 0.9
+# the smallest interval an increase starts from
+INTERVAL_STEP = 0.01
+
+
+class LiveSource(object):
+    """
+    reads a live source in a capture thread that keeps only the newest frame
+
+    frames() hands out the newest frame, leaving at least interval seconds between frames. The interval adapts to
+    the latency of the frames, from capture until completed() is called for them: it grows while frames take longer
+    than target_latency and shrinks once they take well under it, so frames do not pile up in the pipeline's queues.
+    """
+
+    def __init__(self, video_reader, target_latency=TARGET_LATENCY, min_interval=0.0, max_interval=MAX_INTERVAL,
+                 stats=None, clock=time.monotonic):
+        """
+        :param video_reader: an iterable of frames e.g. from imageio.get_reader()
+        :param target_latency: seconds from capture to completion to stay under
+        :param min_interval: the shortest seconds between frames e.g. 1 / target_fps
+        :param max_interval: the longest seconds between frames
+        :param stats: an optional collections.Counter updated with the 'dropped' frames, captured but never handed out
+        :param clock: returns the current time in seconds, useful for mocking
+        """
+        self.video_reader = video_reader
+        self.target_latency = target_latency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.stats = stats if stats is not None else collections.Counter()
+        self.clock = clock
+        self.condition = threading.Condition()
+        # (frame_count, frame, capture time) of the newest frame, None once it is handed out
+        self.latest = None
+        self.finished = False
+        self.error = None
+        # frame_count: capture time, of the frames handed out and not completed yet, in frame order
+        self.capture_times = collections.OrderedDict()
+        self.thread = threading.Thread(target=self._capture, name='capture', daemon=True)
+
+    def _capture(self):
+        try:
+            for frame_count, frame in enumerate(self.video_reader):
+                with self.condition:
+                    if self.latest is not None:
+                        self.stats['dropped'] += 1
+                    self.latest = (frame_count, frame, self.clock())
+                    self.condition.notify()
+        except Exception as e:
+            logging.exception('capturing frames failed')
+            self.error = e
+        finally:
+            with self.condition:
+                self.finished = True
+                self.condition.notify()
+
+    def frames(self):
+        """ yield (frame_count, frame) tuples of the newest frames until the source ends """
+        if self.thread.ident is None:
+            self.thread.start()
+        next_frame_time = self.clock()
+        while True:
+            wait = next_frame_time - self.clock()
+            if wait > 0:
+                time.sleep(wait)
+            with self.condition:
+                while self.latest is None and not self.finished:
+                    self.condition.wait()
+                if self.latest is None:
+                    break
+                frame_count, frame, capture_time = self.latest
+                self.latest = None
+                self.capture_times[frame_count] = capture_time
+                next_frame_time = self.clock() + self.interval
+            yield frame_count, frame
+        if self.error is not None:
+            raise self.error
+
+    def completed(self, frame_count):
+        """
+        adapt the interval to the latency of a frame that was handed out, once it has been handled
+
+        returns the seconds since the frame was captured
+        """
+        with self.condition:
+            # frames are completed in order, earlier ones that are left were never handled e.g. static frames
+            while self.capture_times and next(iter(self.capture_times)) < frame_count:
+                self.capture_times.popitem(last=False)
+            latency = self.clock() - self.capture_times.pop(frame_count)
+            if latency > self.target_latency:
+                self.interval = min(self.max_interval, max(self.interval * INTERVAL_INCREASE, INTERVAL_STEP))
+            elif latency < self.target_latency / 2:
+                self.interval = max(self.min_interval, self.interval * INTERVAL_DECREASE)
+        return latency
+
+
+def determine_sampled_frames(args, sample_rate, target_fps=None, video_reader=imageio.get_reader):
+    """
+    open the source in args and pick how to sample its frames
+
+    file sources are read through ffmpeg with a frame selection filter so unsampled frames never reach python,
+    other sources are sampled here, by frame index or by time when target_fps is set
+
+    parameters:
+        args: a namespace object from argparse.ArgumentParser.parse_args(), see detect_video_stream_utils.determine_source()
+        sample_rate: sample frames whose index is a multiple of this
+        target_fps: if set, sample this many frames per second of video instead
+        video_reader: the class/function to use to read video from file or camera, useful for mocking
+
+    returns a tuple of (the reader, an iterable of (frame_count, frame) tuples)
+    """
+    paths = list_images(args.source)
+    if paths:
+        # images have no timestamps, so they are always sampled by index
+        reader = ImageReader(
+            paths,
+            workers=int(detect_video_stream_utils.determine_input_arg(args.decode_workers, DECODE_WORKERS)),
+            prefetch=int(args.prefetch) if args.prefetch else None,
+            processes=args.decode_processes)
+        return reader, reader.sample(sample_rate)
+    if args.source != '-' and not args.source.isnumeric() and os.path.exists(args.source):
+        try:
+            frame_counts = None
+            if target_fps:
+                # probed once, ffmpeg then selects the same frames by their timestamps
+                frame_counts = select_by_time(probe_frame_times(args.source), target_fps)
+            reader = video_reader(args.source, 'ffmpeg', output_params=ffmpeg_sampling_params(sample_rate, target_fps))
+            return reader, read_sampled_file(reader, sample_rate, frame_counts)
+        except (ValueError, RuntimeError, IndexError) as e:
+            # e.g. an image format ffmpeg does not read, fall back to the default plugin
+            logging.debug(f'could not open {args.source} with ffmpeg, sampling every decoded frame instead: {e}')
+    reader = detect_video_stream_utils.determine_source(args, video_reader)
+    if target_fps:
+        return reader, sample_by_clock(reader, target_fps)
+    return reader, sample_every(reader, sample_rate)
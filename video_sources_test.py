@@ -0,0 +1,217 @@
+import collections
+import time
+import unittest.mock as mock
+
+import imageio
+import numpy
+import pytest
+
+import video_sources
+
+
+def test_sample_every():
+    assert list(video_sources.sample_every(['a', 'b', 'c', 'd', 'e'], 2)) == \
+        [(0, 'a'), (1, None), (2, 'c'), (3, None), (4, 'e')]
+
+
+def test_sample_by_clock():
+    # a frame arrives every 0.1 seconds
+    times = iter([0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6])
+    frames = video_sources.sample_by_clock(range(7), 4, clock=lambda: next(times))
+    assert [frame_count for frame_count, frame in frames if frame is not None] == [0, 3, 6]
+
+
+def test_ffmpeg_sampling_params():
+    assert video_sources.ffmpeg_sampling_params(sample_rate=5) == \
+        ['-vf', 'select=not(mod(n\\,5))', '-fps_mode', 'passthrough']
+    assert video_sources.ffmpeg_sampling_params(sample_rate=5, target_fps=2) == \
+        ['-vf', 'select=isnan(prev_selected_t)+gt(floor((t-start_t)*2+1e-06)\\,floor((prev_selected_t-start_t)*2+1e-06))',
+         '-fps_mode', 'passthrough']
+    assert video_sources.select_by_time([0, .1, .2, .3, .4, .5, .6, .7, .8, .9], 4) == [0, 3, 5, 8]
+
+
+def test_determine_sampled_frames_uses_ffmpeg_for_files(tmp_path):
+    path = str(tmp_path / 'video.avi')
+    open(path, 'w').close()
+    args = mock.Mock()
+    args.source = path
+    reader = mock.MagicMock()
+    reader.__iter__.return_value = iter(['a', 'b'])
+    video_reader = mock.Mock(return_value=reader)
+    _, frames = video_sources.determine_sampled_frames(args, 10, video_reader=video_reader)
+    video_reader.assert_called_with(path, 'ffmpeg', output_params=video_sources.ffmpeg_sampling_params(10))
+    assert list(frames) == [(0, 'a'), (10, 'b')]
+
+
+def test_determine_sampled_frames_webcam():
+    args = mock.Mock()
+    args.source = '2'
+    video_reader = mock.Mock(return_value=['a', 'b', 'c'])
+    _, frames = video_sources.determine_sampled_frames(args, 2, video_reader=video_reader)
+    video_reader.assert_called_with('2')
+    assert list(frames) == [(0, 'a'), (1, None), (2, 'c')]
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    """ a 3 second video at 10 frames per second where each frame is a shade brighter than the previous one """
+    path = str(tmp_path / 'video.mp4')
+    with imageio.get_writer(path, fps=10, macro_block_size=1) as writer:
+        for i in range(30):
+            writer.append_data(numpy.full((32, 48, 3), i * 8, numpy.uint8))
+    return path
+
+
+def test_determine_sampled_frames_skips_decoding(video_file):
+    args = mock.Mock()
+    args.source = video_file
+    _, frames = video_sources.determine_sampled_frames(args, 5)
+    frames = list(frames)
+    assert [frame_count for frame_count, _ in frames] == [0, 5, 10, 15, 20, 25]
+    # the frames are the ones at those positions in the file
+    for frame_count, frame in frames:
+        assert frame.mean() == pytest.approx(frame_count * 8, abs=4)
+
+
+def test_determine_sampled_frames_target_fps(video_file):
+    args = mock.Mock()
+    args.source = video_file
+    _, frames = video_sources.determine_sampled_frames(args, 5, target_fps=2)
+    frames = list(frames)
+    assert [frame_count for frame_count, _ in frames] == [0, 5, 10, 15, 20, 25]
+    for frame_count, frame in frames:
+        assert frame.mean() == pytest.approx(frame_count * 8, abs=4)
+    # a frame rate that is not a divisor of the file's
+    _, frames = video_sources.determine_sampled_frames(args, 5, target_fps=4)
+    frames = list(frames)
+    assert [frame_count for frame_count, _ in frames] == [0, 3, 5, 8, 10, 13, 15, 18, 20, 23, 25, 28]
+    for frame_count, frame in frames:
+        assert frame.mean() == pytest.approx(frame_count * 8, abs=4)
+
+
+@pytest.fixture
+def variable_frame_rate_file(tmp_path):
+    """ a second at 10 frames per second then a second at 30, each frame a shade brighter than the previous one """
+    path = str(tmp_path / 'video.mp4')
+    # timestamps in 30ths of a second, 3 apart for the first 10 frames and 1 apart after them
+    with imageio.get_writer(path, fps=30, macro_block_size=1,
+                            output_params=['-vf', 'setpts=if(lt(N\\,10)\\,N*3\\,N+20)/30/TB',
+                                           '-fps_mode', 'passthrough']) as writer:
+        for i in range(40):
+            writer.append_data(numpy.full((32, 48, 3), i * 6, numpy.uint8))
+    return path
+
+
+def test_determine_sampled_frames_target_fps_follows_variable_frame_rates(variable_frame_rate_file):
+    args = mock.Mock()
+    args.source = variable_frame_rate_file
+    _, frames = video_sources.determine_sampled_frames(args, 5, target_fps=5)
+    frames = list(frames)
+    # every other frame of the first second, every 6th of the second, 5 frames per second throughout
+    assert [frame_count for frame_count, _ in frames] == [0, 2, 4, 6, 8, 10, 16, 22, 28, 34]
+    for frame_count, frame in frames:
+        assert frame.mean() == pytest.approx(frame_count * 6, abs=4)
+
+
+def write_images(directory, count):
+    """ write images whose pixels are their index, in an order that differs from their names """
+    for index in reversed(range(count)):
+        imageio.imwrite(str(directory / f'{index:03d}.png'), numpy.full((4, 6, 3), index, dtype=numpy.uint8))
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_image_reader_decodes_sampled_images_in_order(tmp_path, processes):
+    write_images(tmp_path, 10)
+    (tmp_path / 'notes.txt').write_text('not an image')
+    reader = video_sources.ImageReader(video_sources.list_images(str(tmp_path)), workers=3, prefetch=2,
+                                       processes=processes)
+    assert reader.get_meta_data()['size'] == (6, 4)
+    frames = list(reader.sample(3))
+    assert [frame_count for frame_count, _ in frames] == list(range(10))
+    assert [frame_count for frame_count, frame in frames if frame is not None] == [0, 3, 6, 9]
+    for frame_count, frame in frames:
+        if frame is not None:
+            assert frame.dtype == numpy.uint8
+            assert frame.shape == (4, 6, 3)
+            assert frame[0, 0, 0] == frame_count
+
+
+def test_image_reader_only_decodes_sampled_images(tmp_path):
+    write_images(tmp_path, 6)
+    decoded = []
+
+    def decode(path):
+        decoded.append(path)
+        return video_sources.decode_image(path)
+
+    reader = video_sources.ImageReader(video_sources.list_images(str(tmp_path)), workers=1, decode=decode)
+    assert len(list(reader.sample(2))) == 6
+    assert [path[-7:-4] for path in decoded] == ['000', '002', '004']
+
+
+def test_determine_sampled_frames_reads_glob_patterns(tmp_path):
+    write_images(tmp_path, 4)
+    args = mock.Mock()
+    args.source = str(tmp_path / '00[0-2].png')
+    args.decode_workers = None
+    args.prefetch = None
+    args.decode_processes = False
+    reader, frames = video_sources.determine_sampled_frames(args, 1)
+    assert len(reader) == 3
+    assert [frame[0, 0, 0] for _, frame in frames] == [0, 1, 2]
+
+
+class SlowCamera(object):
+    """ yields a frame every interval seconds, the frame is its index """
+
+    def __init__(self, count, interval):
+        self.count = count
+        self.interval = interval
+
+    def __iter__(self):
+        for frame_count in range(self.count):
+            time.sleep(self.interval)
+            yield frame_count
+
+
+def test_live_source_hands_out_the_newest_frame():
+    stats = collections.Counter()
+    live = video_sources.LiveSource(SlowCamera(20, 0.005), stats=stats)
+    taken = []
+    for frame_count, frame in live.frames():
+        assert frame == frame_count
+        taken.append(frame_count)
+        # detection is slower than the camera
+        time.sleep(0.02)
+        live.completed(frame_count)
+    assert taken == sorted(taken)
+    assert taken[-1] == 19
+    assert len(taken) < 20
+    assert stats['dropped'] == 20 - len(taken)
+
+
+def test_live_source_adapts_interval_to_latency():
+    now = [0.0]
+    live = video_sources.LiveSource(SlowCamera(3, 0), target_latency=0.5, clock=lambda: now[0])
+    live.capture_times.update({1: 0.0, 2: 0.0, 3: 0.0, 4: 0.0})
+    now[0] = 1.0
+    live.completed(1)
+    assert live.interval == video_sources.INTERVAL_STEP
+    live.completed(2)
+    assert live.interval == video_sources.INTERVAL_STEP * video_sources.INTERVAL_INCREASE
+    # frame 3 was never handled e.g. a motion gate skipped it
+    now[0] = 0.1
+    live.completed(4)
+    assert live.interval < video_sources.INTERVAL_STEP * video_sources.INTERVAL_INCREASE
+    assert not live.capture_times
+
+
+def test_live_source_raises_capture_errors():
+    def broken_camera():
+        yield 'frame'
+        raise IOError('camera disconnected')
+
+    live = video_sources.LiveSource(broken_camera())
+    with pytest.raises(IOError):
+        for frame_count, _ in live.frames():
+            live.completed(frame_count)